@@ -4,9 +4,13 @@ using Npgsql;
 using System;
 using System.Diagnostics;
 using System.IO;
+using System.Net.Sockets;
 using System.Text;
+using System.Text.Json;
+using System.Threading;
 using System.Threading.Tasks;
 using System.Windows;
+using System.Windows.Threading;
 
 namespace DocxParser
 {
@@ -19,10 +23,26 @@ namespace DocxParser
         private const string User = "postgres";
         private const string Password = "test1";
 
+        // Адрес локального сервиса импорта (ingest_service.py)
+        private const string ServiceHost = "127.0.0.1";
+        private const int ServicePort = 8765;
+        private const int ServiceStartTimeoutMs = 30000;
+
+        // Процесс сервиса, если его запустило приложение
+        private Process? _serviceProcess;
+
+        // Последнее событие задания: пишется потоком чтения, читается таймером интерфейса
+        private ImportEvent? _latestEvent;
+        private readonly DispatcherTimer _progressTimer;
+
         public MainWindow()
         {
             InitializeComponent();
             StatusText.Text = "Выберите файл спецификации (.docx) для импорта в PostgreSQL";
+
+            _progressTimer = new DispatcherTimer { Interval = TimeSpan.FromMilliseconds(200) };
+            _progressTimer.Tick += (sender, e) => ShowProgress(Volatile.Read(ref _latestEvent));
+            Closed += (sender, e) => StopService();
         }
 
         private void BrowseButton_Click(object sender, RoutedEventArgs e)
@@ -50,22 +70,26 @@ namespace DocxParser
             }
 
             string docxPath = FilePathTextBox.Text;
-            
+
             StatusText.Text = "Импорт данных начат...";
+            ImportProgressBar.Value = 0;
             ProcessButton.IsEnabled = false;
-            
+            Volatile.Write(ref _latestEvent, null);
+            _progressTimer.Start();
+
             try
             {
-                // Передаем фиксированные параметры в фоновый поток
-                await Task.Run(() => ProcessWithPython(
-                    docxPath, 
-                    Host, 
-                    Port, 
-                    Database, 
-                    User, 
-                    Password));
-                    
-                StatusText.Text = "Данные успешно импортированы в PostgreSQL!";
+                // Чтение событий идёт в фоновом потоке, интерфейс обновляется по таймеру
+                ImportEvent result = await Task.Run(() => ImportWithService(docxPath));
+                ShowProgress(result);
+
+                if (result.Event == "failed")
+                    throw new Exception(result.Error);
+                if (result.DocType == null)
+                    throw new Exception("Не удалось определить тип документа (КЖ, СО или ВР)");
+
+                StatusText.Text = $"Данные успешно импортированы в PostgreSQL! " +
+                                  $"{result.DocType}: записано {result.Records} за {result.Elapsed:F1} с";
             }
             catch (Exception ex)
             {
@@ -75,18 +99,82 @@ namespace DocxParser
             }
             finally
             {
+                _progressTimer.Stop();
                 ProcessButton.IsEnabled = true;
             }
         }
 
-        private void ProcessWithPython(
-            string docxPath, 
-            string host, 
-            string port, 
-            string database, 
-            string user, 
-            string password)
+        private ImportEvent ImportWithService(string docxPath)
+        {
+            using (TcpClient client = ConnectToService())
+            using (NetworkStream stream = client.GetStream())
+            using (var reader = new StreamReader(stream, new UTF8Encoding(false)))
+            using (var writer = new StreamWriter(stream, new UTF8Encoding(false)))
+            {
+                // Одна строка JSON - одно задание; сервис отвечает строками JSON с событиями
+                writer.Write(JsonSerializer.Serialize(new { file = docxPath }) + "\n");
+                writer.Flush();
+                client.Client.Shutdown(SocketShutdown.Send);
+
+                // Без таймаута: большой документ обрабатывается до конца
+                string? line;
+                while ((line = reader.ReadLine()) != null)
+                {
+                    ImportEvent importEvent = ImportEvent.Parse(line);
+                    Volatile.Write(ref _latestEvent, importEvent);
+
+                    if (importEvent.Event == "error")
+                        throw new Exception(importEvent.Error);
+                    if (importEvent.Event == "done" || importEvent.Event == "failed")
+                        return importEvent;
+                }
+            }
+
+            throw new Exception("Сервис импорта закрыл соединение до завершения задания");
+        }
+
+        private TcpClient ConnectToService()
         {
+            TcpClient? client = TryConnect();
+            if (client != null)
+                return client;
+
+            StartService();
+            var stopwatch = Stopwatch.StartNew();
+            while (stopwatch.ElapsedMilliseconds < ServiceStartTimeoutMs)
+            {
+                if (_serviceProcess!.HasExited)
+                    throw new Exception($"Сервис импорта завершился с кодом {_serviceProcess.ExitCode}");
+
+                Thread.Sleep(250);
+                client = TryConnect();
+                if (client != null)
+                    return client;
+            }
+
+            throw new TimeoutException("Сервис импорта не запустился");
+        }
+
+        private static TcpClient? TryConnect()
+        {
+            var client = new TcpClient();
+            try
+            {
+                client.Connect(ServiceHost, ServicePort);
+                return client;
+            }
+            catch (SocketException)
+            {
+                client.Dispose();
+                return null;
+            }
+        }
+
+        private void StartService()
+        {
+            if (_serviceProcess != null && !_serviceProcess.HasExited)
+                return;
+
             // Найдем python.exe
             string pythonExe = FindPythonExe();
             if (pythonExe == null)
@@ -95,73 +183,79 @@ namespace DocxParser
             }
 
             // Путь к скрипту в директории приложения
-            string scriptPath = Path.Combine(AppDomain.CurrentDomain.BaseDirectory, "spec_parser.py");
-            
+            string scriptPath = Path.Combine(AppDomain.CurrentDomain.BaseDirectory, "ingest_service.py");
+
             if (!File.Exists(scriptPath))
             {
                 throw new FileNotFoundException($"Python-скрипт не найден: {scriptPath}");
             }
 
-            // Формируем аргументы для Python
-            string arguments = $"\"{scriptPath}\" \"{docxPath}\" " +
-                              $"\"{host}\" " +
-                              $"\"{port}\" " +
-                              $"\"{database}\" " +
-                              $"\"{user}\" " +
-                              $"\"{password}\"";
-            
             var processInfo = new ProcessStartInfo
             {
                 FileName = pythonExe,
-                Arguments = arguments,
-                RedirectStandardOutput = true,
-                RedirectStandardError = true,
+                Arguments = $"\"{scriptPath}\" --port {ServicePort}",
                 UseShellExecute = false,
                 CreateNoWindow = true,
                 WindowStyle = ProcessWindowStyle.Hidden,
-                StandardOutputEncoding = Encoding.UTF8,
-                StandardErrorEncoding = Encoding.UTF8
+                WorkingDirectory = AppDomain.CurrentDomain.BaseDirectory
             };
 
-            using (var process = new Process { StartInfo = processInfo })
-            {
-                StringBuilder outputBuilder = new StringBuilder();
-                StringBuilder errorBuilder = new StringBuilder();
+            // Параметры подключения передаются через переменные окружения (db_config.py)
+            processInfo.Environment["PGHOST"] = Host;
+            processInfo.Environment["PGPORT"] = Port;
+            processInfo.Environment["PGDATABASE"] = Database;
+            processInfo.Environment["PGUSER"] = User;
+            processInfo.Environment["PGPASSWORD"] = Password;
 
-                process.OutputDataReceived += (sender, e) => 
-                {
-                    if (!string.IsNullOrEmpty(e.Data)) 
-                    {
-                        outputBuilder.AppendLine(e.Data);
-                        Dispatcher.Invoke(() => StatusText.Text += $"\n{e.Data}");
-                    }
-                };
-                
-                process.ErrorDataReceived += (sender, e) => 
-                {
-                    if (!string.IsNullOrEmpty(e.Data)) 
-                    {
-                        errorBuilder.AppendLine(e.Data);
-                        Dispatcher.Invoke(() => StatusText.Text += $"\nОШИБКА: {e.Data}");
-                    }
-                };
+            _serviceProcess = Process.Start(processInfo);
+        }
 
-                process.Start();
-                
-                // Начинаем асинхронное чтение вывода
-                process.BeginOutputReadLine();
-                process.BeginErrorReadLine();
-                
-                process.WaitForExit(120000); // Таймаут 120 секунд
+        private void StopService()
+        {
+            if (_serviceProcess == null)
+                return;
 
-                if (process.ExitCode != 0)
-                {
-                    string errorDetails = errorBuilder.ToString();
-                    if (string.IsNullOrEmpty(errorDetails))
-                        errorDetails = outputBuilder.ToString();
-                    
-                    throw new Exception($"Ошибка выполнения скрипта (код {process.ExitCode}):\n{errorDetails}");
-                }
+            try
+            {
+                if (!_serviceProcess.HasExited)
+                    _serviceProcess.Kill(entireProcessTree: true);
+            }
+            catch (Exception)
+            {
+                // Процесс уже завершился
+            }
+            _serviceProcess.Dispose();
+            _serviceProcess = null;
+        }
+
+        private void ShowProgress(ImportEvent? importEvent)
+        {
+            if (importEvent == null)
+                return;
+
+            switch (importEvent.Event)
+            {
+                case "queued":
+                    StatusText.Text = $"Задание в очереди (позиция {importEvent.Position})";
+                    break;
+                case "started":
+                    StatusText.Text = "Разбор документа...";
+                    break;
+                case "parsing":
+                    StatusText.Text = $"Разбор документа: таблиц {importEvent.Tables}, строк {importEvent.RowsParsed}";
+                    break;
+                case "parsed":
+                    StatusText.Text = $"Документ разобран: строк {importEvent.RowsParsed}";
+                    break;
+                case "writing":
+                    if (importEvent.RowsTotal > 0)
+                        ImportProgressBar.Value = 100.0 * importEvent.RowsWritten / importEvent.RowsTotal;
+                    StatusText.Text = $"Запись в PostgreSQL: {importEvent.RowsWritten} из {importEvent.RowsTotal} строк " +
+                                      $"({importEvent.RowsPerSec:F0} строк/с, {importEvent.Elapsed:F1} с)";
+                    break;
+                case "done":
+                    ImportProgressBar.Value = 100;
+                    break;
             }
         }
 
@@ -179,13 +273,13 @@ namespace DocxParser
                 @"C:\Program Files\Python312\python.exe",
                 @"C:\Users\" + Environment.UserName + @"\AppData\Local\Programs\Python\Python312\python.exe"
             };
-            
+
             foreach (var path in possiblePaths)
             {
                 if (File.Exists(path)) 
                     return path;
             }
-            
+
             // Проверим переменную PATH
             var pathDirs = Environment.GetEnvironmentVariable("PATH")?.Split(';') ?? Array.Empty<string>();
             foreach (var dir in pathDirs)
@@ -201,8 +295,60 @@ namespace DocxParser
                     // Пропустим невалидные пути
                 }
             }
-            
+
             return null;
         }
     }
+
+    // Событие задания импорта (строка JSON от ingest_service.py)
+    public class ImportEvent
+    {
+        public string Event { get; private set; } = "";
+        public string? DocType { get; private set; }
+        public string? Error { get; private set; }
+        public long Position { get; private set; }
+        public long Tables { get; private set; }
+        public long RowsParsed { get; private set; }
+        public long RowsWritten { get; private set; }
+        public long RowsTotal { get; private set; }
+        public long Records { get; private set; }
+        public double RowsPerSec { get; private set; }
+        public double Elapsed { get; private set; }
+
+        public static ImportEvent Parse(string line)
+        {
+            using (JsonDocument document = JsonDocument.Parse(line))
+            {
+                JsonElement root = document.RootElement;
+                return new ImportEvent
+                {
+                    Event = GetString(root, "event") ?? "",
+                    DocType = GetString(root, "doc_type"),
+                    Error = GetString(root, "error"),
+                    Position = (long)GetNumber(root, "position"),
+                    Tables = (long)GetNumber(root, "tables"),
+                    RowsParsed = (long)GetNumber(root, "rows_parsed"),
+                    RowsWritten = (long)GetNumber(root, "rows_written"),
+                    RowsTotal = (long)GetNumber(root, "rows_total"),
+                    Records = (long)GetNumber(root, "records"),
+                    RowsPerSec = GetNumber(root, "rows_per_sec"),
+                    Elapsed = GetNumber(root, "elapsed")
+                };
+            }
+        }
+
+        private static string? GetString(JsonElement root, string name)
+        {
+            return root.TryGetProperty(name, out JsonElement value) && value.ValueKind == JsonValueKind.String
+                ? value.GetString()
+                : null;
+        }
+
+        private static double GetNumber(JsonElement root, string name)
+        {
+            return root.TryGetProperty(name, out JsonElement value) && value.ValueKind == JsonValueKind.Number
+                ? value.GetDouble()
+                : 0;
+        }
+    }
 }
\ No newline at end of file
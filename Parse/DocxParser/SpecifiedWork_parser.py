@@ -1,14 +1,17 @@
 # SpecifiedWork_parser.py
-from docx import Document
 import os
 import re
 import sys
 import traceback
-import psycopg2
 import uuid
 import logging
-import pandas as pd
-import numpy as np
+from db_config import load_db_params
+from docx_tables import iter_tables, open_archive, source_name
+from text_normalize import normalize_cell_text, parse_float
+from column_merge import collapse_columns
+from columnar_export import ColumnarExport
+from parse_options import DEFAULT_OPTIONS
+from metrics import DocumentMetrics
 
 # Настройка логирования
 logging.basicConfig(
@@ -20,170 +23,216 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def parse_docx_to_specified_work(docx_path, db_params, project_document_id, document_section_id):
-    """Основная функция для обработки DOCX файла и записи в таблицу SpecifiedWork"""
-    try:
-        conn = psycopg2.connect(**db_params)
-        cursor = conn.cursor()
-        logger.info("Успешное подключение к базе данных PostgreSQL!")
-    except Exception as e:
-        logger.error(f"Ошибка подключения к PostgreSQL: {str(e)}")
-        raise
+# Столбцы таблицы SpecifiedWork в порядке записи
+SPECIFIED_WORK_COLUMNS = [
+    "ID_work",
+    "ID_project_document",
+    "ID_document_section",
+    "Work_identification",
+    "Name_work",
+    "Units1",
+    "Units2",
+    "Quantity1",
+    "Quantity2",
+    "Note"
+]
+# Естественный ключ для режима upsert
+SPECIFIED_WORK_NATURAL_KEY = ["ID_project_document", "Work_identification"]
+
+# Ожидаемая структура: [№ п/п, Наименование, Ед. изм., Кол-во, Примечание]
+EXPECTED_COLUMNS = ['Work_identification', 'Name_work', 'Units', 'Quantity', 'Note']
+WORK_IDENTIFICATION_RE = re.compile(r'^\d+\.\d+(\.\d+)*$')
+
+def split_work_fields(row):
+    """
+    Раскладывает строку по ожидаемым столбцам. Недостающие поля пустые,
+    лишние столбцы добавляются к примечанию.
+    """
+    fields = (row + [''] * len(EXPECTED_COLUMNS))[:len(EXPECTED_COLUMNS)]
+    for extra in row[len(EXPECTED_COLUMNS):]:
+        fields[4] = fields[4] + ' ' + extra
+    return fields
+
+def work_skip_reason(idx, work_identification):
+    """Причина пропуска строки ведомости (заголовок или строка без номера работы) или None"""
+    if idx < 2:
+        return "header"
+    if not WORK_IDENTIFICATION_RE.match(work_identification):
+        return "no_identification"
+    return None
+
+def map_work_row(idx, row, project_document_id, document_section_id):
+    """
+    Формирует строку таблицы SpecifiedWork (SPECIFIED_WORK_COLUMNS).
+    Возвращает None для заголовков и разделителей.
+    """
+    work_identification, name_work, units, quantity, note = split_work_fields(row)
+
+    # Пропускаем заголовки и разделители
+    if work_skip_reason(idx, work_identification) is not None:
+        return None
+    
+    # Обработка единиц измерения (может быть составной, например "м/шт")
+    units_parts = units.split('/')
+    units1 = units_parts[0].strip() if units_parts and units_parts[0].strip() else None
+    units2 = units_parts[1].strip() if len(units_parts) > 1 and units_parts[1].strip() else None
+    
+    # Обработка количества (может быть составным, например "1482/494")
+    quantity_parts = quantity.split('/')
+    first = quantity_parts[0].strip()
+    second = quantity_parts[1].strip() if len(quantity_parts) > 1 else ''
+    quantity1 = parse_float(first) if first else None
+    quantity2 = None
+
+    # Если первая часть не число, вторая не разбирается
+    if first and quantity1 is None:
+        logger.warning(f"Не удалось преобразовать количество: {quantity}")
+    elif second:
+        quantity2 = parse_float(second)
+        if quantity2 is None:
+            logger.warning(f"Не удалось преобразовать количество: {quantity}")
     
+    # Генерируем UUID для работы
+    work_id = str(uuid.uuid4())
+    
+    # Строка для записи в SpecifiedWork
+    return (
+        work_id,
+        project_document_id,
+        document_section_id,
+        work_identification,
+        name_work,
+        units1,
+        units2,
+        quantity1,
+        quantity2,
+        note
+    )
+
+def iter_work_rows(data, project_document_id, document_section_id, metrics=None):
+    """
+    Выдаёт строки для записи в SpecifiedWork из таблицы ведомости работ.
+    В metrics (DocumentMetrics) учитываются таблица, её строки, время
+    схлопывания столбцов и сопоставления и причины пропуска строк.
+    """
+    if metrics is None:
+        metrics = DocumentMetrics()
+    metrics.count("tables")
+    metrics.count("rows_read", len(data))
+    with metrics.stage("collapse"):
+        rows = collapse_columns(data)
+
+    for idx, row in enumerate(rows):
+        with metrics.stage("map"):
+            reason = work_skip_reason(idx, row[0] if row else '')
+            if reason is None:
+                work = map_work_row(idx, row, project_document_id, document_section_id)
+                metrics.count("rows_mapped")
+            else:
+                metrics.skip(reason)
+        if reason is None:
+            yield work
+
+def extract_work_rows(docx_path, project_document_id, document_section_id, progress=None):
+    """
+    Разбирает ведомость работ без записи в базу.
+    Возвращает строки в виде {(таблица, столбцы): [строки, ...]}.
+    progress(количество таблиц, количество строк) вызывается после каждой таблицы.
+    """
+    rows = []
+    for table_idx, data in enumerate(iter_tables(docx_path, normalize=normalize_cell_text)):
+        rows.extend(iter_work_rows(data, project_document_id, document_section_id))
+        if progress:
+            progress(table_idx + 1, len(rows))
+    return {("SpecifiedWork", tuple(SPECIFIED_WORK_COLUMNS)): rows} if rows else {}
+
+def parse_docx_to_specified_work(docx_path, db_params, project_document_id, document_section_id,
+                                 collected=None, upsert=False, options=DEFAULT_OPTIONS):
+    """
+    Основная функция для обработки DOCX файла и записи в таблицу SpecifiedWork.
+    docx_path - путь к файлу или открытый zipfile.ZipFile, options (ParseOptions) -
+    подключение или приёмник, выгрузка и замеры. Изменения фиксируются после
+    каждой таблицы; в collected (если передан) добавляются зафиксированные строки,
+    в режиме upsert строки пишутся по SPECIFIED_WORK_NATURAL_KEY.
+    """
+    metrics = options.metrics
+    if metrics is None:
+        metrics = DocumentMetrics(source_name(docx_path), "ВР")
+    batch_size = options.batch_size
     try:
-        doc = Document(docx_path)
-        logger.info(f"Файл {docx_path} успешно открыт")
+        with metrics.stage("open"):
+            docx_zip = open_archive(docx_path)
+        metrics.measure_document(docx_zip)
+        logger.info(f"Файл {source_name(docx_path)} успешно открыт")
     except Exception as e:
-        conn.close()
         logger.error(f"Ошибка открытия DOCX файла: {str(e)}")
         raise
 
-    # Создаем список всех таблиц в виде DataFrame
-    tables = []
-    for table in doc.tables:
-        data = []
-        for row in table.rows:
-            current_row = []
-            for cell in row.cells:
-                text = cell.text.strip()
-                text = re.sub(r'\s+', ' ', text)
-                text = text.replace(" ,", ",")
-                current_row.append(text)
-            data.append(current_row)
-        df_table = pd.DataFrame(data)
-        tables.append(df_table)
-
-    total_inserted = 0
-
-    # Обрабатываем каждую таблицу
-    for table_idx, df in enumerate(tables):
-        logger.info(f"Обработка таблицы {table_idx+1}")
-        
-        # Функция для вычисления схожести столбцов
-        def calculate_similarity(col1, col2):
-            mask = (~df[col1].isna()) & (~df[col2].isna())
-            if mask.sum() == 0:
-                return 0
-            matches = (df.loc[mask, col1] == df.loc[mask, col2]).sum()
-            total = mask.sum()
-            return (matches / total) * 100
-
-        # Находим группы схожих столбцов
-        groups = []
-        current_group = [df.columns[0]]
-        for i in range(1, len(df.columns)):
-            similarity = calculate_similarity(df.columns[i-1], df.columns[i])
-            if similarity > 80:
-                current_group.append(df.columns[i])
-            else:
-                groups.append(current_group)
-                current_group = [df.columns[i]]
-        groups.append(current_group)
-
-        # Формируем очищенный DataFrame
-        columns_to_keep = []
-        for group in groups:
-            columns_to_keep.append(group[0])
-        df_cleaned = df[columns_to_keep].copy()
-
-        # Заменяем NaN на пустые строки
-        df_cleaned = df_cleaned.fillna('')
-        
-        # Переименовываем столбцы в соответствии с ожидаемой структурой
-        # Предполагаем, что структура: [№ п/п, Наименование, Ед. изм., Кол-во, Примечание]
-        expected_columns = ['Work_identification', 'Name_work', 'Units', 'Quantity', 'Note']
-        for i, col in enumerate(df_cleaned.columns):
-            if i < len(expected_columns):
-                df_cleaned = df_cleaned.rename(columns={col: expected_columns[i]})
-            else:
-                # Если столбцов больше, чем ожидалось, добавляем к примечанию
-                df_cleaned[expected_columns[4]] = df_cleaned[expected_columns[4]] + ' ' + df_cleaned[col]
-        
-        # Оставляем только нужные столбцы (обрезаем до 5)
-        df_cleaned = df_cleaned[expected_columns[:min(len(df_cleaned.columns), 5)]]
-
-        try:
-            inserted_count = 0
-            for idx, row in df_cleaned.iterrows():
-                # Пропускаем заголовки и разделители
-                if idx < 2 or not re.match(r'^\d+\.\d+(\.\d+)*$', str(row.get('Work_identification', ''))):
-                    continue
-                
-                # Извлекаем данные из строки
-                work_identification = row.get('Work_identification', '')
-                name_work = row.get('Name_work', '')
-                units = row.get('Units', '')
-                quantity = row.get('Quantity', '')
-                note = row.get('Note', '')
-                
-                # Обработка единиц измерения (может быть составной, например "м/шт")
-                units_parts = str(units).split('/')
-                units1 = units_parts[0].strip() if units_parts and units_parts[0].strip() else None
-                units2 = units_parts[1].strip() if len(units_parts) > 1 and units_parts[1].strip() else None
-                
-                # Обработка количества (может быть составным, например "1482/494")
-                quantity_parts = str(quantity).split('/')
-                quantity1 = None
-                quantity2 = None
-                
+    try:
+        if options.export_dir:
+            with ColumnarExport(options.export_dir, docx_path, options.export_format,
+                                batch_size) as export:
+                for data in metrics.timed("read", iter_tables(docx_zip, normalize=normalize_cell_text)):
+                    for row in iter_work_rows(data, project_document_id, document_section_id, metrics):
+                        with metrics.stage("write"):
+                            export.add("SpecifiedWork", SPECIFIED_WORK_COLUMNS, row)
+            metrics.count("rows_written", export.count)
+            logger.info(f"Выгрузка завершена. Выгружено записей: {export.count}")
+            metrics.log(logger)
+            return export.count
+
+        with options.session(db_params) as sink:
+            sink = metrics.sink(sink)
+            total_inserted = 0
+            failed_tables = []
+            writer = sink.writer("SpecifiedWork", SPECIFIED_WORK_COLUMNS, batch_size,
+                                 SPECIFIED_WORK_NATURAL_KEY if upsert else None)
+
+            # Таблицы читаются из word/document.xml по одной: в памяти держится
+            # только текущая таблица, а её строки уходят в базу пачками
+            tables = metrics.timed("read", iter_tables(docx_zip, normalize=normalize_cell_text))
+            for table_idx, data in enumerate(tables):
+                logger.info(f"Обработка таблицы {table_idx+1}")
+
                 try:
-                    if quantity_parts and quantity_parts[0].strip():
-                        quantity1 = float(quantity_parts[0].replace(',', '.').strip())
-                    if len(quantity_parts) > 1 and quantity_parts[1].strip():
-                        quantity2 = float(quantity_parts[1].replace(',', '.').strip())
-                except ValueError:
-                    logger.warning(f"Не удалось преобразовать количество: {quantity}")
-                
-                # Генерируем UUID для работы
-                work_id = str(uuid.uuid4())
-                
-                # Формируем запрос
-                insert_query = '''
-                INSERT INTO "SpecifiedWork" (
-                    "ID_work",
-                    "ID_project_document",
-                    "ID_document_section",
-                    "Work_identification",
-                    "Name_work",
-                    "Units1",
-                    "Units2",
-                    "Quantity1",
-                    "Quantity2",
-                    "Note"
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                '''
-                
-                # Параметры для запроса
-                data = (
-                    work_id,
-                    project_document_id,
-                    document_section_id,
-                    work_identification,
-                    name_work,
-                    units1,
-                    units2,
-                    quantity1,
-                    quantity2,
-                    note
-                )
-                
-                # Выполняем запрос
-                cursor.execute(insert_query, data)
-                inserted_count += 1
+                    inserted_count = 0
+                    table_rows = []
+                    for work in iter_work_rows(data, project_document_id, document_section_id, metrics):
+                        # Добавляем строку в пакет
+                        inserted_count += writer.add(work)
+                        if collected is not None:
+                            table_rows.append(work)
             
-            # Фиксируем изменения для таблицы
-            conn.commit()
-            total_inserted += inserted_count
-            logger.info(f"Таблица {table_idx+1}: добавлено {inserted_count} записей")
+                    # Отправляем остаток пакета и фиксируем изменения для таблицы
+                    inserted_count += writer.flush()
+                    sink.commit()
+                    total_inserted += inserted_count
+                    if collected is not None and table_rows:
+                        collected.setdefault(("SpecifiedWork", tuple(SPECIFIED_WORK_COLUMNS)), []).extend(table_rows)
+                    logger.info(f"Таблица {table_idx+1}: добавлено {inserted_count} записей")
             
-        except Exception as e:
-            logger.error(f"Ошибка при обработке таблицы {table_idx+1}: {str(e)}")
-            conn.rollback()
-            traceback.print_exc()
-                
-    cursor.close()
-    conn.close()
+                except Exception as e:
+                    logger.error(f"Ошибка при обработке таблицы {table_idx+1}: {str(e)}")
+                    writer.discard()
+                    sink.rollback()
+                    traceback.print_exc()
+                    failed_tables.append(table_idx + 1)
+
+            # Остальные таблицы зафиксированы, но документ записан не целиком:
+            # вызывающий код не должен считать его обработанным (например, кэшировать)
+            if failed_tables:
+                raise RuntimeError(f"не записаны таблицы {', '.join(map(str, failed_tables))}, "
+                                   f"остальные зафиксированы ({total_inserted} записей)")
+    except Exception as e:
+        metrics.error = str(e)
+        metrics.log(logger)
+        raise
+    finally:
+        if docx_zip is not docx_path:
+            docx_zip.close()
+
     logger.info(f"Обработка завершена. Всего добавлено записей: {total_inserted}")
+    metrics.log(logger)
     return total_inserted
 
 if __name__ == "__main__":
@@ -195,13 +244,7 @@ if __name__ == "__main__":
         project_document_id = sys.argv[2]
         document_section_id = sys.argv[3]
     
-    db_params = {
-        "host": "localhost",
-        "port": "5432",
-        "database": "cable_db",
-        "user": "postgres",
-        "password": "test1"
-    }
+    db_params = load_db_params()
     
     logger.info(f"Начата обработка файла: {docx_file_path}")
     
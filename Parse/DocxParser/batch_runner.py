@@ -0,0 +1,366 @@
+import os
+import uuid
+import logging
+import multiprocessing.util
+from concurrent.futures import ProcessPoolExecutor
+
+from find_files import find_files_in_directory
+from db_config import load_db_params
+from sinks import sink_session
+from parse_options import DEFAULT_OPTIONS, ParseOptions
+from metrics import DocumentMetrics
+from cable_parser import parse_cable_journal_docx
+from spec_parser import parse_docx_to_postgres
+from SpecifiedWork_parser import parse_docx_to_specified_work
+from document_diff import (diff_document, document_column_index, document_id, NATURAL_KEYS,
+                           PLAIN_DOCUMENT_IDS)
+
+# Параметры подключения: db_config.json / DOCX_PARSER_DB_CONFIG и переменные PG*
+DB_PARAMS = load_db_params()
+
+logger = logging.getLogger(__name__)
+
+def run_document(doc_type, file_path, db_params, collected=None, upsert=False, diff=False,
+                 options=DEFAULT_OPTIONS):
+    """
+    Запускает парсер, соответствующий типу документа, в текущем процессе.
+    В режимах upsert и diff строки КЖ и ВР ссылаются на документ по его обозначению
+    (document_id), при выгрузке - если оно найдено, чтобы режим записи можно было
+    выбрать при загрузке; при обычной записи - PLAIN_DOCUMENT_IDS.
+    options (ParseOptions) - подключение или приёмник, выгрузка и замеры.
+    В режиме diff к базе применяются только изменения документа (нужен PostgreSQL:
+    подключение берётся из options или у приёмника).
+    Возвращает количество добавленных (в режимах upsert и diff - изменённых,
+    при выгрузке - выгруженных) записей.
+    """
+    project_document_id = None
+    if upsert or diff or options.export_dir:
+        project_document_id = document_id(doc_type, file_path, required=upsert or diff)
+    if diff:
+        conn = options.sink.conn if options.sink is not None else options.conn
+        summary = diff_document(doc_type, file_path, conn, project_document_id,
+                                collected=collected)
+        return sum(changes.inserted + changes.updated + changes.deleted
+                   for changes in summary.values())
+    if doc_type == "КЖ":
+        return parse_cable_journal_docx(file_path, db_params, project_document_id, collected,
+                                        upsert, options)
+    elif doc_type == "СО":
+        return parse_docx_to_postgres(file_path, db_params, collected, upsert, options)
+    elif doc_type == "ВР":
+        return parse_docx_to_specified_work(file_path, db_params, project_document_id or "", "",
+                                            collected, upsert, options)
+    raise ValueError(f"Неизвестный тип документа: {doc_type}")
+
+def replay_rows(sink, batches, upsert=False, project_document_id=None):
+    """
+    Записывает в приёмник строки документа из кэша {(таблица, столбцы): [строки, ...]}
+    одной транзакцией. Без upsert строки получают новые идентификаторы, как при
+    разборе, - иначе повтор в базу, где они уже есть, нарушил бы первичный ключ.
+    Ссылка на документ (DOCUMENT_COLUMNS) ставится по режиму записи, а не по тому,
+    в каком режиме документ разбирался: при upsert - project_document_id,
+    иначе - PLAIN_DOCUMENT_IDS.
+    Возвращает количество записей.
+    """
+    total = 0
+    for (table, columns), rows in batches.items():
+        writer = sink.writer(table, columns, key_columns=NATURAL_KEYS[table] if upsert else None)
+        document_index = document_column_index(table, columns)
+        document_value = project_document_id if upsert else PLAIN_DOCUMENT_IDS.get(table)
+        for row in rows:
+            if not upsert:
+                row = (str(uuid.uuid4()),) + tuple(row[1:])
+            if document_index is not None:
+                row = row[:document_index] + (document_value,) + tuple(row[document_index + 1:])
+            total += writer.add(row)
+        total += writer.flush()
+    sink.commit()
+    return total
+
+def split_cached(documents, cache):
+    """
+    Делит документы на неизменённые, результаты которых есть в кэше,
+    и те, что нужно разобрать.
+    Возвращает ([(тип, путь, строки, записан ли в текущий приёмник), ...], [(тип, путь), ...]).
+    """
+    if cache is None:
+        return [], list(documents)
+
+    cached, pending = [], []
+    for doc_type, file_path in documents:
+        batches = cache.rows(file_path)
+        if batches is None:
+            pending.append((doc_type, file_path))
+        else:
+            cached.append((doc_type, file_path, batches, cache.written(file_path)))
+    return cached, pending
+
+def needs_writing(cached, replay):
+    """Нужно ли что-то записывать из кэша (иначе документы только пропускаются)"""
+    return any(replay or not written for _, _, _, written in cached)
+
+def process_cached(cached, sink, replay, upsert=False, cache=None):
+    """
+    Пропускает неизменённые документы, уже записанные в текущий приёмник,
+    а если replay или документ в этот приёмник ещё не записывался - записывает
+    его строки из кэша без разбора.
+    Возвращает список путей файлов, запись которых завершилась ошибкой.
+    """
+    failed = []
+    for doc_type, file_path, batches, written in cached:
+        if written and not replay:
+            print(f"{doc_type}: {file_path} не изменился, пропускаем")
+            continue
+        try:
+            project_document_id = document_id(doc_type, file_path, required=True) if upsert else None
+            record_count = replay_rows(sink, batches, upsert, project_document_id)
+            if cache is not None:
+                cache.mark_written(file_path)
+            print(f"{doc_type}: {file_path} - записей из кэша: {record_count}")
+        except Exception as e:
+            print(f"Ошибка при записи файла {file_path} из кэша: {e}")
+            sink.rollback()
+            failed.append(file_path)
+    return failed
+
+def process_documents(documents, db_params, sink, cache=None, upsert=False, diff=False,
+                      archives=None, report=None):
+    """
+    Обрабатывает документы [(тип, путь), ...] через общий приёмник sink
+    (sinks.PostgresSink с одним подключением, SQLite или NDJSON).
+    Если передан кэш, разобранные строки каждого документа сохраняются в него.
+    Архивы из archives (уже открытые при определении типа) передаются
+    парсерам вместо путей и закрываются после обработки.
+    Если передан отчёт report (metrics.MetricsReport), в него добавляются
+    замеры каждого документа.
+    Возвращает список путей файлов, обработка которых завершилась ошибкой.
+    """
+    failed = []
+    for doc_type, file_path in documents:
+        collected = {} if cache is not None else None
+        source = archives.pop(file_path, file_path) if archives else file_path
+        metrics = DocumentMetrics(file_path, doc_type)
+        try:
+            run_document(doc_type, source, db_params, collected, upsert, diff,
+                         ParseOptions(sink=sink, metrics=metrics))
+            if cache is not None:
+                cache.store_rows(file_path, doc_type, collected)
+        except Exception as e:
+            print(f"Ошибка при обработке файла {file_path}: {e}")
+            metrics.error = str(e)
+            # Сбрасываем прерванную транзакцию, чтобы следующий документ
+            # мог использовать то же подключение
+            sink.rollback()
+            failed.append(file_path)
+        finally:
+            if source is not file_path:
+                source.close()
+            if report is not None and not diff:
+                report.add(metrics.summary())
+    return failed
+
+def collect_documents(folders, cache=None, archives=None):
+    """
+    Ищет документы КЖ/СО/ВР во всех папках "Книга".
+    Возвращает список пар (тип документа, путь к файлу) в порядке обхода.
+    """
+    documents = []
+    for folder_path in folders:
+        folder_name = os.path.basename(folder_path.rstrip('/\\'))
+        found_files = find_files_in_directory(folder_path, cache, archives)
+        print(f"Найдены файлы в папке {folder_name}: {found_files}")
+        documents.extend(found_files.items())
+    return documents
+
+def run_batch(folders, db_params, cache=None, replay=False, upsert=False, diff=False,
+              sink=None, report=None):
+    """
+    Обрабатывает папки "Книга" в одном процессе: парсеры импортируются один раз,
+    а все документы пишутся через одно подключение к PostgreSQL.
+    С кэшем результатов неизменённые документы пропускаются
+    (или при replay записываются из кэша без разбора). В режиме upsert
+    строки пишутся по естественным ключам (см. NATURAL_KEYS), в режиме diff
+    для каждого документа применяются только изменения.
+    Папки обрабатываются по очереди, и документ, тип которого определялся
+    по содержимому, разбирается из уже открытого архива.
+    Если передан приёмник sink (см. sinks), строки пишутся в него вместо PostgreSQL.
+    В отчёт report (metrics.MetricsReport), если он передан, собираются замеры документов.
+    Возвращает список путей файлов, обработка которых завершилась ошибкой.
+    """
+    failed = []
+    with sink_session(db_params, sink=sink) as sink:
+        for folder_path in folders:
+            archives = {}
+            try:
+                cached, documents = split_cached(collect_documents([folder_path], cache, archives),
+                                                 cache)
+                failed.extend(process_cached(cached, sink, replay, upsert, cache))
+                failed.extend(process_documents(documents, db_params, sink, cache, upsert, diff,
+                                                archives, report))
+            finally:
+                # Архивы документов, взятых из кэша, парсерам не понадобились
+                for docx_zip in archives.values():
+                    docx_zip.close()
+    return failed
+
+def run_documents(documents, db_params, cache=None, replay=False, upsert=False, diff=False,
+                  sink=None, report=None):
+    """
+    Обрабатывает уже выбранные документы [(тип, путь), ...] в одном процессе,
+    как run_batch, но без выбора документов в папках: в папке может быть
+    несколько документов одного типа (например, изменившиеся файлы из watch_folder).
+    Возвращает список путей файлов, обработка которых завершилась ошибкой.
+    """
+    with sink_session(db_params, sink=sink) as sink:
+        cached, pending = split_cached(documents, cache)
+        failed = process_cached(cached, sink, replay, upsert, cache)
+        failed.extend(process_documents(pending, db_params, sink, cache, upsert, diff,
+                                        report=report))
+    return failed
+
+# Подключение рабочего процесса пула, создаётся один раз на процесс
+_worker_conn = None
+
+def _init_worker(db_params):
+    """Открывает подключение к PostgreSQL в рабочем процессе пула"""
+    import psycopg2
+
+    global _worker_conn
+    _worker_conn = psycopg2.connect(**db_params)
+    # Закрываем подключение при завершении рабочего процесса
+    multiprocessing.util.Finalize(None, _worker_conn.close, exitpriority=10)
+
+def _run_in_worker(doc_type, file_path, db_params, collect=False, upsert=False, diff=False):
+    """
+    Обрабатывает один документ в рабочем процессе пула.
+    Возвращает (количество записей, текст ошибки или None,
+    записанные строки или None, если collect не задан,
+    замеры документа или None в режиме diff).
+    """
+    collected = {} if collect else None
+    metrics = DocumentMetrics(file_path, doc_type)
+    try:
+        record_count = run_document(doc_type, file_path, db_params, collected, upsert, diff,
+                                    ParseOptions(conn=_worker_conn, metrics=metrics))
+        return record_count, None, collected, None if diff else metrics.summary()
+    except Exception as e:
+        _worker_conn.rollback()
+        metrics.error = str(e)
+        return 0, str(e), None, None if diff else metrics.summary()
+
+def run_parallel(folders, db_params, jobs, cache=None, replay=False, upsert=False,
+                 diff=False, report=None):
+    """
+    Распределяет документы папок "Книга" по пулу из jobs процессов.
+    У каждого рабочего процесса своё подключение к БД, результаты выводятся
+    в порядке обхода документов. Кэш результатов используется только
+    в основном процессе: рабочие процессы возвращают разобранные строки
+    и замеры, которые собираются в отчёт report (если передан).
+    Возвращает список путей файлов, обработка которых завершилась ошибкой.
+    """
+    cached, documents = split_cached(collect_documents(folders, cache), cache)
+    total = len(documents)
+    failed = []
+
+    if cached:
+        # Строки из кэша записываются основным процессом
+        if needs_writing(cached, replay):
+            with sink_session(db_params) as sink:
+                failed.extend(process_cached(cached, sink, replay, upsert, cache))
+        else:
+            process_cached(cached, None, replay)
+
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                             initargs=(db_params,)) as executor:
+        futures = [executor.submit(_run_in_worker, doc_type, file_path, db_params,
+                                   cache is not None, upsert, diff)
+                   for doc_type, file_path in documents]
+
+        for idx, ((doc_type, file_path), future) in enumerate(zip(documents, futures), 1):
+            try:
+                record_count, error, collected, summary = future.result()
+            except Exception as e:
+                # Рабочий процесс упал целиком (например, не удалось подключиться к БД)
+                record_count, error, collected, summary = 0, str(e), None, None
+
+            if report is not None:
+                report.add(summary)
+            if collected is not None:
+                cache.store_rows(file_path, doc_type, collected)
+
+            if error:
+                print(f"[{idx}/{total}] Ошибка при обработке файла {file_path}: {error}")
+                failed.append(file_path)
+            else:
+                print(f"[{idx}/{total}] {doc_type}: {file_path} - добавлено записей: {record_count}")
+
+    return failed
+
+def _export_in_worker(doc_type, file_path, export_dir, export_format):
+    """
+    Выгружает один документ в рабочем процессе пула.
+    Возвращает (количество строк, текст ошибки или None, замеры документа).
+    """
+    metrics = DocumentMetrics(file_path, doc_type)
+    try:
+        record_count = run_document(doc_type, file_path, None, options=ParseOptions(
+            export_dir=export_dir, export_format=export_format, metrics=metrics))
+        return record_count, None, metrics.summary()
+    except Exception as e:
+        metrics.error = str(e)
+        return 0, str(e), metrics.summary()
+
+def run_export(folders, export_dir, export_format="parquet", jobs=1, report=None):
+    """
+    Разбирает документы папок "Книга" без подключения к базе: строки выгружаются
+    в export_dir (см. columnar_export) и загружаются отдельно columnar_loader.py.
+    При jobs > 1 документы разбираются пулом процессов - рабочим процессам
+    не нужно подключение к БД, поэтому разбор масштабируется независимо от загрузки.
+    В отчёт report (metrics.MetricsReport), если он передан, собираются замеры документов.
+    Возвращает список путей файлов, разбор которых завершился ошибкой.
+    """
+    failed = []
+    if jobs > 1:
+        documents = collect_documents(folders)
+        total = len(documents)
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(_export_in_worker, doc_type, file_path, export_dir,
+                                       export_format)
+                       for doc_type, file_path in documents]
+            for idx, ((doc_type, file_path), future) in enumerate(zip(documents, futures), 1):
+                try:
+                    record_count, error, summary = future.result()
+                except Exception as e:
+                    record_count, error, summary = 0, str(e), None
+                if report is not None:
+                    report.add(summary)
+                if error:
+                    print(f"[{idx}/{total}] Ошибка при разборе файла {file_path}: {error}")
+                    failed.append(file_path)
+                else:
+                    print(f"[{idx}/{total}] {doc_type}: {file_path} - выгружено записей: {record_count}")
+        return failed
+
+    for folder_path in folders:
+        archives = {}
+        try:
+            for doc_type, file_path in collect_documents([folder_path], archives=archives):
+                source = archives.pop(file_path, file_path)
+                metrics = DocumentMetrics(file_path, doc_type)
+                try:
+                    record_count = run_document(doc_type, source, None, options=ParseOptions(
+                        export_dir=export_dir, export_format=export_format, metrics=metrics))
+                    print(f"{doc_type}: {file_path} - выгружено записей: {record_count}")
+                except Exception as e:
+                    print(f"Ошибка при разборе файла {file_path}: {e}")
+                    metrics.error = str(e)
+                    failed.append(file_path)
+                finally:
+                    if source is not file_path:
+                        source.close()
+                    if report is not None:
+                        report.add(metrics.summary())
+        finally:
+            for docx_zip in archives.values():
+                docx_zip.close()
+    return failed
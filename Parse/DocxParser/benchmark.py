@@ -0,0 +1,301 @@
+import io
+import os
+import re
+import sys
+import copy
+import json
+import time
+import zipfile
+import argparse
+import platform
+import statistics
+from datetime import datetime
+
+from lxml import etree
+
+from docx_tables import W_BODY, W_TBL, W_TR, iter_tables, main_document_part
+import text_normalize
+from text_normalize import normalize_cell_text
+from bulk_writer import BulkWriter, copy_payload
+from metrics import DocumentMetrics
+from find_files import detect_doc_type
+import cable_parser
+import spec_parser
+import SpecifiedWork_parser
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Документы, которые поставляются вместе с репозиторием
+SAMPLE_DOCUMENTS = [
+    '14_ДСиР-2022-864-Р-8.1.2-КЖ.docx',
+    '15_ДСиР-2022-864-Р-8.1.2-СО.docx',
+    '27_ДСиР-2022-864-Р-8.1.1_СО.docx',
+    'files/26_ДСиР-2022-864-Р-8.1.1-КЖ.docx',
+    'files/27_ДСиР-2022-864-Р-8.1.1_СО.docx',
+    'files/28_ДСиР-2022-864-Р-8.1.1_ВР.docx',
+    'files/29_ДСиР-2022-864-Р-8.1.1-СВР.docx',
+    'files/30_ДСиР-2022-864-Р-8.1.1-СВОРиС.docx',
+]
+
+# Этапы замера: open - открытие архива, read/collapse/map - этапы рабочих парсеров
+# (см. metrics.STAGES), write - запись сопоставленных строк
+STAGES = ['open', 'read', 'collapse', 'map', 'write']
+
+def scale_document(path, factor, header_rows=2):
+    """
+    Синтетически увеличивает документ: в каждой таблице тела word/document.xml
+    строки после заголовка повторяются factor раз. Возвращает содержимое DOCX
+    (bytes), поэтому с коэффициентом растёт и чтение XML, а не только разбор строк.
+    """
+    with zipfile.ZipFile(path, 'r') as source:
+        part = main_document_part(source)
+        root = etree.fromstring(source.read(part))
+        body = root.find(W_BODY)
+        if factor > 1 and body is not None:
+            for table in body.findall(W_TBL):
+                rows = table.findall(W_TR)[header_rows:]
+                for _ in range(factor - 1):
+                    table.extend(copy.deepcopy(row) for row in rows)
+
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as target:
+            for info in source.infolist():
+                if info.filename == part:
+                    target.writestr(info, etree.tostring(root, xml_declaration=True,
+                                                         encoding='UTF-8', standalone=True))
+                else:
+                    target.writestr(info, source.read(info))
+    return buffer.getvalue()
+
+def _iter_records(doc_type, docx_zip, metrics):
+    """
+    Строки документа из рабочих итераторов парсеров: ((таблица, столбцы), строка).
+    Время чтения, схлопывания и сопоставления учитывается в metrics.
+    """
+    if doc_type == "КЖ":
+        for table_type, row in cable_parser.iter_cable_journal(docx_zip, None, metrics=metrics):
+            columns = cable_parser.CABLE_TYPE1_COLUMNS if table_type == 1 else cable_parser.CABLE_TYPE2_COLUMNS
+            yield ("Cable", tuple(columns)), row
+        return
+
+    tables = metrics.timed("read", iter_tables(docx_zip, normalize=normalize_cell_text))
+    for data in tables:
+        if doc_type == "СО":
+            key = ("Equipment", tuple(spec_parser.EQUIPMENT_COLUMNS))
+            rows = spec_parser.iter_equipment_rows(data, metrics)
+        elif doc_type == "ВР":
+            key = ("SpecifiedWork", tuple(SpecifiedWork_parser.SPECIFIED_WORK_COLUMNS))
+            rows = SpecifiedWork_parser.iter_work_rows(data, "", "", metrics)
+        else:
+            continue
+        for row in rows:
+            yield key, row
+
+def _write(batches, conn):
+    """
+    Запись: без подключения только формируется поток COPY (no-op приёмник),
+    с подключением строки отправляются в базу и транзакция откатывается
+    """
+    written = 0
+    for (table, columns), records in batches.items():
+        if not records:
+            continue
+        if conn is None:
+            copy_payload(records)
+        else:
+            writer = BulkWriter(conn, table, columns)
+            for record in records:
+                writer.add(record)
+            writer.flush()
+        written += len(records)
+    if conn is not None:
+        conn.rollback()
+    return written
+
+def run_once(document, doc_type, conn=None):
+    """Один прогон документа (содержимое DOCX) с замером времени каждого этапа"""
+    metrics = DocumentMetrics(doc_type=doc_type)
+
+    with metrics.stage("open"):
+        docx_zip = zipfile.ZipFile(io.BytesIO(document), 'r')
+        main_document_part(docx_zip)
+
+    batches = {}
+    try:
+        for key, row in _iter_records(doc_type, docx_zip, metrics):
+            batches.setdefault(key, []).append(row)
+    finally:
+        docx_zip.close()
+
+    with metrics.stage("write"):
+        records = _write(batches, conn)
+
+    timings = {stage: metrics.stages[stage] for stage in STAGES}
+    counts = {'tables': metrics.counters['tables'], 'rows': metrics.counters['rows_read'],
+              'records': records}
+    return timings, counts
+
+# Прежняя обработка текста ячеек (до text_normalize): эталон для --normalize
+LEGACY_WHITESPACE_RE = re.compile(r'\s+')
+
+def legacy_clean_cell_text(text):
+    return LEGACY_WHITESPACE_RE.sub(' ', text.strip())
+
+def legacy_normalize_cell_text(text):
+    return legacy_clean_cell_text(text).replace(" ,", ",")
+
+def legacy_extract_length(text):
+    if not text:
+        return None
+    cleaned = text.replace(' ', '').replace(',', '.')
+    match = re.search(r'(\d+\.?\d*)', cleaned)
+    if match:
+        try:
+            return float(match.group(1))
+        except ValueError:
+            return None
+    return None
+
+def legacy_parse_float(text):
+    try:
+        return float(text.replace(',', '.'))
+    except ValueError:
+        return None
+
+# Ядра нормализации: (имя, прежняя функция, новая функция, вход - 'raw' или 'normalized')
+NORMALIZATION_KERNELS = [
+    ('clean_cell_text', legacy_clean_cell_text, text_normalize.clean_cell_text, 'raw'),
+    ('normalize_cell_text', legacy_normalize_cell_text, text_normalize.normalize_cell_text, 'raw'),
+    ('extract_length', legacy_extract_length, text_normalize.extract_length, 'normalized'),
+    ('parse_float', legacy_parse_float, text_normalize.parse_float, 'normalized'),
+]
+
+def benchmark_normalization(files, scale, repeat):
+    """
+    Сравнивает прежнюю и общую (text_normalize) обработку текста ячеек
+    на всех ячейках документов, повторённых scale раз. Кэши чисел очищаются
+    перед каждым прогоном, поэтому учитываются только повторы внутри прогона.
+    """
+    raw = []
+    for path in files:
+        for data in iter_tables(path):
+            raw.extend(cell for row in data for cell in row)
+    raw = raw * scale
+    inputs = {'raw': raw, 'normalized': [legacy_clean_cell_text(cell) for cell in raw]}
+
+    results = {}
+    for name, legacy, current, source in NORMALIZATION_KERNELS:
+        cells = inputs[source]
+        timings = {}
+        outputs = {}
+        for label, func in (('legacy', legacy), ('current', current)):
+            runs = []
+            for _ in range(repeat):
+                if hasattr(func, 'cache_clear'):
+                    func.cache_clear()
+                start = time.perf_counter()
+                outputs[label] = [func(cell) for cell in cells]
+                runs.append(time.perf_counter() - start)
+            timings[label] = min(runs)
+        results[name] = {
+            'cells': len(cells),
+            'legacy_ms': timings['legacy'] * 1000,
+            'current_ms': timings['current'] * 1000,
+            'speedup': timings['legacy'] / timings['current'],
+            'identical': outputs['legacy'] == outputs['current'],
+        }
+    return results
+
+def benchmark_document(path, scale, repeat, conn=None):
+    """Несколько прогонов документа; по каждому этапу сохраняются минимум и медиана"""
+    doc_type = detect_doc_type(path)
+    document = scale_document(path, scale)
+    runs = []
+    counts = None
+    for _ in range(repeat):
+        timings, counts = run_once(document, doc_type, conn)
+        runs.append(timings)
+
+    stages = {}
+    for stage in STAGES + ['total']:
+        values = [sum(run.values()) if stage == 'total' else run[stage] for run in runs]
+        stages[stage] = {'min': min(values), 'median': statistics.median(values)}
+
+    return {
+        'file': os.path.relpath(path, BASE_DIR),
+        'doc_type': doc_type,
+        'scale': scale,
+        'repeat': repeat,
+        **counts,
+        'stages': stages,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Замер скорости разбора документов КЖ/СО/ВР по этапам")
+    parser.add_argument("files", nargs="*",
+                        help="DOCX файлы (по умолчанию - примеры из репозитория)")
+    parser.add_argument("--scale", type=int, nargs="+", default=[1, 10, 100],
+                        help="во сколько раз синтетически увеличить таблицы документа (по умолчанию 1 10 100)")
+    parser.add_argument("--repeat", type=int, default=3, help="количество прогонов (по умолчанию 3)")
+    parser.add_argument("--output", default="benchmark.json", help="файл с результатами в формате JSON")
+    parser.add_argument("--db", action="store_true",
+                        help="писать в локальный PostgreSQL (с откатом) вместо no-op приёмника")
+    parser.add_argument("--normalize", action="store_true",
+                        help="сравнить прежнюю и общую (text_normalize) обработку текста ячеек")
+    args = parser.parse_args()
+
+    files = args.files or [os.path.join(BASE_DIR, name) for name in SAMPLE_DOCUMENTS]
+    files = [path for path in files if os.path.exists(path)]
+
+    if args.normalize:
+        report = {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'normalization': {},
+        }
+        for scale in args.scale:
+            results = benchmark_normalization(files, scale, args.repeat)
+            report['normalization'][scale] = results
+            for name, result in results.items():
+                print(f"x{scale} {name}: {result['cells']} ячеек, прежняя {result['legacy_ms']:.1f} мс, "
+                      f"общая {result['current_ms']:.1f} мс, ускорение {result['speedup']:.2f}x"
+                      f"{'' if result['identical'] else ' - РЕЗУЛЬТАТЫ РАЗЛИЧАЮТСЯ'}")
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {args.output}")
+        return
+
+    conn = None
+    if args.db:
+        import psycopg2
+        from db_config import load_db_params
+        conn = psycopg2.connect(**load_db_params())
+
+    results = []
+    try:
+        for path in files:
+            for scale in args.scale:
+                result = benchmark_document(path, scale, args.repeat, conn)
+                results.append(result)
+                stages = ', '.join(f"{stage} {result['stages'][stage]['min'] * 1000:.1f}"
+                                   for stage in STAGES)
+                print(f"{result['file']} x{scale}: {result['rows']} строк, {result['records']} записей; "
+                      f"мс: {stages}; всего {result['stages']['total']['min'] * 1000:.1f}")
+    finally:
+        if conn is not None:
+            conn.close()
+
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'sink': 'postgresql' if args.db else 'noop',
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Результаты сохранены в {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+import io
+import json
+import uuid
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Количество строк, накапливаемых перед отправкой в базу
+DEFAULT_BATCH_SIZE = 1000
+
+# Пространство имён для детерминированных идентификаторов (UUIDv5) по естественным ключам
+NATURAL_KEY_NAMESPACE = uuid.UUID('6f1c8e2a-5b0d-4c4e-9a57-3d2f1e0b7c41')
+
+def natural_id(table, key_values):
+    """
+    Детерминированный идентификатор строки: UUIDv5 от имени таблицы и значений
+    естественного ключа. None и пустая строка дают разные идентификаторы.
+    """
+    return str(uuid.uuid5(NATURAL_KEY_NAMESPACE, json.dumps([table, *key_values], ensure_ascii=False)))
+
+def _copy_value(value):
+    """Преобразует значение в поле текстового формата COPY"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, float):
+        return repr(value)
+    text = str(value)
+    if '\\' in text or '\t' in text or '\n' in text or '\r' in text:
+        text = (text.replace('\\', '\\\\').replace('\t', '\\t')
+                    .replace('\n', '\\n').replace('\r', '\\r'))
+    return text
+
+def copy_payload(rows):
+    """Формирует данные для COPY ... FROM STDIN из списка кортежей"""
+    return ''.join('\t'.join(_copy_value(value) for value in row) + '\n' for row in rows)
+
+class BulkWriter:
+    """
+    Буферизует строки одной таблицы и отправляет их пачками через
+    COPY ... FROM STDIN. Если сервер не поддерживает COPY (NotSupportedError,
+    например за пулером соединений), пачка и все последующие отправляются через
+    execute_values. Поддержка проверяется только на первой пачке, остальные
+    ошибки (схема, разрыв соединения) передаются вызывающему коду.
+    Фиксация транзакции остаётся за вызывающим кодом.
+    """
+
+    def __init__(self, conn, table, columns, batch_size=DEFAULT_BATCH_SIZE):
+        self.conn = conn
+        self.table = table
+        self.columns = list(columns)
+        self.batch_size = batch_size
+        self.use_copy = True
+        # Первая пачка отправлена через COPY: точка сохранения больше не нужна
+        self.copy_checked = False
+        self.rows = []
+        # Количество запросов к базе (для metrics): COPY с точкой сохранения - три
+        self.round_trips = 0
+
+        column_list = ', '.join(f'"{column}"' for column in self.columns)
+        self.copy_query = f'COPY "{table}" ({column_list}) FROM STDIN'
+        self.insert_query = f'INSERT INTO "{table}" ({column_list}) VALUES %s'
+
+    def add(self, row):
+        """
+        Добавляет строку в буфер и отправляет буфер, если он заполнен.
+        Возвращает количество отправленных строк.
+        """
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            return self.flush()
+        return 0
+
+    def flush(self):
+        """Отправляет накопленные строки. Возвращает их количество"""
+        if not self.rows:
+            return 0
+
+        # psycopg2 импортируется при первой отправке, а не при импорте модуля
+        import psycopg2
+        import psycopg2.extras
+
+        rows, self.rows = self.rows, []
+        with self.conn.cursor() as cursor:
+            if self.use_copy and self.copy_checked:
+                cursor.copy_expert(self.copy_query, io.StringIO(copy_payload(rows)))
+                self.round_trips += 1
+                return len(rows)
+            if self.use_copy:
+                # Точка сохранения позволяет повторить первую пачку без COPY,
+                # не теряя уже записанное в этой транзакции
+                cursor.execute('SAVEPOINT bulk_writer_copy')
+                self.round_trips += 3
+                try:
+                    cursor.copy_expert(self.copy_query, io.StringIO(copy_payload(rows)))
+                except psycopg2.NotSupportedError as e:
+                    cursor.execute('ROLLBACK TO SAVEPOINT bulk_writer_copy')
+                    logger.warning(f"COPY в таблицу {self.table} недоступен, "
+                                   f"используется execute_values: {str(e)}")
+                    self.use_copy = False
+                else:
+                    cursor.execute('RELEASE SAVEPOINT bulk_writer_copy')
+                    self.copy_checked = True
+                    return len(rows)
+
+            psycopg2.extras.execute_values(cursor, self.insert_query, rows,
+                                           page_size=self.batch_size)
+            self.round_trips += 1
+        return len(rows)
+
+    def discard(self):
+        """Отбрасывает неотправленные строки (например, после отката транзакции)"""
+        self.rows = []
+
+def upsert_queries(table, columns):
+    """
+    Запросы идемпотентной записи в таблицу table: (имя временной таблицы,
+    запрос её создания и очистки, запрос переноса строк в table через
+    INSERT ... ON CONFLICT по идентификатору - первому столбцу columns).
+    Существующая строка обновляется, только если изменилось хотя бы одно значение.
+    """
+    stage = f'{table}_upsert_stage'
+    columns = list(columns)
+    id_column = f'"{columns[0]}"'
+    column_list = ', '.join(f'"{column}"' for column in columns)
+    data_columns = [f'"{column}"' for column in columns[1:]]
+    assignments = ', '.join(f'{column} = EXCLUDED.{column}' for column in data_columns)
+    target_values = ', '.join(f'"{table}".{column}' for column in data_columns)
+    excluded_values = ', '.join(f'EXCLUDED.{column}' for column in data_columns)
+
+    stage_query = (f'CREATE TEMP TABLE IF NOT EXISTS "{stage}" '
+                   f'(LIKE "{table}" INCLUDING DEFAULTS); '
+                   f'TRUNCATE "{stage}"')
+    merge_query = (f'INSERT INTO "{table}" ({column_list}) '
+                   f'SELECT {column_list} FROM "{stage}" '
+                   f'ON CONFLICT ({id_column}) DO UPDATE SET {assignments} '
+                   f'WHERE ({target_values}) IS DISTINCT FROM ({excluded_values})')
+    return stage, stage_query, merge_query
+
+class UpsertWriter(BulkWriter):
+    """
+    Идемпотентная запись по естественному ключу. Первый столбец (идентификатор)
+    заменяется на natural_id от значений key_columns, пачка загружается
+    через COPY во временную таблицу и переносится в целевую через
+    INSERT ... ON CONFLICT по идентификатору. Существующие строки обновляются
+    только если изменилось хотя бы одно значение, поэтому повторный импорт
+    того же документа ничего не записывает.
+    """
+
+    def __init__(self, conn, table, columns, key_columns, batch_size=DEFAULT_BATCH_SIZE):
+        self.target = table
+        stage, self.stage_query, self.merge_query = upsert_queries(table, columns)
+        super().__init__(conn, stage, columns, batch_size)
+        self.key_indexes = [self.columns.index(column) for column in key_columns]
+
+    def add(self, row):
+        """
+        Добавляет строку с идентификатором по естественному ключу.
+        Возвращает количество добавленных или изменённых строк.
+        """
+        row_id = natural_id(self.target, [row[i] for i in self.key_indexes])
+        return super().add((row_id,) + tuple(row[1:]))
+
+    def flush(self):
+        """Переносит накопленные строки в целевую таблицу. Возвращает количество изменённых"""
+        if not self.rows:
+            return 0
+
+        # Повтор ключа внутри пачки: ON CONFLICT не может изменить строку дважды,
+        # поэтому остаётся последнее вхождение
+        self.rows = list({row[0]: row for row in self.rows}.values())
+
+        with self.conn.cursor() as cursor:
+            cursor.execute(self.stage_query)
+        super().flush()
+        with self.conn.cursor() as cursor:
+            cursor.execute(self.merge_query)
+            # Создание временной таблицы и перенос из неё
+            self.round_trips += 2
+            return cursor.rowcount
+
+def create_writer(conn, table, columns, batch_size=DEFAULT_BATCH_SIZE, key_columns=None):
+    """BulkWriter для обычной вставки или UpsertWriter, если задан естественный ключ"""
+    if key_columns:
+        return UpsertWriter(conn, table, columns, key_columns, batch_size)
+    return BulkWriter(conn, table, columns, batch_size)
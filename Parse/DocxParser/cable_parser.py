@@ -1,13 +1,14 @@
-from docx import Document
 import os
-import re
 import sys
 import traceback
-import psycopg2
 import uuid
 import logging
-import pandas as pd
-import numpy as np
+from db_config import load_db_params
+from docx_tables import iter_table_rows, open_archive, source_name
+from text_normalize import clean_cell_text, extract_length
+from columnar_export import ColumnarExport
+from parse_options import DEFAULT_OPTIONS
+from metrics import DocumentMetrics
 
 # Настройка логирования
 logging.basicConfig(
@@ -19,205 +20,290 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def extract_length(text):
-    """Извлекает числовое значение длины из текста"""
-    if not text:
+# Столбцы таблицы Cable для журналов первого и второго типа
+CABLE_TYPE1_COLUMNS = [
+    "ID_cable", "ID_project_document", "Cable_identification",
+    "Trassa_beginning", "Trassa_end", "Cable_or_wire_brand",
+    "Cable_or_wire_projet_length", "Cable_or_wire_laying_brand",
+    "Cable_or_wire_laying_length"
+]
+CABLE_TYPE2_COLUMNS = [
+    "ID_cable", "ID_project_document", "Cable_identification",
+    "Trassa_beginning", "Trassa_end", "Pipe_passage_designation",
+    "Pipe_passage_diameter", "Pipe_passage_length", "Draw_box_passing_length",
+    "Cable_or_wire_brand", "Cable_or_wire_projet_cross_section", "Cable_or_wire_projet_length",
+    "Cable_or_wire_laying_brand", "Cable_or_wire_laying_cross_setion", "Cable_or_wire_laying_length"
+]
+# Естественный ключ кабеля для режима upsert
+CABLE_NATURAL_KEY = ["ID_project_document", "Cable_identification"]
+
+# Заголовки первого столбца, по которым определяется тип журнала
+TYPE1_HEADERS = ["Номер кабеля"]
+TYPE2_HEADERS = ["Обозначение кабеля, провода", "Обозначение\nкабеля,\nпровода"]
+HEADER_CELLS = TYPE1_HEADERS + TYPE2_HEADERS
+NUMBERING_ROW = ['1', '2', '3', '4', '5', '6', '7', '8', '9', '10', '11', '12', '13']
+MIN_COLUMNS = 13
+
+def pad_table(data, width=MIN_COLUMNS):
+    """
+    Выравнивает строки таблицы: короткие строки дополняются None до самой
+    длинной строки, а вся таблица - пустыми строками до width столбцов
+    """
+    if not data:
+        return []
+    max_len = max(len(row) for row in data)
+    extra = [''] * (width - max_len) if max_len < width else []
+    return [row + [None] * (max_len - len(row)) + extra for row in data]
+
+def pad_row(row, width, min_width=MIN_COLUMNS):
+    """
+    Выравнивает одну строку так же, как pad_table, когда таблица целиком
+    недоступна: None до ширины таблицы width (длины самой длинной строки,
+    см. docx_tables.iter_table_rows), затем пустые строки до min_width столбцов
+    """
+    max_len = max(width, len(row))
+    padded = row + [None] * (max_len - len(row))
+    if max_len < min_width:
+        padded += [''] * (min_width - max_len)
+    return padded
+
+def detect_table_type(rows):
+    """Определяет тип кабельного журнала по первой ячейке: 1, 2 или None"""
+    if not rows:
         return None
-        
-    # Удаляем все пробелы и заменяем запятую на точку
-    cleaned = text.replace(' ', '').replace(',', '.')
-    
-    # Ищем числа с плавающей точкой
-    match = re.search(r'(\d+\.?\d*)', cleaned)
-    if match:
-        try:
-            return float(match.group(1))
-        except ValueError:
-            return None
+    first_cell = rows[0][0]
+    if first_cell in TYPE1_HEADERS:
+        return 1
+    if first_cell in TYPE2_HEADERS:
+        return 2
     return None
 
-def parse_cable_journal_docx(docx_path, db_params, project_document_id):
-    """Парсер для кабельного журнала с использованием pandas"""
-    try:
-        conn = psycopg2.connect(**db_params)
-        cursor = conn.cursor()
-        logger.info("Успешное подключение к базе данных PostgreSQL!")
-    except Exception as e:
-        logger.error(f"Ошибка подключения к PostgreSQL: {str(e)}")
-        raise
-    
+def is_journal_header(first_row):
+    """
+    Проверка первой строки таблицы прямо при чтении XML: остальные строки
+    строятся только для кабельных журналов первого и второго типа
+    """
+    return bool(first_row) and first_row[0] in HEADER_CELLS
+
+def row_skip_reason(idx, cells):
+    """Причина пропуска строки журнала (заголовок, разделитель, номера столбцов) или None"""
+    if idx == 0:
+        return "header"
+    if all(cell == cells[0] for cell in cells):
+        return "separator"
+    if cells[0] in HEADER_CELLS:
+        return "header"
+    if cells == NUMBERING_ROW:
+        return "numbering"
+    return None
+
+def is_data_row(idx, cells):
+    """Отсекает заголовки, разделители и строку с номерами столбцов"""
+    return row_skip_reason(idx, cells) is None
+
+def map_type1_row(cells, project_document_id):
+    """Формирует строку таблицы Cable (CABLE_TYPE1_COLUMNS) из журнала первого типа"""
+    return (
+        str(uuid.uuid4()),
+        project_document_id,
+        cells[0],                     # cable_identification
+        cells[2],                     # trassa_beginning
+        cells[5],                     # trassa_end
+        cells[8],                     # cable_or_wire_brand
+        extract_length(cells[9]),     # cable_or_wire_projet_length
+        cells[10],                    # cable_or_wire_laying_brand
+        extract_length(cells[11])     # cable_or_wire_laying_length
+    )
+
+def map_type2_row(cells, project_document_id):
+    """Формирует строку таблицы Cable (CABLE_TYPE2_COLUMNS) из журнала второго типа"""
+    return (
+        str(uuid.uuid4()),
+        project_document_id,
+        cells[0],                     # cable_identification
+        cells[1],                     # trassa_beginning
+        cells[2],                     # trassa_end
+        cells[3],                     # pipe_passage_designation
+        cells[4],                     # pipe_passage_diameter
+        extract_length(cells[5]),     # pipe_passage_length
+        extract_length(cells[6]),     # draw_box_passing_length
+        cells[7],                     # cable_or_wire_brand
+        cells[8],                     # cable_or_wire_projet_cross_section
+        extract_length(cells[9]),     # cable_or_wire_projet_length
+        cells[10],                    # cable_or_wire_laying_brand
+        cells[11],                    # cable_or_wire_laying_cross_section
+        extract_length(cells[12])     # cable_or_wire_laying_length
+    )
+
+def iter_cable_rows(rows, table_type, project_document_id):
+    """Выдаёт строки для записи в Cable из выровненной таблицы журнала"""
+    map_row = map_type1_row if table_type == 1 else map_type2_row
+    for idx, cells in enumerate(rows):
+        if is_data_row(idx, cells):
+            yield map_row(cells, project_document_id)
+
+def iter_cable_journal(docx_path, project_document_id, progress=None, metrics=None):
+    """
+    Потоково выдаёт строки для записи в Cable по мере чтения word/document.xml:
+    (тип журнала, строка). Таблицы, не являющиеся журналами, отбрасываются
+    по первой строке, а журнал не собирается в памяти целиком - каждая строка
+    выравнивается по самой длинной строке таблицы (как pad_table) и сразу сопоставляется.
+    После каждой разобранной таблицы журнала вызывается
+    progress(количество таблиц, количество строк), если он передан.
+    В metrics (DocumentMetrics) учитываются время чтения и сопоставления,
+    прочитанные таблицы и строки и причины пропуска строк.
+    """
+    if metrics is None:
+        metrics = DocumentMetrics()
+    current_table = None
+    table_type = None
+    map_row = None
+    row_idx = 0
+    table_count = 0
+    row_count = 0
+    rows = iter_table_rows(docx_path, normalize=clean_cell_text, accept=is_journal_header)
+    for table_idx, width, row in metrics.timed("read", rows):
+        with metrics.stage("map"):
+            metrics.count("rows_read")
+            cells = pad_row(row, width)
+            if table_idx != current_table:
+                if progress and table_count:
+                    progress(table_count, row_count)
+                current_table = table_idx
+                table_count += 1
+                metrics.count("tables")
+                row_idx = 0
+                table_type = detect_table_type([cells])
+                map_row = map_type1_row if table_type == 1 else map_type2_row
+                logger.info(f"Обработка таблицы {table_idx+1}")
+
+            reason = row_skip_reason(row_idx, cells)
+            row_idx += 1
+            if reason is None:
+                row_count += 1
+                metrics.count("rows_mapped")
+                mapped = map_row(cells, project_document_id)
+            else:
+                metrics.skip(reason)
+        if reason is None:
+            yield table_type, mapped
+
+    if progress and table_count:
+        progress(table_count, row_count)
+
+def extract_cable_rows(docx_path, project_document_id, progress=None):
+    """
+    Разбирает кабельный журнал без записи в базу.
+    Возвращает строки в виде {(таблица, столбцы): [строки, ...]}.
+    progress(количество таблиц, количество строк) вызывается после каждой таблицы.
+    """
+    batches = {}
+    for table_type, row in iter_cable_journal(docx_path, project_document_id, progress):
+        columns = CABLE_TYPE1_COLUMNS if table_type == 1 else CABLE_TYPE2_COLUMNS
+        batches.setdefault(("Cable", tuple(columns)), []).append(row)
+    return batches
+
+def parse_cable_journal_docx(docx_path, db_params, project_document_id, collected=None,
+                             upsert=False, options=DEFAULT_OPTIONS):
+    """
+    Парсер для кабельного журнала. docx_path - путь к файлу или открытый zipfile.ZipFile,
+    options (ParseOptions) - подключение или приёмник, выгрузка и замеры.
+    Журнал читается потоково и фиксируется одной транзакцией; в collected (если
+    передан) добавляются зафиксированные строки, в режиме upsert строки пишутся
+    по CABLE_NATURAL_KEY. Возвращает количество добавленных (изменённых) записей.
+    """
+    metrics = options.metrics
+    if metrics is None:
+        metrics = DocumentMetrics(source_name(docx_path), "КЖ")
+    batch_size = options.batch_size
     try:
-        doc = Document(docx_path)
-        logger.info(f"Файл {docx_path} успешно открыт")
+        with metrics.stage("open"):
+            docx_zip = open_archive(docx_path)
+        metrics.measure_document(docx_zip)
+        logger.info(f"Файл {source_name(docx_path)} успешно открыт")
     except Exception as e:
-        conn.close()
         logger.error(f"Ошибка открытия DOCX файла: {str(e)}")
         raise
-    
-    total_inserted = 0
-
-    # Создаем список всех таблиц в виде DataFrame
-    tables = []
-    for table in doc.tables:
-        data = []
-        for row in table.rows:
-            current_row = []
-            for cell in row.cells:
-                text = cell.text.strip()
-                text = re.sub(r'\s+', ' ', text)
-                current_row.append(text)
-            data.append(current_row)
-        
-        # Создаем DataFrame и дополняем до 13 столбцов
-        df = pd.DataFrame(data)
-        if len(df.columns) < 13:
-            for i in range(len(df.columns), 13):
-                df[i] = ''
-        tables.append(df)
-
-    # Обрабатываем каждую таблицу
-    for table_idx, df in enumerate(tables):
-        logger.info(f"Обработка таблицы {table_idx+1}")
-        
-        # Определяем тип таблицы
-        type1 = False
-        type2 = False
-        
-        if not df.empty:
-            first_row = df.iloc[0].tolist()
-            if first_row[0] == "Номер кабеля":
-                type1 = True
-            elif first_row[0] == "Обозначение кабеля, провода" or first_row[0] == "Обозначение\nкабеля,\nпровода":
-                type2 = True
-        
-        # Пропускаем таблицы неизвестного типа
-        if not type1 and not type2:
-            logger.info(f"Таблица {table_idx+1} неизвестного формата, пропускаем")
-            continue
-
-        # Обрабатываем строки таблицы
-        for idx, row in df.iterrows():
-            cells = row.tolist()
-            # print(cells)
-            # Пропускаем заголовки и разделители
-            if (idx == 0 or 
-                all(cell == cells[0] for cell in cells) or
-                cells[0] in ['Номер кабеля', 'Обозначение кабеля, провода', 'Обозначение\nкабеля,\nпровода'] or
-                cells == ['1', '2', '3', '4', '5', '6', '7', '8', '9', '10', '11', '12', '13']):
-                continue
-            
-            if type1:
-                cable_data = {
-                    'cable_identification': cells[0],
-                    'trassa_beginning': cells[2],
-                    'trassa_end': cells[5],
-                    'cable_or_wire_brand': cells[8],
-                    'cable_or_wire_projet_length': extract_length(cells[9]),
-                    'cable_or_wire_laying_brand': cells[10],
-                    'cable_or_wire_laying_length': extract_length(cells[11]),
-                    'note': cells[12] if len(cells) > 12 else ''
-                }
 
-                try:
-                    insert_query = """
-                    INSERT INTO "Cable" (
-                        "ID_cable", "ID_project_document", "Cable_identification",
-                        "Trassa_beginning", "Trassa_end", "Cable_or_wire_brand",
-                        "Cable_or_wire_projet_length", "Cable_or_wire_laying_brand",
-                        "Cable_or_wire_laying_length"
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    """
-
-                    data = (
-                        str(uuid.uuid4()),  
-                        project_document_id,
-                        cable_data['cable_identification'],
-                        cable_data['trassa_beginning'],
-                        cable_data['trassa_end'],
-                        cable_data['cable_or_wire_brand'],
-                        cable_data['cable_or_wire_projet_length'],
-                        cable_data['cable_or_wire_laying_brand'],
-                        cable_data['cable_or_wire_laying_length']
-                    )
-
-                    cursor.execute(insert_query, data)
-                    total_inserted += 1
+    try:
+        if options.export_dir:
+            with ColumnarExport(options.export_dir, docx_path, options.export_format,
+                                batch_size) as export:
+                for table_type, row in iter_cable_journal(docx_zip, project_document_id, metrics=metrics):
+                    with metrics.stage("write"):
+                        export.add("Cable", CABLE_TYPE1_COLUMNS if table_type == 1 else CABLE_TYPE2_COLUMNS, row)
+            metrics.count("rows_written", export.count)
+            logger.info(f"Выгрузка завершена. Выгружено записей: {export.count}")
+            metrics.log(logger)
+            return export.count
 
-                except Exception as e:
-                    logger.error(f"Ошибка при вставке данных кабеля {cable_data['cable_identification']}: {str(e)}")
-                    conn.rollback()
-                    continue
-
-            elif type2:
-                cable_data = {
-                    'cable_identification': cells[0],
-                    'trassa_beginning': cells[1],
-                    'trassa_end': cells[2],
-                    'pipe_passage_designation': cells[3],
-                    'pipe_passage_diameter': cells[4],
-                    'pipe_passage_length': extract_length(cells[5]),
-                    'draw_box_passing_length': extract_length(cells[6]),
-                    'cable_or_wire_brand': cells[7],
-                    'cable_or_wire_projet_cross_section': cells[8],
-                    'cable_or_wire_projet_length': extract_length(cells[9]),
-                    'cable_or_wire_laying_brand': cells[10],
-                    'cable_or_wire_laying_cross_section': cells[11],
-                    'cable_or_wire_laying_length': extract_length(cells[12])
-                }
+        with options.session(db_params) as sink:
+            sink = metrics.sink(sink)
+            total_inserted = 0
+            failed_batches = 0
+            # Строки, которые будут зафиксированы вместе с документом (только для collected)
+            pending = {1: [], 2: []}
+            key_columns = CABLE_NATURAL_KEY if upsert else None
+            writers = {
+                1: sink.writer("Cable", CABLE_TYPE1_COLUMNS, batch_size, key_columns),
+                2: sink.writer("Cable", CABLE_TYPE2_COLUMNS, batch_size, key_columns)
+            }
 
+            # Строки журналов приходят по мере чтения документа, посторонние таблицы
+            # (штампы, ведомости чертежей) отбрасываются по первой строке
+            for table_type, row in iter_cable_journal(docx_zip, project_document_id, metrics=metrics):
                 try:
-                    insert_query = """
-                    INSERT INTO "Cable" (
-                        "ID_cable", "ID_project_document", "Cable_identification",
-                        "Trassa_beginning", "Trassa_end", "Pipe_passage_designation",
-                        "Pipe_passage_diameter", "Pipe_passage_length", "Draw_box_passing_length",
-                        "Cable_or_wire_brand", "Cable_or_wire_projet_cross_section", "Cable_or_wire_projet_length",
-                        "Cable_or_wire_laying_brand", "Cable_or_wire_laying_cross_setion", "Cable_or_wire_laying_length"
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    """
-
-                    data = (
-                        str(uuid.uuid4()),  
-                        project_document_id,
-                        cable_data['cable_identification'],
-                        cable_data['trassa_beginning'],
-                        cable_data['trassa_end'],
-                        cable_data['pipe_passage_designation'],
-                        cable_data['pipe_passage_diameter'],
-                        cable_data['pipe_passage_length'],
-                        cable_data['draw_box_passing_length'],
-                        cable_data['cable_or_wire_brand'],
-                        cable_data['cable_or_wire_projet_cross_section'],
-                        cable_data['cable_or_wire_projet_length'],
-                        cable_data['cable_or_wire_laying_brand'],
-                        cable_data['cable_or_wire_laying_cross_section'],
-                        cable_data['cable_or_wire_laying_length']
-                    )
-
-                    cursor.execute(insert_query, data)
-                    total_inserted += 1
-
+                    total_inserted += writers[table_type].add(row)
+                    if collected is not None:
+                        pending[table_type].append(row)
                 except Exception as e:
-                    logger.error(f"Ошибка при вставке данных кабеля {cable_data['cable_identification']}: {str(e)}")
-                    conn.rollback()
-                    continue
+                    logger.error(f"Ошибка при вставке пакета кабелей (последний {row[2]}): {str(e)}")
+                    # Откат отменяет все незафиксированные записи документа, поэтому
+                    # строки, ещё ждущие в буферах обоих писателей, тоже отбрасываются
+                    for writer in writers.values():
+                        writer.discard()
+                    sink.rollback()
+                    total_inserted = 0
+                    pending = {1: [], 2: []}
+                    failed_batches += 1
 
-    conn.commit()
-    cursor.close()
-    conn.close()
+            try:
+                total_inserted += writers[1].flush()
+                total_inserted += writers[2].flush()
+            except Exception as e:
+                logger.error(f"Ошибка при вставке пакета кабелей: {str(e)}")
+                for writer in writers.values():
+                    writer.discard()
+                sink.rollback()
+                total_inserted = 0
+                pending = {1: [], 2: []}
+                failed_batches += 1
+
+            sink.commit()
+            # Строки после отката зафиксированы, но журнал записан не целиком:
+            # вызывающий код не должен считать документ обработанным (например, кэшировать)
+            if failed_batches:
+                raise RuntimeError(f"не записано пакетов кабелей: {failed_batches}, строки до последней "
+                                   f"ошибки отменены, остальные зафиксированы ({total_inserted} записей)")
+            if collected is not None:
+                for table_type, columns in ((1, CABLE_TYPE1_COLUMNS), (2, CABLE_TYPE2_COLUMNS)):
+                    if pending[table_type]:
+                        collected.setdefault(("Cable", tuple(columns)), []).extend(pending[table_type])
+    except Exception as e:
+        metrics.error = str(e)
+        metrics.log(logger)
+        raise
+    finally:
+        if docx_zip is not docx_path:
+            docx_zip.close()
     logger.info(f"Обработка завершена. Добавлено записей: {total_inserted}")
+    metrics.log(logger)
     return total_inserted
 
 if __name__ == "__main__":
     docx_file_path = sys.argv[1]
     
-    db_params = {
-        "host": "localhost",
-        "port": "5432",
-        "database": "cable_db",
-        "user": "postgres",
-        "password": "test1"
-    }
+    db_params = load_db_params()
     
     project_document_id = None
     
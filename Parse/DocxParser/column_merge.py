@@ -0,0 +1,49 @@
+# Порог схожести соседних столбцов (в процентах), выше которого столбец
+# считается копией предыдущего, размноженной горизонтальным объединением ячеек
+DEFAULT_SIMILARITY_THRESHOLD = 80
+
+def kept_columns(rows, threshold=DEFAULT_SIMILARITY_THRESHOLD):
+    """
+    Находит столбцы таблицы, которые остаются после схлопывания объединённых.
+    Все пары соседних столбцов сравниваются за один проход по массиву NumPy:
+    схожесть - доля совпадающих значений среди строк, где заполнены оба столбца.
+    Столбец, похожий на предыдущий больше чем на threshold процентов,
+    попадает в его группу; из каждой группы остаётся первый столбец.
+    rows - список строк (строки могут быть разной длины).
+    Возвращает список индексов оставляемых столбцов.
+    """
+    if not rows:
+        return []
+
+    # NumPy нужен только при разборе СО/ВР, поэтому импортируется здесь
+    import numpy as np
+
+    lengths = np.fromiter((len(row) for row in rows), dtype=np.intp, count=len(rows))
+    width = int(lengths.max())
+    if width <= 1:
+        return list(range(width))
+
+    # Дополняем короткие строки; заполненность отслеживаем отдельной маской
+    values = np.empty((len(rows), width), dtype=object)
+    for i, row in enumerate(rows):
+        values[i, :len(row)] = row
+    present = np.arange(width) < lengths[:, None]
+
+    both = present[:, 1:] & present[:, :-1]
+    matches = (values[:, 1:] == values[:, :-1]).astype(bool) & both
+
+    total = both.sum(axis=0)
+    similarity = np.zeros(width - 1)
+    np.divide(matches.sum(axis=0) * 100, total, out=similarity, where=total > 0)
+
+    keep = np.concatenate(([True], similarity <= threshold))
+    return np.flatnonzero(keep).tolist()
+
+def collapse_columns(rows, threshold=DEFAULT_SIMILARITY_THRESHOLD):
+    """
+    Оставляет в таблице только столбцы из kept_columns и заменяет
+    отсутствующие ячейки пустыми строками.
+    """
+    columns_to_keep = kept_columns(rows, threshold)
+    return [[row[i] if i < len(row) and row[i] is not None else '' for i in columns_to_keep]
+            for row in rows]
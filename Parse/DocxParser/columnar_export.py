@@ -0,0 +1,194 @@
+import os
+import re
+import hashlib
+import logging
+
+from bulk_writer import DEFAULT_BATCH_SIZE
+from docx_tables import source_name
+
+logger = logging.getLogger(__name__)
+
+# Форматы выгрузки и расширения файлов
+EXPORT_FORMATS = {
+    "parquet": ".parquet",
+    "arrow": ".arrow"
+}
+
+# Столбцы с типом double precision в базе; остальные выгружаются как текст
+FLOAT_COLUMNS = {
+    "Pipe_passage_length",
+    "Draw_box_passing_length",
+    "Cable_or_wire_projet_length",
+    "Cable_or_wire_laying_length",
+    "Quantity1",
+    "Quantity2",
+    "Unit_mass"
+}
+
+def export_schema(table, columns, source=''):
+    """Схема Arrow для строк таблицы; имя таблицы и документа хранятся в метаданных"""
+    import pyarrow as pa
+
+    return pa.schema([pa.field(column, pa.float64() if column in FLOAT_COLUMNS else pa.string())
+                      for column in columns],
+                     metadata={'table': table, 'source': source})
+
+def export_stem(docx_path):
+    """
+    Имя файлов выгрузки документа: имя DOCX и короткий хэш полного пути,
+    чтобы одноимённые документы из разных папок "Книга" не перезаписывали друг друга
+    """
+    name = source_name(docx_path)
+    digest = hashlib.sha1(os.path.abspath(name).encode('utf-8')).hexdigest()[:8]
+    return f"{os.path.splitext(os.path.basename(name))[0]}-{digest}"
+
+class ColumnarWriter:
+    """
+    Пишет строки одной таблицы в файл Parquet или Arrow IPC. Строки копятся
+    и записываются группами по batch_size, поэтому память не растёт с размером
+    документа. Файл пишется под временным именем и получает своё только
+    в close(), так что загрузчик никогда не видит недописанных файлов.
+    """
+
+    def __init__(self, path, table, columns, export_format="parquet",
+                 batch_size=DEFAULT_BATCH_SIZE, source=''):
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError(f"Неизвестный формат выгрузки: {export_format}")
+        self.path = path
+        self.temp_path = path + '.tmp'
+        self.table = table
+        self.columns = list(columns)
+        self.export_format = export_format
+        self.batch_size = batch_size
+        self.schema = export_schema(table, self.columns, source)
+        self.rows = []
+        self.writer = None
+        self.sink = None
+
+    def add(self, row):
+        """
+        Добавляет строку в буфер и записывает буфер, если он заполнен.
+        Возвращает количество записанных строк.
+        """
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            return self.flush()
+        return 0
+
+    def flush(self):
+        """Записывает накопленные строки группой. Возвращает их количество"""
+        if not self.rows:
+            return 0
+
+        import pyarrow as pa
+
+        rows, self.rows = self.rows, []
+        if self.writer is None:
+            self._open()
+        arrays = [pa.array(values, type=field.type) for values, field in zip(zip(*rows), self.schema)]
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+        return len(rows)
+
+    def _open(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        if self.export_format == "parquet":
+            self.writer = pq.ParquetWriter(self.temp_path, self.schema)
+        else:
+            self.sink = pa.OSFile(self.temp_path, 'wb')
+            self.writer = pa.ipc.new_file(self.sink, self.schema)
+
+    def _close_writer(self):
+        if self.writer is not None:
+            self.writer.close()
+        if self.sink is not None:
+            self.sink.close()
+
+    def close(self):
+        """Записывает остаток и публикует файл под итоговым именем. Возвращает количество строк"""
+        written = self.flush()
+        if self.writer is not None:
+            self._close_writer()
+            os.replace(self.temp_path, self.path)
+        return written
+
+    def discard(self):
+        """Отбрасывает недописанный файл (например, после ошибки разбора)"""
+        self.rows = []
+        if self.writer is not None:
+            self._close_writer()
+            os.remove(self.temp_path)
+        self.writer = None
+
+class ColumnarExport:
+    """
+    Выгрузка строк одного документа: по файлу на каждую пару (таблица, столбцы)
+    в export_dir/<таблица>/<export_stem><расширение>. Если разбор документа
+    прервался исключением, его недописанные файлы удаляются. При успешной
+    выгрузке файлы прежней выгрузки того же документа, которые она не заменяет
+    (например, второй набор столбцов журнала, пропавший из новой редакции),
+    удаляются, чтобы загрузчик не загрузил их повторно.
+    """
+
+    def __init__(self, export_dir, docx_path, export_format="parquet", batch_size=DEFAULT_BATCH_SIZE):
+        self.export_dir = export_dir
+        self.source = os.path.basename(source_name(docx_path))
+        self.stem = export_stem(docx_path)
+        self.export_format = export_format
+        self.batch_size = batch_size
+        self.writers = {}
+        self.count = 0
+
+    def add(self, table, columns, row):
+        key = (table, tuple(columns))
+        writer = self.writers.get(key)
+        if writer is None:
+            # У кабельного журнала два набора столбцов: второй файл таблицы получает суффикс
+            index = sum(1 for other in self.writers if other[0] == table)
+            suffix = f".{index + 1}" if index else ""
+            path = os.path.join(self.export_dir, table,
+                                f"{self.stem}{suffix}{EXPORT_FORMATS[self.export_format]}")
+            writer = ColumnarWriter(path, table, columns, self.export_format, self.batch_size,
+                                    self.source)
+            self.writers[key] = writer
+        self.count += 1
+        writer.add(row)
+
+    @property
+    def paths(self):
+        return [writer.path for writer in self.writers.values()]
+
+    def remove_stale(self):
+        """Удаляет файлы прежних выгрузок документа, кроме тех, что будут заменены"""
+        pattern = re.compile(re.escape(self.stem) + r'(\.\d+)?('
+                             + '|'.join(map(re.escape, EXPORT_FORMATS.values())) + r')$')
+        keep = set(self.paths)
+        try:
+            table_dirs = [entry.path for entry in os.scandir(self.export_dir) if entry.is_dir()]
+        except FileNotFoundError:
+            return
+        for table_dir in table_dirs:
+            for entry in os.scandir(table_dir):
+                if pattern.match(entry.name) and entry.path not in keep:
+                    logger.info(f"Удалён файл прежней выгрузки {entry.path}")
+                    os.remove(entry.path)
+
+    def close(self):
+        self.remove_stale()
+        for writer in self.writers.values():
+            writer.close()
+
+    def discard(self):
+        for writer in self.writers.values():
+            writer.discard()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
@@ -0,0 +1,140 @@
+import os
+import sys
+import shutil
+import logging
+import argparse
+
+from sinks import console_output, create_sink, sink_session
+from document_diff import DOCUMENT_COLUMNS, NATURAL_KEYS, PLAIN_DOCUMENT_IDS, document_column_index
+from columnar_export import EXPORT_FORMATS
+
+logger = logging.getLogger(__name__)
+
+def find_export_files(directory):
+    """Файлы выгрузки (Parquet и Arrow IPC) в папке и её подпапках в порядке имён"""
+    extensions = tuple(EXPORT_FORMATS.values())
+    paths = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        paths.extend(os.path.join(root, name) for name in sorted(files) if name.endswith(extensions))
+    return paths
+
+def read_export_file(path):
+    """
+    Открывает файл выгрузки. Возвращает (таблица, столбцы, пачки строк):
+    пачки - генератор списков кортежей по группам строк файла.
+    Таблица берётся из метаданных схемы, а если их нет - из имени папки.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if path.endswith(EXPORT_FORMATS["parquet"]):
+        data = pq.ParquetFile(path)
+        schema = data.schema_arrow
+        batches = data.iter_batches()
+    else:
+        data = pa.ipc.open_file(pa.memory_map(path))
+        schema = data.schema
+        batches = (data.get_batch(i) for i in range(data.num_record_batches))
+
+    metadata = schema.metadata or {}
+    table = metadata.get(b'table', b'').decode('utf-8') or os.path.basename(os.path.dirname(path))
+
+    def rows():
+        for batch in batches:
+            yield list(zip(*(column.to_pylist() for column in batch.columns)))
+
+    return table, schema.names, rows()
+
+def load_file(path, sink, upsert=False):
+    """
+    Загружает один файл выгрузки в приёмник (см. sinks) одной транзакцией.
+    В режиме upsert строки пишутся по естественным ключам (NATURAL_KEYS),
+    поэтому повторная загрузка того же файла не создаёт копий; без upsert
+    ссылка на документ (DOCUMENT_COLUMNS) записывается как при обычном разборе
+    (PLAIN_DOCUMENT_IDS).
+    Возвращает количество добавленных (в режиме upsert - изменённых) записей.
+    """
+    table, columns, batches = read_export_file(path)
+    writer = sink.writer(table, columns, key_columns=NATURAL_KEYS[table] if upsert else None)
+    document_index = document_column_index(table, columns)
+    try:
+        total = 0
+        for rows in batches:
+            for row in rows:
+                if document_index is not None and not upsert:
+                    row = row[:document_index] + (PLAIN_DOCUMENT_IDS[table],) + row[document_index + 1:]
+                elif document_index is not None and not row[document_index]:
+                    # Без ссылки на документ строки разных документов совпали бы по естественному ключу
+                    raise ValueError(f"строка без {DOCUMENT_COLUMNS[table]}: загрузка с --upsert невозможна")
+                total += writer.add(row)
+        total += writer.flush()
+        sink.commit()
+    except Exception:
+        writer.discard()
+        sink.rollback()
+        raise
+    return total
+
+def load_directory(directory, sink, upsert=False, done_dir=None):
+    """
+    Загружает все файлы выгрузки из папки, каждый своей транзакцией.
+    Успешно загруженные файлы переносятся в done_dir (если задана), поэтому
+    повторный запуск после сбоя загружает только оставшиеся.
+    Возвращает (количество записей, список файлов с ошибками).
+    """
+    total = 0
+    failed = []
+    for path in find_export_files(directory):
+        try:
+            record_count = load_file(path, sink, upsert)
+        except Exception as e:
+            print(f"Ошибка при загрузке файла {path}: {e}")
+            failed.append(path)
+            continue
+
+        total += record_count
+        print(f"{path} - загружено записей: {record_count}")
+        if done_dir:
+            target = os.path.join(done_dir, os.path.relpath(path, directory))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.move(path, target)
+    return total, failed
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Загрузка строк, выгруженных в Parquet/Arrow (find_files.py --export)")
+    parser.add_argument("directory", help="папка выгрузки")
+    parser.add_argument("--upsert", action="store_true",
+                        help="обновлять строки по естественным ключам вместо добавления копий")
+    parser.add_argument("--done-dir", metavar="DIR",
+                        help="переносить загруженные файлы в эту папку")
+    parser.add_argument("--sink", default="postgres",
+                        help="куда загружать: postgres (по умолчанию), sqlite:ФАЙЛ, ndjson или ndjson:ФАЙЛ")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.directory):
+        print("Указанный путь не существует или не является папкой")
+        sys.exit(1)
+
+    try:
+        sink = create_sink(args.sink)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+
+    with console_output(sink), sink_session(sink=sink) as session:
+        try:
+            total, failed = load_directory(args.directory, session, args.upsert, args.done_dir)
+        finally:
+            if sink is not None:
+                sink.close()
+
+        print(f"Всего загружено записей: {total}")
+
+    if failed:
+        print(f"Не удалось загрузить файлов: {len(failed)}")
+        sys.exit(2)
+
+if __name__ == "__main__":
+    main()
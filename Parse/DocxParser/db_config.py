@@ -0,0 +1,117 @@
+import os
+import json
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Параметры подключения по умолчанию (локальная база разработки)
+DEFAULT_DB_PARAMS = {
+    "host": "localhost",
+    "port": "5432",
+    "database": "cable_db",
+    "user": "postgres",
+    "password": "test1"
+}
+
+# Файл с параметрами подключения: путь из DOCX_PARSER_DB_CONFIG
+# или db_config.json рядом с парсерами
+CONFIG_ENV = "DOCX_PARSER_DB_CONFIG"
+DEFAULT_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "db_config.json")
+
+# Стандартные переменные окружения libpq, переопределяющие параметры из файла
+ENV_PARAMS = {
+    "PGHOST": "host",
+    "PGPORT": "port",
+    "PGDATABASE": "database",
+    "PGUSER": "user",
+    "PGPASSWORD": "password"
+}
+
+def load_db_params(config_path=None):
+    """
+    Собирает параметры подключения к PostgreSQL: значения по умолчанию,
+    затем JSON файл конфигурации (config_path, путь из DOCX_PARSER_DB_CONFIG
+    или db_config.json, если он есть), затем переменные окружения PGHOST,
+    PGPORT, PGDATABASE, PGUSER и PGPASSWORD.
+    """
+    db_params = dict(DEFAULT_DB_PARAMS)
+
+    path = config_path or os.environ.get(CONFIG_ENV)
+    if path is None and os.path.exists(DEFAULT_CONFIG_PATH):
+        path = DEFAULT_CONFIG_PATH
+    if path:
+        with open(path, encoding='utf-8') as f:
+            db_params.update(json.load(f))
+
+    for env_name, param in ENV_PARAMS.items():
+        if os.environ.get(env_name):
+            db_params[param] = os.environ[env_name]
+    return db_params
+
+class SessionFactory:
+    """
+    Пул подключений к PostgreSQL (psycopg2.pool.ThreadedConnectionPool).
+    session() выдаёт подключение из пула и возвращает его обратно, откатив
+    незавершённую транзакцию, так что следующий документ получает
+    уже установленное подключение без повторного рукопожатия.
+    """
+
+    def __init__(self, db_params=None, minconn=1, maxconn=4):
+        import psycopg2.pool
+
+        self.db_params = db_params or load_db_params()
+        self.pool = psycopg2.pool.ThreadedConnectionPool(minconn, maxconn, **self.db_params)
+
+    @contextmanager
+    def session(self):
+        import psycopg2.extensions
+
+        conn = self.pool.getconn()
+        try:
+            yield conn
+        finally:
+            broken = conn.closed != 0
+            if not broken and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            self.pool.putconn(conn, close=broken)
+
+    def close(self):
+        self.pool.closeall()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+@contextmanager
+def db_session(db_params=None, conn=None, sessions=None):
+    """
+    Подключение для одного документа. Переданное соединение conn используется
+    как есть и остаётся открытым; при переданном пуле sessions подключение
+    берётся из него и возвращается после обработки; иначе открывается
+    новое подключение по db_params (или load_db_params()) и закрывается в конце.
+    """
+    if conn is not None:
+        yield conn
+        return
+
+    if sessions is not None:
+        with sessions.session() as conn:
+            yield conn
+        return
+
+    import psycopg2
+
+    try:
+        conn = psycopg2.connect(**(db_params or load_db_params()))
+        logger.info("Успешное подключение к базе данных PostgreSQL!")
+    except Exception as e:
+        logger.error(f"Ошибка подключения к PostgreSQL: {str(e)}")
+        raise
+
+    try:
+        yield conn
+    finally:
+        conn.close()
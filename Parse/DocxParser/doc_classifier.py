@@ -0,0 +1,49 @@
+import os
+import zipfile
+
+from id_xml_parser import find_id_in_archive
+from docx_tables import first_table_row
+from text_normalize import clean_cell_text
+
+# Начало шапки первой таблицы для каждого типа документа (тексты после clean_cell_text).
+# Шапки журналов совпадают с заголовками, по которым cable_parser определяет тип журнала;
+# у СВР вместо "Наименование" стоит "Наименование работ", поэтому она не принимается за ВР
+HEADER_SIGNATURES = [
+    ("КЖ", ("Номер кабеля",)),
+    ("КЖ", ("Обозначение кабеля, провода",)),
+    ("СО", ("Поз.", "Наименование и техническая характеристика")),
+    ("ВР", ("№ п/п", "Наименование", "Ед. изм.")),
+]
+
+def match_header(row):
+    """Тип документа по шапке первой таблицы или None"""
+    if not row:
+        return None
+    for doc_type, signature in HEADER_SIGNATURES:
+        if tuple(row[:len(signature)]) == signature:
+            return doc_type
+    return None
+
+def classify_archive(docx_zip, docx_name=''):
+    """
+    Определяет тип уже открытого документа: сначала по обозначению в футере,
+    а если его нет - по шапке первой таблицы.
+    Возвращает 'КЖ', 'СО', 'ВР' или None.
+    """
+    designation = find_id_in_archive(docx_zip, docx_name)
+    if designation:
+        return designation.doc_type
+    return match_header(first_table_row(docx_zip, clean_cell_text))
+
+def classify_file(docx_path):
+    """
+    Открывает документ один раз и определяет его тип.
+    Возвращает (тип или None, открытый zipfile.ZipFile). Архив можно сразу
+    передать парсеру вместо пути; закрывает его вызывающий код.
+    """
+    docx_zip = zipfile.ZipFile(docx_path, 'r')
+    try:
+        return classify_archive(docx_zip, os.path.basename(docx_path)), docx_zip
+    except Exception:
+        docx_zip.close()
+        raise
@@ -0,0 +1,221 @@
+import sys
+import logging
+import traceback
+from collections import namedtuple
+
+from bulk_writer import BulkWriter, natural_id
+from db_config import db_session
+from docx_tables import source_name
+from id_xml_parser import find_document_id
+from cable_parser import extract_cable_rows, CABLE_NATURAL_KEY
+from spec_parser import extract_equipment_rows, EQUIPMENT_NATURAL_KEY
+from SpecifiedWork_parser import extract_work_rows, SPECIFIED_WORK_NATURAL_KEY
+
+logger = logging.getLogger(__name__)
+
+# Естественные ключи таблиц: по ним строки новой редакции сопоставляются с записанными
+NATURAL_KEYS = {
+    "Cable": CABLE_NATURAL_KEY,
+    "Equipment": EQUIPMENT_NATURAL_KEY,
+    "SpecifiedWork": SPECIFIED_WORK_NATURAL_KEY
+}
+
+# Столбец, по которому определяются строки документа. У Equipment ссылки на документ
+# нет, поэтому строки, пропавшие из спецификации, не удаляются
+DOCUMENT_COLUMNS = {
+    "Cable": "ID_project_document",
+    "SpecifiedWork": "ID_project_document"
+}
+
+# ID_project_document при обычной записи (без upsert и diff): NULL в Cable
+# и пустая строка в SpecifiedWork, как до определения обозначения документа
+PLAIN_DOCUMENT_IDS = {
+    "Cable": None,
+    "SpecifiedWork": ""
+}
+
+# Типы документов, строки которых ссылаются на документ: ID_project_document входит
+# в естественные ключи Cable и SpecifiedWork
+DOCUMENT_ID_TYPES = ("КЖ", "ВР")
+
+ChangeSummary = namedtuple('ChangeSummary', ['inserted', 'updated', 'deleted', 'unchanged'])
+
+def document_id(doc_type, docx, required=False):
+    """
+    ID_project_document для строк документа КЖ или ВР: обозначение из футера
+    или имени файла (id_xml_parser.find_document_id); для СО - None.
+    С required (режимы upsert и diff) документ без обозначения отклоняется: иначе
+    строки с одинаковыми номерами из разных документов получили бы один natural_id.
+    """
+    if doc_type not in DOCUMENT_ID_TYPES:
+        return None
+    project_document_id = find_document_id(docx)
+    if project_document_id is None and required:
+        raise ValueError("не найдено обозначение документа (ДСиР-...) ни в футере, ни в имени файла: "
+                         "без ID_project_document запись по естественным ключам невозможна")
+    return project_document_id
+
+def document_column_index(table, columns):
+    """Позиция столбца DOCUMENT_COLUMNS в строках таблицы или None, если его нет"""
+    column = DOCUMENT_COLUMNS.get(table)
+    return list(columns).index(column) if column in columns else None
+
+def extract_document(doc_type, file_path, project_document_id=None, document_section_id=None,
+                     progress=None):
+    """
+    Разбирает документ нужного типа без записи в базу: {(таблица, столбцы): [строки, ...]}.
+    progress(количество таблиц, количество строк) вызывается после каждой таблицы.
+    """
+    if doc_type == "КЖ":
+        return extract_cable_rows(file_path, project_document_id, progress)
+    elif doc_type == "СО":
+        return extract_equipment_rows(file_path, progress)
+    elif doc_type == "ВР":
+        return extract_work_rows(file_path, project_document_id or "", document_section_id or "",
+                                 progress)
+    raise ValueError(f"Неизвестный тип документа: {doc_type}")
+
+def _stage_table(conn, table, batches):
+    """
+    Загружает новые строки таблицы во временную таблицу с идентификаторами
+    по естественному ключу. Возвращает (имя временной таблицы, столбец
+    идентификатора, столбцы данных, количество строк).
+    """
+    stage = f'{table}_diff_stage'
+    with conn.cursor() as cursor:
+        cursor.execute(f'CREATE TEMP TABLE IF NOT EXISTS "{stage}" '
+                       f'(LIKE "{table}" INCLUDING DEFAULTS); '
+                       f'TRUNCATE "{stage}"')
+
+    id_column = None
+    data_columns = []
+    staged = {}
+    for columns, rows in batches:
+        id_column = columns[0]
+        data_columns.extend(column for column in columns[1:] if column not in data_columns)
+        key_indexes = [columns.index(column) for column in NATURAL_KEYS[table]]
+        for row in rows:
+            row_id = natural_id(table, [row[i] for i in key_indexes])
+            # При повторе ключа остаётся последнее вхождение
+            staged.pop(row_id, None)
+            staged[row_id] = (columns, (row_id,) + tuple(row[1:]))
+
+    writers = {}
+    for columns, row in staged.values():
+        if columns not in writers:
+            writers[columns] = BulkWriter(conn, stage, columns)
+        writers[columns].add(row)
+    for writer in writers.values():
+        writer.flush()
+
+    return stage, id_column, data_columns, len(staged)
+
+def apply_document_diff(conn, batches, project_document_id=None):
+    """
+    Сравнивает новые строки документа {(таблица, столбцы): [строки, ...]}
+    с уже записанными и применяет только разницу: изменившиеся строки
+    обновляются, новые добавляются, а строки документа, которых больше нет,
+    удаляются. Строки сопоставляются по NATURAL_KEYS, сравнение выполняется
+    на стороне базы. Удаление возможно только при известном
+    project_document_id и только в таблицах из DOCUMENT_COLUMNS.
+    Транзакцию не фиксирует. Возвращает {таблица: ChangeSummary}.
+    """
+    by_table = {}
+    for (table, columns), rows in batches.items():
+        by_table.setdefault(table, []).append((tuple(columns), rows))
+
+    summary = {}
+    for table, table_batches in by_table.items():
+        stage, id_column, data_columns, staged_count = _stage_table(conn, table, table_batches)
+
+        id_ref = f'"{id_column}"'
+        assignments = ', '.join(f'"{column}" = s."{column}"' for column in data_columns)
+        target_values = ', '.join(f't."{column}"' for column in data_columns)
+        stage_values = ', '.join(f's."{column}"' for column in data_columns)
+        column_list = ', '.join(f'"{column}"' for column in [id_column] + data_columns)
+
+        with conn.cursor() as cursor:
+            deleted = 0
+            document_column = DOCUMENT_COLUMNS.get(table)
+            if document_column and project_document_id:
+                cursor.execute(
+                    f'DELETE FROM "{table}" t WHERE t."{document_column}" = %s '
+                    f'AND NOT EXISTS (SELECT 1 FROM "{stage}" s WHERE s.{id_ref} = t.{id_ref})',
+                    (project_document_id,))
+                deleted = cursor.rowcount
+
+            cursor.execute(
+                f'UPDATE "{table}" t SET {assignments} FROM "{stage}" s '
+                f'WHERE t.{id_ref} = s.{id_ref} '
+                f'AND ({target_values}) IS DISTINCT FROM ({stage_values})')
+            updated = cursor.rowcount
+
+            cursor.execute(
+                f'INSERT INTO "{table}" ({column_list}) SELECT {column_list} FROM "{stage}" s '
+                f'WHERE NOT EXISTS (SELECT 1 FROM "{table}" t WHERE t.{id_ref} = s.{id_ref})')
+            inserted = cursor.rowcount
+
+        summary[table] = ChangeSummary(inserted, updated, deleted,
+                                       staged_count - inserted - updated)
+
+    return summary
+
+def format_summary(summary):
+    """Строка с итогами изменений по таблицам"""
+    if not summary:
+        return "изменений нет"
+    return '; '.join(f"{table}: добавлено {changes.inserted}, изменено {changes.updated}, "
+                     f"удалено {changes.deleted}, без изменений {changes.unchanged}"
+                     for table, changes in summary.items())
+
+def diff_document(doc_type, file_path, conn, project_document_id=None, document_section_id=None,
+                  collected=None):
+    """
+    Разбирает документ и применяет к базе только изменения одной транзакцией.
+    Если project_document_id не задан, берётся обозначение документа (document_id):
+    без него строки, пропавшие из документа, нельзя было бы найти и удалить.
+    В словарь collected (если передан) добавляются разобранные строки.
+    Возвращает {таблица: ChangeSummary}.
+    """
+    if project_document_id is None:
+        project_document_id = document_id(doc_type, file_path, required=True)
+    batches = extract_document(doc_type, file_path, project_document_id, document_section_id)
+    try:
+        summary = apply_document_diff(conn, batches, project_document_id)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    if collected is not None:
+        for key, rows in batches.items():
+            collected.setdefault(key, []).extend(rows)
+    logger.info(f"Изменения по файлу {source_name(file_path)}: {format_summary(summary)}")
+    return summary
+
+if __name__ == "__main__":
+    from find_files import detect_doc_type
+
+    if len(sys.argv) < 2:
+        print("Использование: document_diff.py <файл.docx> [ID_project_document [ID_document_section]]")
+        sys.exit(1)
+
+    docx_file_path = sys.argv[1]
+    project_document_id = sys.argv[2] if len(sys.argv) > 2 else None
+    document_section_id = sys.argv[3] if len(sys.argv) > 3 else None
+
+    doc_type = detect_doc_type(docx_file_path)
+    if doc_type is None:
+        print(f"Не удалось определить тип документа: {docx_file_path}")
+        sys.exit(1)
+
+    try:
+        with db_session() as conn:
+            summary = diff_document(doc_type, docx_file_path, conn,
+                                    project_document_id, document_section_id)
+        print(f"{doc_type}: {format_summary(summary)}")
+        sys.exit(0)
+    except Exception as e:
+        logger.error(f"Critical error: {str(e)}")
+        traceback.print_exc()
+        sys.exit(2)
@@ -0,0 +1,303 @@
+import os
+import re
+import sys
+import time
+import sqlite3
+import zipfile
+import argparse
+from datetime import datetime
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+# Потоков обхода папок: os.scandir и stat отпускают GIL, а на сетевых дисках
+# время уходит на ожидание ответа, поэтому папки читаются параллельно
+DEFAULT_SCAN_THREADS = 8
+
+DEFAULT_MANIFEST_PATH = "manifest.sqlite"
+
+# Сколько классифицированных документов записывается в манифест одной транзакцией:
+# прерванное сканирование большого дерева не теряет уже сделанную работу
+MANIFEST_COMMIT_EVERY = 500
+
+# Номер проекта - последняя группа цифр шифра (ДСиР-2022-864 -> 864)
+PROJECT_NUMBER_RE = re.compile(r'(\d+)$')
+
+ScannedFile = namedtuple('ScannedFile', ['path', 'size', 'mtime_ns'])
+
+ManifestEntry = namedtuple('ManifestEntry', [
+    'path', 'folder', 'name', 'size', 'mtime_ns', 'doc_type', 'project_code',
+    'project_number', 'section', 'designation', 'detected_by', 'error'
+])
+
+def _scan_directory(directory, with_files=True):
+    """
+    Одна папка: (подпапки, файлы DOCX с размером и временем изменения).
+    Тип записи берётся из scandir без лишнего stat; ссылки на папки не обходятся.
+    """
+    from find_files import is_docx_candidate
+
+    subdirs = []
+    files = []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif with_files and is_docx_candidate(entry.name) and entry.is_file():
+                        stat = entry.stat()
+                        files.append(ScannedFile(entry.path, stat.st_size, stat.st_mtime_ns))
+                except OSError:
+                    continue
+    except OSError as e:
+        print(f"Не удалось прочитать папку {directory}: {e}")
+    return subdirs, files
+
+def walk_tree(root, threads=DEFAULT_SCAN_THREADS, with_files=True):
+    """
+    Обходит дерево папок root на любую глубину, читая папки в threads потоков.
+    Выдаёт (папка, файлы DOCX в ней) по мере чтения; порядок папок не задан.
+    """
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        pending = {executor.submit(_scan_directory, root, with_files): root}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                directory = pending.pop(future)
+                subdirs, files = future.result()
+                for subdir in subdirs:
+                    pending[executor.submit(_scan_directory, subdir, with_files)] = subdir
+                yield directory, files
+
+def find_kniga_folders(root, threads=DEFAULT_SCAN_THREADS):
+    """Папки "Книга" на любой глубине внутри root (и сама root, если это такая папка)"""
+    return sorted(directory for directory, _ in walk_tree(root, threads, with_files=False)
+                  if os.path.basename(directory.rstrip('/\\')).startswith("Книга"))
+
+def project_number(project_code):
+    match = PROJECT_NUMBER_RE.search(project_code or '')
+    return match.group(1) if match else None
+
+def classify_document(scanned):
+    """
+    Определяет обозначение и тип документа. Источник (detected_by):
+    'footer' - обозначение в футере, 'header' - шапка первой таблицы,
+    'name' - обозначение или тип в имени файла, '' - тип не определён.
+    Возвращает ManifestEntry; ошибка чтения архива сохраняется в поле error.
+    """
+    from id_xml_parser import designation_from_name, find_id_in_archive
+    from doc_classifier import match_header
+    from docx_tables import first_table_row
+    from text_normalize import clean_cell_text
+
+    path = scanned.path
+    name = os.path.basename(path)
+    designation = None
+    doc_type = None
+    detected_by = ''
+    error = None
+    try:
+        with zipfile.ZipFile(path, 'r') as docx_zip:
+            designation = find_id_in_archive(docx_zip, name)
+            if designation:
+                doc_type, detected_by = designation.doc_type, 'footer'
+            else:
+                doc_type = match_header(first_table_row(docx_zip, clean_cell_text))
+                detected_by = 'header' if doc_type else ''
+    except Exception as e:
+        error = str(e) or type(e).__name__
+
+    # Шифр проекта и раздел, если их нет в футере, берутся из имени файла
+    if designation is None:
+        designation = designation_from_name(name)
+        if designation is not None and not doc_type:
+            doc_type, detected_by = designation.doc_type, 'name'
+
+    return ManifestEntry(
+        path=path,
+        folder=os.path.dirname(path),
+        name=name,
+        size=scanned.size,
+        mtime_ns=scanned.mtime_ns,
+        doc_type=doc_type or '',
+        project_code=designation and designation.project_code,
+        project_number=project_number(designation and designation.project_code),
+        section=designation and designation.section,
+        designation=designation and designation.text,
+        detected_by=detected_by,
+        error=error
+    )
+
+class DocumentManifest:
+    """
+    Постоянный индекс документов DOCX в файле SQLite: путь, размер и время
+    изменения, тип (КЖ/СО/ВР или '') и обозначение (шифр и номер проекта, раздел).
+    refresh() обходит дерево и классифицирует заново только новые и изменённые
+    файлы; выборки по проекту и типу (find) идут по индексу без обхода диска.
+    """
+
+    def __init__(self, path=DEFAULT_MANIFEST_PATH):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS documents (
+                path TEXT PRIMARY KEY,
+                folder TEXT NOT NULL,
+                name TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                doc_type TEXT NOT NULL,
+                project_code TEXT,
+                project_number TEXT,
+                section TEXT,
+                designation TEXT,
+                detected_by TEXT NOT NULL,
+                error TEXT,
+                scanned_at TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS documents_project_type ON documents (project_number, doc_type);
+            CREATE INDEX IF NOT EXISTS documents_code_type ON documents (project_code, doc_type);
+            CREATE INDEX IF NOT EXISTS documents_type ON documents (doc_type);
+            CREATE INDEX IF NOT EXISTS documents_folder ON documents (folder);
+        """)
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    @staticmethod
+    def _under(root):
+        """Условие "путь внутри root" (LIKE не подходит: в именах файлов бывают _ и %)"""
+        prefix = os.path.join(root, '')
+        return 'substr(path, 1, ?) = ?', (len(prefix), prefix)
+
+    def known_files(self, root):
+        """Запомненные {путь: (размер, время изменения)} для файлов внутри root"""
+        condition, params = self._under(root)
+        return {path: (size, mtime_ns) for path, size, mtime_ns in self.conn.execute(
+            f'SELECT path, size, mtime_ns FROM documents WHERE {condition}', params)}
+
+    def store(self, entries):
+        scanned_at = datetime.now().isoformat(timespec='seconds')
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO documents (path, folder, name, size, mtime_ns, doc_type, '
+            'project_code, project_number, section, designation, detected_by, error, scanned_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            [tuple(entry) + (scanned_at,) for entry in entries])
+        self.conn.commit()
+
+    def remove(self, paths):
+        self.conn.executemany('DELETE FROM documents WHERE path = ?', [(path,) for path in paths])
+        self.conn.commit()
+
+    def refresh(self, root, jobs=1, threads=DEFAULT_SCAN_THREADS):
+        """
+        Приводит манифест в соответствие с деревом root: новые и изменённые файлы
+        классифицируются (в jobs процессов), исчезнувшие удаляются из индекса.
+        Возвращает (найдено файлов, классифицировано, удалено).
+        """
+        root = os.path.abspath(root)
+        known = self.known_files(root)
+        seen = set()
+        changed = []
+        for _, files in walk_tree(root, threads):
+            for scanned in files:
+                seen.add(scanned.path)
+                if known.get(scanned.path) != (scanned.size, scanned.mtime_ns):
+                    changed.append(scanned)
+
+        removed = [path for path in known if path not in seen]
+        if removed:
+            self.remove(removed)
+
+        changed.sort()
+        if jobs > 1 and len(changed) > 1:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                self._store_in_batches(executor.map(classify_document, changed, chunksize=16))
+        else:
+            self._store_in_batches(map(classify_document, changed))
+        return len(seen), len(changed), len(removed)
+
+    def _store_in_batches(self, entries):
+        batch = []
+        for entry in entries:
+            if entry.error:
+                print(f"Ошибка при анализе файла {entry.path}: {entry.error}")
+            batch.append(entry)
+            if len(batch) >= MANIFEST_COMMIT_EVERY:
+                self.store(batch)
+                batch = []
+        if batch:
+            self.store(batch)
+
+    def find(self, project=None, doc_type=None, root=None):
+        """
+        Документы из манифеста в порядке путей. project - номер проекта (864)
+        или полный шифр (ДСиР-2022-864), doc_type - 'КЖ', 'СО' или 'ВР',
+        root - только файлы внутри этой папки. Возвращает список ManifestEntry.
+        """
+        conditions = []
+        params = []
+        if project:
+            conditions.append('project_number = ?' if project.isdigit() else 'project_code = ?')
+            params.append(project)
+        if doc_type:
+            conditions.append('doc_type = ?')
+            params.append(doc_type)
+        if root:
+            condition, root_params = self._under(os.path.abspath(root))
+            conditions.append(condition)
+            params.extend(root_params)
+        where = f' WHERE {" AND ".join(conditions)}' if conditions else ''
+        columns = ', '.join(ManifestEntry._fields)
+        return [ManifestEntry(*row) for row in self.conn.execute(
+            f'SELECT {columns} FROM documents{where} ORDER BY path', params)]
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Индекс документов DOCX в дереве проекта: обозначение и тип КЖ/СО/ВР")
+    parser.add_argument("--manifest", default=DEFAULT_MANIFEST_PATH, metavar="FILE",
+                        help=f"файл манифеста SQLite (по умолчанию {DEFAULT_MANIFEST_PATH})")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    scan = commands.add_parser("scan", help="обойти дерево и обновить манифест")
+    scan.add_argument("root", help="папка проекта (обходится на любую глубину)")
+    scan.add_argument("--jobs", "-j", type=int, default=1,
+                      help="процессов для определения типа документов (по умолчанию 1)")
+    scan.add_argument("--threads", type=int, default=DEFAULT_SCAN_THREADS,
+                      help=f"потоков для чтения папок (по умолчанию {DEFAULT_SCAN_THREADS})")
+
+    query = commands.add_parser("query", help="найти документы в манифесте без обхода диска")
+    query.add_argument("--project", help="номер проекта (864) или шифр (ДСиР-2022-864)")
+    query.add_argument("--type", dest="doc_type", choices=["КЖ", "СО", "ВР"], help="тип документа")
+    query.add_argument("--root", help="только документы внутри этой папки")
+    args = parser.parse_args()
+
+    if args.command == "scan":
+        if not os.path.isdir(args.root):
+            print("Указанный путь не существует или не является папкой")
+            sys.exit(1)
+        if args.jobs < 1 or args.threads < 1:
+            print("Количество процессов и потоков должно быть не меньше 1")
+            sys.exit(1)
+
+        started = time.perf_counter()
+        with DocumentManifest(args.manifest) as manifest:
+            found, classified, removed = manifest.refresh(args.root, args.jobs, args.threads)
+        print(f"Файлов DOCX: {found}, классифицировано: {classified}, удалено из индекса: {removed} "
+              f"({time.perf_counter() - started:.2f} с)")
+        return
+
+    with DocumentManifest(args.manifest) as manifest:
+        entries = manifest.find(args.project, args.doc_type, args.root)
+    for entry in entries:
+        print(f"{entry.doc_type or '-'}\t{entry.designation or '-'}\t{entry.path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+import zipfile
+import posixpath
+from lxml import etree
+
+W_NS = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+REL_NS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+OFFICE_DOCUMENT_REL_TYPE = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument'
+DEFAULT_DOCUMENT_PART = 'word/document.xml'
+
+def _w(tag):
+    return f'{{{W_NS}}}{tag}'
+
+W_BODY = _w('body')
+W_TBL = _w('tbl')
+W_TR = _w('tr')
+W_TC = _w('tc')
+W_P = _w('p')
+W_R = _w('r')
+W_T = _w('t')
+W_HYPERLINK = _w('hyperlink')
+W_TAB = _w('tab')
+W_PTAB = _w('ptab')
+W_BR = _w('br')
+W_CR = _w('cr')
+W_NO_BREAK_HYPHEN = _w('noBreakHyphen')
+W_TBL_GRID = _w('tblGrid')
+W_GRID_COL = _w('gridCol')
+W_TR_PR = _w('trPr')
+W_TC_PR = _w('tcPr')
+W_GRID_BEFORE = _w('gridBefore')
+W_GRID_SPAN = _w('gridSpan')
+W_V_MERGE = _w('vMerge')
+W_VAL = _w('val')
+W_TYPE = _w('type')
+
+def main_document_part(docx_zip):
+    """Возвращает имя основной части документа (обычно word/document.xml)"""
+    try:
+        rels_root = etree.fromstring(docx_zip.read('_rels/.rels'))
+    except (KeyError, etree.XMLSyntaxError):
+        return DEFAULT_DOCUMENT_PART
+
+    for rel in rels_root.iter(f'{{{REL_NS}}}Relationship'):
+        if rel.get('Type') == OFFICE_DOCUMENT_REL_TYPE:
+            return posixpath.normpath(rel.get('Target', '').lstrip('/'))
+    return DEFAULT_DOCUMENT_PART
+
+def source_name(source):
+    """Имя файла для сообщений: путь или имя файла открытого zipfile.ZipFile"""
+    if isinstance(source, zipfile.ZipFile):
+        return source.filename
+    return source
+
+def open_archive(source):
+    """
+    Открывает DOCX для чтения. Уже открытый zipfile.ZipFile возвращается как есть;
+    закрывать архив нужно, только если source - путь.
+    """
+    if isinstance(source, zipfile.ZipFile):
+        return source
+    return zipfile.ZipFile(source, 'r')
+
+def _run_text(r):
+    """Текст прогона w:r так же, как его возвращает python-docx Run.text"""
+    parts = []
+    for child in r.iterchildren():
+        tag = child.tag
+        if tag == W_T:
+            parts.append(child.text or '')
+        elif tag == W_TAB or tag == W_PTAB:
+            parts.append('\t')
+        elif tag == W_BR:
+            # Разрывы страницы и колонки текста не дают
+            if child.get(W_TYPE, 'textWrapping') == 'textWrapping':
+                parts.append('\n')
+        elif tag == W_CR:
+            parts.append('\n')
+        elif tag == W_NO_BREAK_HYPHEN:
+            parts.append('-')
+    return ''.join(parts)
+
+def _cell_text(tc):
+    """Текст ячейки w:tc так же, как его возвращает python-docx _Cell.text"""
+    paragraphs = []
+    for p in tc.iterchildren(W_P):
+        parts = []
+        for child in p.iterchildren(W_R, W_HYPERLINK):
+            if child.tag == W_R:
+                parts.append(_run_text(child))
+            else:
+                parts.extend(_run_text(r) for r in child.iterchildren(W_R))
+        paragraphs.append(''.join(parts))
+    return '\n'.join(paragraphs)
+
+def _int_val(element, default):
+    if element is None:
+        return default
+    try:
+        return int(element.get(W_VAL))
+    except (TypeError, ValueError):
+        return default
+
+def _read_row(tr, above, normalize=None):
+    """
+    Строит одну строку таблицы. above - ячейки предыдущей строки
+    {смещение в сетке: (текст, ширина)} для продолжений vMerge.
+    Возвращает (строка, ячейки этой строки для следующей).
+    """
+    tr_pr = tr.find(W_TR_PR)
+    offset = _int_val(tr_pr.find(W_GRID_BEFORE) if tr_pr is not None else None, 0)
+    current = {}
+    row = []
+
+    for tc in tr.iterchildren(W_TC):
+        tc_pr = tc.find(W_TC_PR)
+        span = 1
+        v_merge = None
+        if tc_pr is not None:
+            span = _int_val(tc_pr.find(W_GRID_SPAN), 1)
+            v_merge_el = tc_pr.find(W_V_MERGE)
+            if v_merge_el is not None:
+                v_merge = v_merge_el.get(W_VAL, 'continue')
+
+        if v_merge == 'continue' and offset in above:
+            text, cell_span = above[offset]
+        else:
+            text = _cell_text(tc)
+            if normalize is not None:
+                text = normalize(text)
+            cell_span = span
+
+        row.extend([text] * cell_span)
+        current[offset] = (text, cell_span)
+        offset += span
+
+    return row, current
+
+def read_rows(tbl, normalize=None):
+    """
+    Строит строки таблицы w:tbl за один проход.
+    Ячейка с gridSpan повторяется по числу занятых столбцов сетки, продолжение
+    вертикального объединения (vMerge) получает текст верхней ячейки -
+    так же, как в python-docx row.cells. normalize применяется к тексту
+    каждой ячейки один раз.
+    """
+    rows = []
+    # Смещение в сетке -> (текст, ширина) ячейки, начинающейся в предыдущей строке
+    above = {}
+    for tr in tbl.iterchildren(W_TR):
+        row, above = _read_row(tr, above, normalize)
+        rows.append(row)
+    return rows
+
+def grid_width(tbl):
+    """Количество столбцов сетки таблицы (w:tblGrid), 0 если сетка не задана"""
+    grid = tbl.find(W_TBL_GRID)
+    return len(grid.findall(W_GRID_COL)) if grid is not None else 0
+
+def _body_table(tr):
+    """Таблица верхнего уровня, которой принадлежит строка w:tr, или None для вложенных"""
+    tbl = tr.getparent()
+    if tbl is None or tbl.tag != W_TBL:
+        return None
+    body = tbl.getparent()
+    if body is None or body.tag != W_BODY:
+        return None
+    return tbl
+
+def _iter_body_tables(stream, normalize=None, accept=None):
+    """
+    Потоково выдаёт элементы w:tbl верхнего уровня тела документа.
+    Если задан accept, он получает первую строку каждой таблицы (тексты
+    после normalize) сразу после её разбора; строки отклонённой таблицы
+    освобождаются по мере чтения, и сама таблица не выдаётся.
+    """
+    tags = W_TBL if accept is None else (W_TR, W_TBL)
+    current = None
+    accepted = False
+
+    for _, element in etree.iterparse(stream, events=('end',), tag=tags, huge_tree=True):
+        if element.tag == W_TR:
+            tbl = _body_table(element)
+            if tbl is None:
+                continue
+            if tbl is not current:
+                # Первая строка таблицы: пока разобрана только она
+                current = tbl
+                accepted = bool(accept(read_rows(tbl, normalize)[0]))
+            if not accepted:
+                # Вложенные таблицы отклонённой строки освобождаются вместе с ней
+                element.clear()
+                while element.getprevious() is not None and element.getprevious().tag == W_TR:
+                    tbl.remove(element.getprevious())
+            continue
+
+        tbl = element
+        parent = tbl.getparent()
+        # Вложенные таблицы читаются вместе с родительской
+        if parent is None or parent.tag != W_BODY:
+            continue
+
+        # Таблица без строк фильтр не проходит
+        if accept is None or (tbl is current and accepted):
+            yield tbl
+
+        # Освобождаем обработанную таблицу и всё, что было до неё
+        tbl.clear()
+        while tbl.getprevious() is not None:
+            del parent[0]
+
+def _iter_body_rows(stream, normalize=None, accept=None):
+    """
+    Потоково выдаёт строки таблиц верхнего уровня по мере разбора XML:
+    (номер таблицы, ширина таблицы, строка), где ширина - длина самой длинной
+    строки таблицы, как при разборе таблиц целиком. Если первая строка
+    занимает всю сетку (w:tblGrid), её длина и есть ширина, и строки выдаются
+    сразу после чтения - в памяти держится одна строка, а не таблица. Строки
+    таблицы, сетка которой шире первой строки, копятся до конца таблицы,
+    пока не станет известна самая длинная из них.
+    accept - фильтр по первой строке, как в _iter_body_tables; номера
+    получают только принятые таблицы.
+    """
+    table_index = -1
+    current = None
+    accepted = False
+    width = 0
+    above = {}
+    # Строки таблицы, ширина которой станет известна только в её конце
+    pending = None
+
+    for _, element in etree.iterparse(stream, events=('end',), tag=(W_TR, W_TBL), huge_tree=True):
+        if element.tag == W_TR:
+            tbl = _body_table(element)
+            if tbl is None:
+                continue
+            if tbl is not current:
+                current = tbl
+                row, above = _read_row(element, {}, normalize)
+                accepted = accept is None or bool(accept(row))
+                if accepted:
+                    table_index += 1
+                    width = len(row)
+                    if width < grid_width(tbl):
+                        pending = [row]
+                    else:
+                        yield table_index, width, row
+            elif accepted:
+                row, above = _read_row(element, above, normalize)
+                if pending is not None:
+                    pending.append(row)
+                else:
+                    yield table_index, width, row
+
+            # Освобождаем прочитанную строку и строки до неё
+            element.clear()
+            while element.getprevious() is not None and element.getprevious().tag == W_TR:
+                tbl.remove(element.getprevious())
+            continue
+
+        if element is current and pending is not None:
+            width = max(len(row) for row in pending)
+            for row in pending:
+                yield table_index, width, row
+            pending = None
+
+        parent = element.getparent()
+        if parent is None or parent.tag != W_BODY:
+            continue
+        element.clear()
+        while element.getprevious() is not None:
+            del parent[0]
+
+def first_table_row(docx_zip, normalize=None):
+    """
+    Первая строка первой таблицы тела документа (например, шапка журнала).
+    Разбор word/document.xml останавливается сразу после этой строки,
+    поэтому остальная часть документа не читается.
+    Возвращает список текстов ячеек или None, если таблиц нет.
+    """
+    with docx_zip.open(main_document_part(docx_zip)) as stream:
+        for _, tr in etree.iterparse(stream, events=('end',), tag=W_TR, huge_tree=True):
+            tbl = _body_table(tr)
+            if tbl is not None:
+                # Пока разобрана только первая строка, таблица состоит из неё одной
+                return read_rows(tbl, normalize)[0]
+    return None
+
+def iter_tables(source, normalize=None, accept=None):
+    """
+    Потоково читает word/document.xml и выдаёт таблицы верхнего уровня
+    (как doc.tables в python-docx) в виде списков строк со списками текстов ячеек.
+    source - путь к DOCX файлу или уже открытый zipfile.ZipFile.
+    accept - необязательный фильтр по первой строке таблицы: остальные строки
+    строятся только для таблиц, для которых он вернул True.
+    """
+    if isinstance(source, zipfile.ZipFile):
+        with source.open(main_document_part(source)) as stream:
+            for tbl in _iter_body_tables(stream, normalize, accept):
+                yield read_rows(tbl, normalize)
+        return
+
+    with zipfile.ZipFile(source, 'r') as docx_zip:
+        yield from iter_tables(docx_zip, normalize, accept)
+
+def iter_table_rows(source, normalize=None, accept=None):
+    """
+    Потоковый вариант iter_tables для больших документов: выдаёт строки
+    по одной в виде (номер таблицы, ширина таблицы, строка), не собирая
+    таблицы целиком (см. _iter_body_rows). Ширина - длина самой длинной строки
+    таблицы, по ней выравнивались строки при разборе таблиц целиком.
+    source и accept - как в iter_tables.
+    """
+    if isinstance(source, zipfile.ZipFile):
+        with source.open(main_document_part(source)) as stream:
+            yield from _iter_body_rows(stream, normalize, accept)
+        return
+
+    with zipfile.ZipFile(source, 'r') as docx_zip:
+        yield from iter_table_rows(docx_zip, normalize, accept)
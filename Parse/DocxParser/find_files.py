@@ -1,19 +1,66 @@
 import os
 import sys
-import subprocess
-from id_xml_parser import find_id
+import argparse
+from doc_classifier import classify_file
 
-def find_files_in_directory(directory):
-    """Поиск файлов по типам СО, КЖ, ВР в указанной директории"""
+def detect_doc_type(path):
+    """Тип документа по обозначению в футере и шапке таблицы, а если их нет - по имени файла"""
+    doc_type, docx_zip = classify_file(path)
+    docx_zip.close()
+    if doc_type:
+        return doc_type
+    return doc_type_from_name(os.path.basename(path))
+
+def doc_type_from_name(filename):
+    """Тип документа по имени файла: КЖ, СО, ВР (но не СВР) или None"""
+    if "КЖ" in filename:
+        return "КЖ"
+    if "СО" in filename:
+        return "СО"
+    if "ВР" in filename and "СВР" not in filename:
+        return "ВР"
+    return None
+
+def find_document_type(path, cache=None):
+    """
+    Тип одного документа так же, как при выборе документов папки: сначала
+    по имени файла, затем по содержимому (с кэшем результатов, если он передан).
+    Возвращает КЖ, СО, ВР или None.
+    """
+    doc_type = doc_type_from_name(os.path.basename(path))
+    if doc_type:
+        return doc_type
+    doc_type = cache.doc_type(path) if cache is not None else None
+    if doc_type is None:
+        doc_type, docx_zip = classify_file(path)
+        docx_zip.close()
+        if cache is not None:
+            cache.store_doc_type(path, doc_type)
+    return doc_type or None
+
+def is_docx_candidate(filename):
+    """Файл DOCX, который может быть документом (временные файлы Word ~$... пропускаются)"""
+    return filename.lower().endswith('.docx') and not filename.startswith('~$')
+
+def find_files_in_directory(directory, cache=None, archives=None):
+    """
+    Поиск файлов по типам СО, КЖ, ВР в указанной директории.
+    Если передан кэш результатов (result_cache.ResultCache), тип документа
+    по содержимому берётся из него и определяется заново только для новых
+    и изменённых файлов.
+    Если передан словарь archives, архивы, открытые для определения типа
+    по содержимому, не закрываются, а сохраняются в нём по пути файла для
+    передачи парсерам; закрывает их вызывающий код.
+    """
     found_files = {}
     all_docx_files = []
     
-    # Собираем все docx файлы, исключая временные
-    for item in os.listdir(directory):
-        if (os.path.isfile(os.path.join(directory, item)) and 
-            item.lower().endswith('.docx') and 
-            not item.startswith('~$')):
-            all_docx_files.append(item)
+    # Собираем все docx файлы, исключая временные (тип записи scandir берёт без stat)
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if is_docx_candidate(entry.name) and entry.is_file():
+                all_docx_files.append(entry.name)
+    all_docx_files.sort()
     
     # Сначала ищем по имени файла
     for filename in all_docx_files:
@@ -41,19 +88,23 @@ def find_files_in_directory(directory):
                 continue
                 
             try:
-                designation = find_id(filepath)
-                if designation:
-                    for doc_type in missing_types[:]:
-                        if doc_type == "ВР":
-                            # Для ВР проверяем, что это не СВР
-                            if "ВР" in designation and "СВР" not in designation:
-                                found_files["ВР"] = filepath
-                                missing_types.remove("ВР")
-                                break
-                        elif doc_type in designation:
-                            found_files[doc_type] = filepath
-                            missing_types.remove(doc_type)
-                            break
+                doc_type = cache.doc_type(filepath) if cache is not None else None
+                if doc_type is None:
+                    # Архив открывается один раз: тип определяется по футеру
+                    # и шапке таблицы, а сам архив может сразу уйти парсеру
+                    doc_type, docx_zip = classify_file(filepath)
+                    doc_type = doc_type or ''
+                    if cache is not None:
+                        cache.store_doc_type(filepath, doc_type)
+                    if archives is not None and doc_type in missing_types:
+                        archives[filepath] = docx_zip
+                    else:
+                        docx_zip.close()
+                # СВР и прочие типы в обозначение и сигнатуры шапок не попадают,
+                # поэтому достаточно сравнить тип документа
+                if doc_type in missing_types:
+                    found_files[doc_type] = filepath
+                    missing_types.remove(doc_type)
             except Exception as e:
                 print(f"Ошибка при анализе файла {filename}: {e}")
                 continue
@@ -61,51 +112,100 @@ def find_files_in_directory(directory):
     return found_files
 
 def main():
-    if len(sys.argv) != 2:
-        print("Использование: python find_files.py <путь_к_папке>")
-        sys.exit(1)
-    
-    path = sys.argv[1]
+    parser = argparse.ArgumentParser(
+        description="Поиск и импорт документов КЖ/СО/ВР из папок \"Книга\"")
+    parser.add_argument("path", help="путь к папке \"Книга\" или к папке проекта")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="количество параллельных процессов обработки (по умолчанию 1)")
+    parser.add_argument("--cache", metavar="FILE",
+                        help="файл кэша результатов: неизменённые документы не разбираются повторно")
+    parser.add_argument("--replay", action="store_true",
+                        help="записывать в базу строки неизменённых документов из кэша вместо пропуска")
+    parser.add_argument("--upsert", action="store_true",
+                        help="обновлять строки по естественным ключам вместо добавления копий при повторном импорте")
+    parser.add_argument("--diff", action="store_true",
+                        help="сравнивать документ с записанными строками и применять только изменения")
+    parser.add_argument("--export", metavar="DIR",
+                        help="не писать в базу, а выгрузить строки в папку для загрузки columnar_loader.py")
+    parser.add_argument("--format", choices=["parquet", "arrow"], default="parquet",
+                        help="формат выгрузки для --export (по умолчанию parquet)")
+    parser.add_argument("--metrics", metavar="FILE",
+                        help="сохранить замеры по этапам и счётчики: *.prom - текстовый формат Prometheus, иначе JSON")
+    parser.add_argument("--sink", default="postgres",
+                        help="куда писать строки: postgres (по умолчанию), sqlite:ФАЙЛ, ndjson (stdout) или ndjson:ФАЙЛ")
+    args = parser.parse_args()
+
+    path = args.path
     if not os.path.isdir(path):
         print("Указанный путь не существует или не является папкой")
         sys.exit(1)
+    if args.jobs < 1:
+        print("Количество процессов должно быть не меньше 1")
+        sys.exit(1)
+    if args.replay and not args.cache:
+        print("Для --replay нужно указать файл кэша (--cache)")
+        sys.exit(1)
+    if args.export and (args.cache or args.diff or args.upsert):
+        print("--export нельзя совмещать с --cache, --diff и --upsert: режим записи задаётся при загрузке")
+        sys.exit(1)
+    if args.sink != "postgres" and (args.export or args.diff or args.jobs > 1):
+        print("--sink, отличный от postgres, работает только в одном процессе без --export и --diff")
+        sys.exit(1)
     
     folder_name = os.path.basename(path.rstrip('/\\'))
     
     if folder_name.startswith("Книга"):
-        found_files = find_files_in_directory(path)
-        print(f"Найдены файлы в папке {folder_name}: {found_files}")
-        
-        # Запускаем обработку найденных файлов
-        for doc_type, file_path in found_files.items():
-            try:
-                if doc_type == "КЖ":
-                    subprocess.run([sys.executable, "cable_parser.py", file_path], check=True)
-                elif doc_type == "СО":
-                    subprocess.run([sys.executable, "spec_parser.py", file_path], check=True)
-                elif doc_type == "ВР":
-                    subprocess.run([sys.executable, "SpecifiedWork_parser.py", file_path], check=True)
-            except subprocess.CalledProcessError as e:
-                print(f"Ошибка при обработке файла {file_path}: {e}")
+        folders = [path]
     else:
-        # Обрабатываем все подпапки, начинающиеся с "Книга"
-        for item in os.listdir(path):
-            item_path = os.path.join(path, item)
-            if os.path.isdir(item_path) and item.startswith("Книга"):
-                found_files = find_files_in_directory(item_path)
-                print(f"Найдены файлы в папке {item}: {found_files}")
-                
-                # Запускаем обработку найденных файлов
-                for doc_type, file_path in found_files.items():
-                    try:
-                        if doc_type == "КЖ":
-                            subprocess.run([sys.executable, "cable_parser.py", file_path], check=True)
-                        elif doc_type == "СО":
-                            subprocess.run([sys.executable, "spec_parser.py", file_path], check=True)
-                        elif doc_type == "ВР":
-                            subprocess.run([sys.executable, "SpecifiedWork_parser.py", file_path], check=True)
-                    except subprocess.CalledProcessError as e:
-                        print(f"Ошибка при обработке файла {file_path}: {e}")
+        # Обрабатываем все папки, начинающиеся с "Книга", на любой глубине
+        from document_manifest import find_kniga_folders
+        folders = find_kniga_folders(path)
+
+    # Парсеры импортируются один раз: при --jobs 1 документы обрабатываются
+    # в этом же процессе с общим подключением к БД, иначе - пулом процессов
+    from batch_runner import run_batch, run_parallel, run_export, DB_PARAMS
+    from sinks import cache_target, console_output, create_sink
+    from metrics import MetricsReport
+    report = MetricsReport() if args.metrics else None
+    if args.export:
+        failed = run_export(folders, args.export, args.format, args.jobs, report)
+        if report is not None:
+            report.write(args.metrics)
+        if failed:
+            print(f"Не удалось разобрать файлов: {len(failed)}")
+            sys.exit(2)
+        return
+
+    try:
+        sink = create_sink(args.sink)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+
+    cache = None
+    if args.cache:
+        from result_cache import ResultCache
+        cache = ResultCache(args.cache, cache_target(sink, DB_PARAMS))
+
+    try:
+        if args.jobs > 1:
+            failed = run_parallel(folders, DB_PARAMS, args.jobs, cache, args.replay, args.upsert,
+                                  args.diff, report)
+        else:
+            with console_output(sink):
+                failed = run_batch(folders, DB_PARAMS, cache, args.replay, args.upsert, args.diff,
+                                   sink, report)
+    finally:
+        if cache is not None:
+            cache.close()
+        if sink is not None:
+            sink.close()
+        if report is not None:
+            report.write(args.metrics)
+
+    if failed:
+        print(f"Не удалось обработать файлов: {len(failed)}")
+        sys.exit(2)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
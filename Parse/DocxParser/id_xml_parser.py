@@ -1,82 +1,185 @@
 import xml.etree.ElementTree as ET
 import zipfile
+from collections import namedtuple
+import posixpath
+import re
 import os
-import shutil
+import logging
 
-def find_id(docx_path, output_folder='TestDocToXml'):
+logger = logging.getLogger(__name__)
+
+W_NS = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+REL_NS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+FOOTER_REL_TYPE = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/footer'
+DOCUMENT_RELS = 'word/_rels/document.xml.rels'
+W_T = f'{{{W_NS}}}t'
+
+# Обозначение вида ДСиР-2022-864-Р-8.1.2-КЖ: шифр проекта, раздел и тип документа.
+# Тип не должен продолжаться буквами, чтобы СВР, СВОРиС и т.п. не принимались за ВР/СО
+DESIGNATION_RE = re.compile(
+    r'(?P<project_code>ДСиР-\d{4}-\d+)-(?P<section>.+?)[-._]'
+    r'(?P<doc_type>КЖ|СО|ВР)(?![А-ЯЁа-яё])'
+)
+
+Designation = namedtuple('Designation', ['project_code', 'section', 'doc_type', 'text'])
+
+def _natural_key(name):
+    """Ключ сортировки, при котором footer2.xml идёт раньше footer10.xml"""
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', name)]
+
+def footer_parts(docx_zip):
     """
-    Обрабатывает DOCX файл для поиска информации в футерах.
-    Возвращает найденное слово или None, если ничего не найдено.
+    Возвращает имена частей футеров внутри архива DOCX.
+    Футеры берутся из связей word/_rels/document.xml.rels, а если их нет -
+    из списка файлов word/footer*.xml.
+    """
+    names = set(docx_zip.namelist())
+    parts = []
+
+    if DOCUMENT_RELS in names:
+        try:
+            rels_root = ET.fromstring(docx_zip.read(DOCUMENT_RELS))
+        except ET.ParseError:
+            logger.warning(f"Ошибка парсинга {DOCUMENT_RELS}")
+            rels_root = None
+
+        if rels_root is not None:
+            for rel in rels_root.iter(f'{{{REL_NS}}}Relationship'):
+                if rel.get('Type') != FOOTER_REL_TYPE or rel.get('TargetMode') == 'External':
+                    continue
+                target = rel.get('Target', '')
+                # Цель задаётся относительно папки word/ либо от корня пакета
+                if target.startswith('/'):
+                    part = target.lstrip('/')
+                else:
+                    part = posixpath.normpath(posixpath.join('word', target))
+                if part in names and part not in parts:
+                    parts.append(part)
+
+    if not parts:
+        parts = [name for name in names
+                 if name.startswith('word/footer') and name.endswith('.xml')]
+
+    return sorted(parts, key=_natural_key)
+
+def extract_designation(footer_stream, max_parts=8):
+    """
+    Потоково ищет обозначение документа (ДСиР...-КЖ/СО/ВР) в XML футера.
+    Текстовые узлы w:t разбираются по мере чтения и сразу очищаются,
+    разбор прекращается, как только обозначение собрано полностью.
+    Возвращает Designation или None.
+    """
+    word = None
+    parts = 0
+
+    for _, elem in ET.iterparse(footer_stream, events=('end',)):
+        if elem.tag != W_T:
+            elem.clear()
+            continue
+
+        text = elem.text if elem.text else ''
+        elem.clear()
+
+        if 'ДСиР' in text:
+            # Каждое вхождение "ДСиР" начинает новое обозначение
+            word = text
+            parts = 1
+        elif word is not None and text.strip():  # Пропускаем пустые строки
+            word += text
+            parts += 1
+        else:
+            continue
+
+        match = DESIGNATION_RE.search(word)
+        if match:
+            return Designation(
+                project_code=match.group('project_code'),
+                section=match.group('section'),
+                doc_type=match.group('doc_type'),
+                text=match.group(0),
+            )
+
+        # Обозначение разбито не более чем на несколько узлов
+        if parts >= max_parts:
+            word = None
+
+    return None
+
+def find_id_in_archive(docx_zip, docx_name=''):
+    """
+    Ищет обозначение документа в футерах уже открытого архива DOCX.
+    Части футеров читаются прямо из архива, на диск ничего не пишется.
+    """
+    for part in footer_parts(docx_zip):
+        try:
+            with docx_zip.open(part) as footer_stream:
+                designation = extract_designation(footer_stream)
+        except ET.ParseError:
+            logger.warning(f"Ошибка парсинга {docx_name}:{part}")
+            continue
+
+        if designation:
+            return designation
+
+    return None
+
+def find_designation(docx_path):
+    """
+    Обрабатывает DOCX файл для поиска обозначения в футерах.
+    Возвращает Designation (шифр проекта, раздел, тип документа)
+    или None, если ничего не найдено.
     """
     # Проверяем существование файла перед обработкой
     if not os.path.exists(docx_path):
-        print(f"Файл не найден: {docx_path}")
+        logger.error(f"Файл не найден: {docx_path}")
         return None
 
-    # Создаём уникальную подпапку для каждого DOCX-файла
-    file_id = os.path.splitext(os.path.basename(docx_path))[0]
-    extract_path = os.path.join(output_folder, file_id)
-    os.makedirs(extract_path, exist_ok=True)
-
     try:
-        # Извлекаем содержимое DOCX
         with zipfile.ZipFile(docx_path, 'r') as docx_zip:
-            docx_zip.extractall(extract_path)
+            designation = find_id_in_archive(docx_zip, os.path.basename(docx_path))
     except Exception as e:
-        print(f"Ошибка при обработке файла {docx_path}: {e}")
-        shutil.rmtree(extract_path, ignore_errors=True)
+        logger.error(f"Ошибка при обработке файла {docx_path}: {e}")
         return None
 
-    found_word = None
-    
-    # Проверяем футеры по порядку
-    for footer_num in range(1, 4):  # Проверяем footer1.xml, footer2.xml, footer3.xml
-        xml_path = os.path.join(extract_path, 'word', f'footer{footer_num}.xml')
-        
-        if not os.path.exists(xml_path):
-            continue  # Если файла нет, переходим к следующему футеру
-        
-        try:
-            tree = ET.parse(xml_path)
-            root = tree.getroot()
-            namespaces = {'w': 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'}
-            elements = root.findall('.//w:t', namespaces)
-            
-            # Ищем "ДСиР" в элементах футера
-            for i, elem in enumerate(elements):
-                text = elem.text if elem.text else ''
-                if 'ДСиР' in text:
-                    word = text
-                    
-                    # Выводим следующие элементы после найденного
-                    for j in range(i+1, len(elements)):
-                        next_text = elements[j].text if elements[j].text else ''
-                        if next_text.strip():  # Пропускаем пустые строки
-                            word += next_text
-                            # Проверяем, содержит ли слово нужные ключевые слова
-                            if ("ВР" in word and "СВР" not in word) or ("СО" in word) or ("КЖ" in word):
-                                found_word = word
-                                #print(f"======================================")
-                                #print(f"Найдено в {os.path.basename(docx_path)}, footer{footer_num}.xml:")
-                                #print(found_word)
-                                #print(f"======================================")
-                                break
-                    
-                    if found_word:
-                        break  # Прерываем цикл проверки элементов
-            
-            if found_word:
-                break  # Прерываем цикл проверки футеров
-                
-        except ET.ParseError:
-            print(f"Ошибка парсинга {xml_path}")
-            continue
-    
-    if not found_word:
-        print(f"ДСиР не найден в файле \"{os.path.basename(docx_path)}\"")
-    
-    # Очищаем временные файлы
-    shutil.rmtree(extract_path, ignore_errors=True)
-    return found_word
-
-#print(find_id('15_ДСиР-2022-864-Р-8.1.2-СО.docx', output_folder='TestDocToXml'))
\ No newline at end of file
+    if not designation:
+        logger.warning(f"ДСиР не найден в файле \"{os.path.basename(docx_path)}\"")
+
+    return designation
+
+def find_id(docx_path, output_folder=None):
+    """
+    Обрабатывает DOCX файл для поиска информации в футерах.
+    Возвращает найденное обозначение (строку) или None, если ничего не найдено.
+    output_folder оставлен для совместимости: архив больше не распаковывается на диск.
+    """
+    designation = find_designation(docx_path)
+    return designation.text if designation else None
+
+def designation_from_name(name):
+    """Обозначение документа в имени файла (14_ДСиР-2022-864-Р-8.1.2-КЖ.docx) или None"""
+    match = DESIGNATION_RE.search(os.path.basename(name))
+    if not match:
+        return None
+    return Designation(
+        project_code=match.group('project_code'),
+        section=match.group('section'),
+        doc_type=match.group('doc_type'),
+        text=match.group(0),
+    )
+
+def find_document_id(docx, docx_name=''):
+    """
+    Идентификатор документа для ID_project_document: текст обозначения из футера,
+    а если его там нет - из имени файла. docx - путь к файлу или открытый
+    zipfile.ZipFile (остаётся открытым). Возвращает None, если обозначения нет.
+    """
+    if isinstance(docx, zipfile.ZipFile):
+        docx_name = docx_name or os.path.basename(docx.filename or '')
+        designation = find_id_in_archive(docx, docx_name)
+    else:
+        docx_name = docx_name or os.path.basename(docx)
+        with zipfile.ZipFile(docx, 'r') as docx_zip:
+            designation = find_id_in_archive(docx_zip, docx_name)
+
+    designation = designation or designation_from_name(docx_name)
+    return designation.text if designation else None
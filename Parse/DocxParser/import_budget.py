@@ -0,0 +1,90 @@
+import os
+import sys
+import argparse
+import subprocess
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Допустимое время импорта точек входа (мс, минимум из нескольких запусков
+# по -X importtime). Запас примерно двукратный относительно замеров
+# на машине разработчика, чтобы проверка не срабатывала от шума
+IMPORT_BUDGET_MS = {
+    "find_files": 100,
+    "cable_parser": 120,
+    "spec_parser": 120,
+    "SpecifiedWork_parser": 120,
+    "document_diff": 130,
+    "batch_runner": 200,
+    "ingest_service": 250,
+    "watch_folder": 200,
+    "document_manifest": 100,
+}
+
+# Тяжёлые модули, которые точки входа не должны импортировать при загрузке:
+# psycopg2/asyncpg нужны только при подключении к базе, numpy - при схлопывании
+# столбцов СО/ВР, pyarrow - только при выгрузке в Parquet/Arrow, pandas
+# и python-docx парсерам больше не нужны вовсе
+HEAVY_MODULES = ("numpy", "pandas", "docx", "psycopg2", "asyncpg", "pyarrow")
+
+def measure_import(module):
+    """
+    Импортирует модуль в отдельном интерпретаторе с -X importtime.
+    Возвращает (суммарное время импорта модуля в мс, множество импортированных модулей).
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=BASE_DIR, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Не удалось импортировать {module}:\n{result.stderr}")
+
+    total_ms = None
+    imported = set()
+    # Строки вида "import time:  self [us] | cumulative | imported package"
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or line.count("|") != 2:
+            continue
+        _, cumulative, name = line.split("|")
+        name = name.strip()
+        if not cumulative.strip().isdigit():
+            continue
+        imported.add(name)
+        if name == module:
+            total_ms = int(cumulative) / 1000
+    return total_ms, imported
+
+def check_module(module, budget_ms, runs):
+    """Проверяет модуль: (время в мс, найденные тяжёлые модули, уложился ли в бюджет)"""
+    timings = []
+    heavy = set()
+    for _ in range(runs):
+        total_ms, imported = measure_import(module)
+        timings.append(total_ms)
+        heavy |= {name.split('.')[0] for name in imported} & set(HEAVY_MODULES)
+    best = min(timings)
+    return best, sorted(heavy), best <= budget_ms and not heavy
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Проверка времени импорта точек входа парсеров (-X importtime)")
+    parser.add_argument("modules", nargs="*", help="модули (по умолчанию - все из IMPORT_BUDGET_MS)")
+    parser.add_argument("--runs", type=int, default=5, help="запусков на модуль (по умолчанию 5)")
+    args = parser.parse_args()
+
+    failed = []
+    for module in args.modules or IMPORT_BUDGET_MS:
+        budget_ms = IMPORT_BUDGET_MS.get(module, min(IMPORT_BUDGET_MS.values()))
+        best, heavy, ok = check_module(module, budget_ms, args.runs)
+        status = "OK" if ok else "ПРЕВЫШЕНИЕ"
+        line = f"{module}: {best:.1f} мс (бюджет {budget_ms} мс) - {status}"
+        if heavy:
+            line += f"; импортированы тяжёлые модули: {', '.join(heavy)}"
+        print(line)
+        if not ok:
+            failed.append(module)
+
+    if failed:
+        print(f"Бюджет импорта превышен: {', '.join(failed)}")
+        sys.exit(1)
+    print("Все модули укладываются в бюджет импорта")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,445 @@
+import io
+import sys
+import json
+import time
+import asyncio
+import logging
+import functools
+import threading
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from bulk_writer import DEFAULT_BATCH_SIZE, copy_payload, natural_id, upsert_queries
+from db_config import load_db_params
+from docx_tables import source_name
+from find_files import detect_doc_type
+from document_diff import document_id, extract_document, NATURAL_KEYS
+from sinks import log_to_stderr
+
+logger = logging.getLogger(__name__)
+
+# Адрес локального сервиса по умолчанию
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+def _connect_params(db_params):
+    """Параметры подключения из db_config в виде аргументов asyncpg"""
+    params = {key: value for key, value in db_params.items()
+              if key in ("host", "port", "database", "user", "password")}
+    if "port" in params:
+        params["port"] = int(params["port"])
+    return params
+
+def parse_document(file_path, doc_type=None, project_document_id=None, document_section_id=None,
+                   progress_queue=None, upsert=False):
+    """
+    Разбор документа в рабочем процессе: определяет тип (если не задан)
+    и возвращает (тип, {(таблица, столбцы): [строки, ...]}).
+    Если project_document_id не задан, в режиме upsert берётся обозначение
+    документа (document_id), иначе ссылка остаётся пустой, как при обычной записи.
+    Для документа неизвестного типа возвращает (None, {}).
+    В очередь progress_queue (если передана) после каждой таблицы
+    кладётся (количество таблиц, количество строк).
+    """
+    doc_type = doc_type or detect_doc_type(file_path)
+    if doc_type is None:
+        return None, {}
+    if project_document_id is None and upsert:
+        project_document_id = document_id(doc_type, file_path, required=True)
+
+    def report(tables, rows):
+        progress_queue.put((tables, rows))
+    progress = report if progress_queue is not None else None
+    return doc_type, extract_document(doc_type, file_path, project_document_id, document_section_id,
+                                      progress)
+
+class AsyncBulkWriter:
+    """
+    Асинхронный аналог BulkWriter/UpsertWriter для asyncpg: строки одной таблицы
+    копятся и отправляются пачками через COPY в текстовом формате (тот же
+    copy_payload). При заданных key_columns идентификатор заменяется на
+    natural_id, а пачка переносится из временной таблицы через ON CONFLICT.
+    Фиксация транзакции остаётся за вызывающим кодом.
+    """
+
+    def __init__(self, conn, table, columns, batch_size=DEFAULT_BATCH_SIZE, key_columns=None):
+        self.conn = conn
+        self.table = table
+        self.columns = list(columns)
+        self.batch_size = batch_size
+        self.rows = []
+        self.key_indexes = None
+        if key_columns:
+            self.key_indexes = [self.columns.index(column) for column in key_columns]
+            self.stage, self.stage_query, self.merge_query = upsert_queries(table, self.columns)
+
+    async def add(self, row):
+        """
+        Добавляет строку в буфер и отправляет буфер, если он заполнен.
+        Возвращает количество записанных (в режиме upsert - изменённых) строк.
+        """
+        if self.key_indexes is not None:
+            row = (natural_id(self.table, [row[i] for i in self.key_indexes]),) + tuple(row[1:])
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            return await self.flush()
+        return 0
+
+    async def flush(self):
+        """Отправляет накопленные строки. Возвращает количество записанных или изменённых"""
+        if not self.rows:
+            return 0
+
+        rows, self.rows = self.rows, []
+        if self.key_indexes is None:
+            await self._copy(self.table, rows)
+            return len(rows)
+
+        # Повтор ключа внутри пачки: остаётся последнее вхождение
+        rows = list({row[0]: row for row in rows}.values())
+        await self.conn.execute(self.stage_query)
+        await self._copy(self.stage, rows)
+        status = await self.conn.execute(self.merge_query)
+        # Статус вида "INSERT 0 <количество>"
+        return int(status.split()[-1])
+
+    async def _copy(self, table, rows):
+        payload = io.BytesIO(copy_payload(rows).encode('utf-8'))
+        await self.conn.copy_to_table(table, source=payload, columns=self.columns, format='text')
+
+class IngestService:
+    """
+    Долгоживущий сервис импорта документов КЖ/СО/ВР.
+    Разбор (CPU) выполняется в пуле процессов, где парсеры уже импортированы,
+    запись - асинхронно через пул подключений asyncpg, поэтому несколько
+    документов обрабатываются одновременно без запуска нового интерпретатора
+    на каждый файл. Каждый документ записывается отдельной транзакцией.
+    """
+
+    def __init__(self, db_params=None, workers=None, pool_size=4, batch_size=DEFAULT_BATCH_SIZE):
+        self.db_params = db_params or load_db_params()
+        self.workers = workers
+        self.pool_size = pool_size
+        self.batch_size = batch_size
+        self.pool = None
+        self.executor = None
+        self.manager = None
+
+    async def start(self):
+        try:
+            import asyncpg
+        except ImportError:
+            raise RuntimeError("Для сервиса импорта нужен пакет asyncpg (pip install asyncpg)")
+        self.pool = await asyncpg.create_pool(min_size=1, max_size=self.pool_size,
+                                              **_connect_params(self.db_params))
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=log_to_stderr)
+        # Очереди событий разбора из рабочих процессов
+        self.manager = multiprocessing.Manager()
+        logger.info("Сервис импорта запущен")
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        if self.manager is not None:
+            self.manager.shutdown()
+            self.manager = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def write_batches(self, batches, upsert=False, progress=None):
+        """
+        Записывает строки {(таблица, столбцы): [строки, ...]} одной транзакцией.
+        После каждой отправленной пачки вызывается progress(отправлено строк).
+        Возвращает количество добавленных (в режиме upsert - изменённых) записей.
+        """
+        record_count = 0
+        sent = 0
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                for (table, columns), rows in batches.items():
+                    key_columns = NATURAL_KEYS[table] if upsert else None
+                    writer = AsyncBulkWriter(conn, table, columns, self.batch_size, key_columns)
+                    for row in rows:
+                        record_count += await writer.add(row)
+                        sent += 1
+                        if progress and not writer.rows:
+                            progress(sent)
+                    record_count += await writer.flush()
+                    if progress:
+                        progress(sent)
+        return record_count
+
+    def _relay(self, parse_progress, progress):
+        """
+        Передаёт события разбора из рабочего процесса до получения None.
+        Очередь читается в отдельном потоке, чтобы ожидание событий не занимало
+        потоки пула run_in_executor. Возвращает future, завершаемое после None.
+        """
+        loop = asyncio.get_running_loop()
+        finished = loop.create_future()
+
+        def relay():
+            try:
+                while (item := parse_progress.get()) is not None:
+                    tables, rows = item
+                    loop.call_soon_threadsafe(
+                        functools.partial(progress, 'parsing', tables=tables, rows_parsed=rows))
+            except Exception as e:
+                loop.call_soon_threadsafe(finished.set_exception, e)
+            else:
+                loop.call_soon_threadsafe(finished.set_result, None)
+
+        threading.Thread(target=relay, name="ingest-progress", daemon=True).start()
+        return finished
+
+    async def ingest(self, file_path, doc_type=None, project_document_id=None,
+                     document_section_id=None, upsert=False, progress=None):
+        """
+        Разбирает документ в пуле процессов и записывает его строки в базу.
+        Если передан progress, он вызывается как progress(событие, **поля):
+        'parsing' после каждой таблицы (tables, rows_parsed), 'parsed' после разбора
+        (doc_type, rows_parsed) и 'writing' после каждой пачки (rows_written, rows_total).
+        Возвращает {'file', 'doc_type', 'rows', 'records'}; для документа
+        неизвестного типа doc_type равен None и ничего не записывается.
+        """
+        loop = asyncio.get_running_loop()
+        parse_progress = self.manager.Queue() if progress else None
+        relay = self._relay(parse_progress, progress) if progress else None
+        try:
+            doc_type, batches = await loop.run_in_executor(
+                self.executor, parse_document, file_path, doc_type,
+                project_document_id, document_section_id, parse_progress, upsert)
+        finally:
+            if relay is not None:
+                parse_progress.put(None)
+                await relay
+
+        row_count = sum(len(rows) for rows in batches.values())
+        if progress:
+            progress('parsed', doc_type=doc_type, rows_parsed=row_count)
+
+        def report_writing(sent):
+            progress('writing', rows_written=sent, rows_total=row_count)
+        write_progress = report_writing if progress else None
+
+        record_count = await self.write_batches(batches, upsert, write_progress) if batches else 0
+        logger.info(f"Файл {source_name(file_path)} ({doc_type}): записано {record_count}")
+        return {'file': file_path, 'doc_type': doc_type, 'rows': row_count, 'records': record_count}
+
+class JobQueue:
+    """
+    Очередь заданий импорта поверх IngestService. Одновременно выполняется
+    не больше concurrency заданий, остальные ждут в порядке поступления.
+    О ходе каждого задания сообщается событиями - словарями, пригодными
+    для вывода строкой JSON:
+    {"job", "id", "event", "file", "elapsed", ...}, где event - один из
+    queued, started, parsing, parsed, writing, done, failed (см. IngestService.ingest).
+    События со счётчиком rows_written дополняются скоростью записи rows_per_sec.
+    """
+
+    def __init__(self, service, concurrency=2):
+        self.service = service
+        self.concurrency = concurrency
+        self.queue = asyncio.Queue()
+        self.runners = []
+        self.next_job = 1
+
+    async def start(self):
+        self.runners = [asyncio.create_task(self._runner()) for _ in range(self.concurrency)]
+
+    async def close(self):
+        for runner in self.runners:
+            runner.cancel()
+        await asyncio.gather(*self.runners, return_exceptions=True)
+        self.runners = []
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def submit(self, request, listener):
+        """
+        Ставит в очередь запрос импорта {"id", "file", "doc_type",
+        "project_document_id", "document_section_id", "upsert"}.
+        listener(событие) вызывается для каждого события задания.
+        Возвращает номер задания.
+        """
+        job = {'job': self.next_job, 'request': request, 'listener': listener, 'started': None}
+        self.next_job += 1
+        self.queue.put_nowait(job)
+        self._emit(job, 'queued', position=self.queue.qsize())
+        return job['job']
+
+    async def join(self):
+        """Ждёт завершения всех поставленных заданий"""
+        await self.queue.join()
+
+    def _emit(self, job, event, **fields):
+        message = {'job': job['job'], 'id': job['request'].get('id'), 'event': event,
+                   'file': job['request'].get('file')}
+        if job['started'] is not None:
+            elapsed = time.perf_counter() - job['started']
+            message['elapsed'] = round(elapsed, 3)
+            if 'rows_written' in fields and elapsed > 0:
+                fields['rows_per_sec'] = round(fields['rows_written'] / elapsed, 1)
+        message.update(fields)
+        job['listener'](message)
+
+    async def _runner(self):
+        while True:
+            job = await self.queue.get()
+            try:
+                await self._run(job)
+            finally:
+                self.queue.task_done()
+
+    async def _run(self, job):
+        request = job['request']
+        job['started'] = time.perf_counter()
+        self._emit(job, 'started')
+        try:
+            result = await self.service.ingest(
+                request['file'], request.get('doc_type'), request.get('project_document_id'),
+                request.get('document_section_id'), bool(request.get('upsert')),
+                progress=lambda event, **fields: self._emit(job, event, **fields))
+            self._emit(job, 'done', doc_type=result['doc_type'], records=result['records'],
+                       rows_written=result['rows'])
+        except Exception as e:
+            logger.error(f"Ошибка при импорте {request.get('file')}: {str(e)}")
+            self._emit(job, 'failed', error=str(e))
+
+# События, которыми заканчивается задание
+FINAL_EVENTS = ('done', 'failed')
+
+async def _serve_client(jobs, reader, writer):
+    """
+    Протокол: каждая строка запроса - JSON объект
+    {"id", "file", "doc_type", "project_document_id", "document_section_id", "upsert"}.
+    В ответ клиент получает строки JSON с событиями своих заданий (JobQueue)
+    по мере их выполнения. Соединение закрывается после того, как клиент
+    закончил передачу запросов и все его задания завершились.
+    """
+    events = asyncio.Queue()
+    submitted = 0
+    finished = 0
+    reading = True
+
+    async def send():
+        nonlocal finished
+        while reading or finished < submitted:
+            message = await events.get()
+            if message is None:
+                continue
+            writer.write(json.dumps(message, ensure_ascii=False).encode('utf-8') + b'\n')
+            await writer.drain()
+            if message['event'] in FINAL_EVENTS:
+                finished += 1
+
+    sender = asyncio.create_task(send())
+    try:
+        while line := await reader.readline():
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict) or 'file' not in request:
+                    raise ValueError("нет поля file")
+            except ValueError as e:
+                events.put_nowait({'event': 'error', 'error': f"Некорректный запрос: {str(e)}"})
+                continue
+            submitted += 1
+            jobs.submit(request, events.put_nowait)
+        reading = False
+        events.put_nowait(None)
+        await sender
+    except ConnectionError:
+        pass
+    finally:
+        sender.cancel()
+        writer.close()
+
+async def serve(jobs, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    """Принимает запросы импорта на локальном TCP порту до остановки"""
+    server = await asyncio.start_server(
+        lambda reader, writer: _serve_client(jobs, reader, writer), host, port)
+    logger.info(f"Сервис импорта слушает {host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+async def ingest_files(files, listener, db_params=None, workers=None, concurrency=2, upsert=False):
+    """Импортирует файлы через очередь заданий, передавая события в listener"""
+    async with IngestService(db_params, workers) as service:
+        async with JobQueue(service, concurrency) as jobs:
+            for path in files:
+                jobs.submit({'file': path, 'upsert': upsert}, listener)
+            await jobs.join()
+
+def print_event(event):
+    """Выводит итог задания в читаемом виде"""
+    if event['event'] == 'done' and event['doc_type'] is None:
+        print(f"Тип документа не определён: {event['file']}")
+    elif event['event'] == 'done':
+        print(f"{event['doc_type']}: {event['file']} - записано: {event['records']} "
+              f"({event['elapsed']:.1f} с)")
+    elif event['event'] == 'failed':
+        print(f"Ошибка при обработке файла {event['file']}: {event['error']}")
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Сервис импорта документов КЖ/СО/ВР в PostgreSQL (asyncio + asyncpg)")
+    parser.add_argument("files", nargs="*",
+                        help="импортировать файлы и завершиться (без аргументов - запустить сервис)")
+    parser.add_argument("--host", default=DEFAULT_HOST, help=f"адрес (по умолчанию {DEFAULT_HOST})")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT,
+                        help=f"порт (по умолчанию {DEFAULT_PORT})")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="количество процессов разбора (по умолчанию - по числу ядер)")
+    parser.add_argument("--jobs", type=int, default=2,
+                        help="количество одновременно выполняемых заданий (по умолчанию 2)")
+    parser.add_argument("--upsert", action="store_true",
+                        help="идемпотентная запись по естественным ключам")
+    parser.add_argument("--events", action="store_true",
+                        help="выводить все события заданий строками JSON")
+    args = parser.parse_args()
+    log_to_stderr()
+
+    if args.files:
+        failed = []
+
+        def listener(event):
+            if event['event'] == 'failed':
+                failed.append(event['file'])
+            if args.events:
+                print(json.dumps(event, ensure_ascii=False), flush=True)
+            else:
+                print_event(event)
+
+        asyncio.run(ingest_files(args.files, listener, workers=args.workers,
+                                 concurrency=args.jobs, upsert=args.upsert))
+        sys.exit(1 if failed else 0)
+
+    async def run_service():
+        async with IngestService(workers=args.workers) as service:
+            async with JobQueue(service, args.jobs) as jobs:
+                await serve(jobs, args.host, args.port)
+
+    try:
+        asyncio.run(run_service())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+import os
+import json
+import time
+from contextlib import contextmanager
+
+from docx_tables import main_document_part, source_name
+
+# Этапы разбора документа в порядке конвейера:
+# open - открытие архива, read - потоковое чтение XML и построение строк таблиц,
+# collapse - схлопывание объединённых столбцов (СО/ВР), map - сопоставление
+# строк со столбцами таблицы, write - отправка пачек в приёмник, commit - фиксация
+STAGES = ("open", "read", "collapse", "map", "write", "commit")
+
+# Счётчики документа
+COUNTERS = ("tables", "rows_read", "rows_mapped", "rows_written", "docx_bytes", "xml_bytes",
+            "db_round_trips")
+
+# Префикс метрик в формате Prometheus
+METRIC_PREFIX = "docx_import"
+
+class MeteredWriter:
+    """
+    Обёртка писателя приёмника: время add/flush относится к этапу write,
+    обращения к базе берутся из счётчика round_trips писателя. Отправленные
+    строки (в режиме upsert - изменённые) учитываются в rows_written только
+    при фиксации (MeteredSink.commit)
+    """
+
+    def __init__(self, writer, metrics):
+        self.writer = writer
+        self.metrics = metrics
+
+    def _call(self, method, *args):
+        round_trips = getattr(self.writer, 'round_trips', 0)
+        started = time.perf_counter()
+        try:
+            written = method(*args)
+        finally:
+            self.metrics.stages["write"] += time.perf_counter() - started
+            self.metrics.counters["db_round_trips"] += getattr(self.writer, 'round_trips', 0) - round_trips
+        self.metrics.uncommitted += written
+        return written
+
+    def add(self, row):
+        return self._call(self.writer.add, row)
+
+    def flush(self):
+        return self._call(self.writer.flush)
+
+    def discard(self):
+        self.writer.discard()
+
+class MeteredSink:
+    """Обёртка приёмника (см. sinks): писатели с замером, время и обращения фиксации"""
+
+    def __init__(self, sink, metrics):
+        self.sink = sink
+        self.metrics = metrics
+
+    def writer(self, *args, **kwargs):
+        return MeteredWriter(self.sink.writer(*args, **kwargs), self.metrics)
+
+    def commit(self):
+        with self.metrics.stage("commit"):
+            self.sink.commit()
+        self.metrics.counters["db_round_trips"] += 1
+        self.metrics.counters["rows_written"] += self.metrics.uncommitted
+        self.metrics.uncommitted = 0
+
+    def rollback(self):
+        self.sink.rollback()
+        self.metrics.counters["db_round_trips"] += 1
+        self.metrics.uncommitted = 0
+
+class DocumentMetrics:
+    """
+    Замеры разбора одного документа: время по этапам (STAGES), счётчики
+    (COUNTERS) и причины пропуска строк. Итог выводится одной строкой JSON
+    в лог (log) и собирается в MetricsReport для файлов метрик.
+    """
+
+    def __init__(self, source='', doc_type=''):
+        self.source = source
+        self.doc_type = doc_type
+        self.started = time.perf_counter()
+        self.stages = dict.fromkeys(STAGES, 0.0)
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.skipped = {}
+        self.error = None
+        # Строки, отправленные в приёмник, но ещё не зафиксированные
+        self.uncommitted = 0
+
+    @contextmanager
+    def stage(self, name):
+        """Относит время блока к этапу name"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] += time.perf_counter() - started
+
+    def timed(self, name, iterable):
+        """Выдаёт элементы iterable, относя время их получения к этапу name"""
+        iterator = iter(iterable)
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.stages[name] += time.perf_counter() - started
+                return
+            self.stages[name] += time.perf_counter() - started
+            yield item
+
+    def count(self, name, value=1):
+        self.counters[name] += value
+
+    def skip(self, reason):
+        """Учитывает пропущенную строку с причиной reason"""
+        self.skipped[reason] = self.skipped.get(reason, 0) + 1
+
+    def measure_document(self, docx_zip):
+        """Размер файла DOCX и несжатый размер основной части документа"""
+        name = source_name(docx_zip)
+        if isinstance(name, str) and os.path.exists(name):
+            self.counters["docx_bytes"] = os.path.getsize(name)
+        try:
+            self.counters["xml_bytes"] = docx_zip.getinfo(main_document_part(docx_zip)).file_size
+        except KeyError:
+            pass
+
+    def sink(self, sink):
+        return MeteredSink(sink, self)
+
+    def summary(self):
+        """Итог по документу в виде словаря (сериализуется в JSON)"""
+        return {
+            "source": os.path.basename(str(self.source)),
+            "doc_type": self.doc_type,
+            "status": "failed" if self.error else "ok",
+            "error": self.error,
+            "seconds": round(time.perf_counter() - self.started, 6),
+            "stages": {name: round(seconds, 6) for name, seconds in self.stages.items()},
+            "counters": dict(self.counters),
+            "skipped": dict(self.skipped)
+        }
+
+    def log(self, logger):
+        logger.info(f"Метрики документа: {json.dumps(self.summary(), ensure_ascii=False)}")
+
+def _label(value):
+    """Экранирование значения метки Prometheus"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _write_atomic(path, text):
+    """
+    Пишет файл через временный и переименование: node_exporter (textfile collector)
+    и дашборды не увидят наполовину записанный файл
+    """
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(temp_path, path)
+
+class MetricsReport:
+    """
+    Итоги документов одного запуска. Сохраняется в JSON (все документы и суммы)
+    или в текстовый формат Prometheus (суммы по типам документов).
+    """
+
+    def __init__(self):
+        self.documents = []
+
+    def add(self, summary):
+        """Добавляет итог документа (DocumentMetrics.summary())"""
+        if summary is not None:
+            self.documents.append(summary)
+
+    def totals(self):
+        """Суммы по типам документов: {тип: {"documents", "failed", "seconds", "stages", "counters", "skipped"}}"""
+        totals = {}
+        for document in self.documents:
+            total = totals.setdefault(document["doc_type"], {
+                "documents": 0,
+                "failed": 0,
+                "seconds": 0.0,
+                "stages": dict.fromkeys(STAGES, 0.0),
+                "counters": dict.fromkeys(COUNTERS, 0),
+                "skipped": {}
+            })
+            total["documents"] += 1
+            total["failed"] += document["status"] == "failed"
+            total["seconds"] += document["seconds"]
+            for name, seconds in document["stages"].items():
+                total["stages"][name] = total["stages"].get(name, 0.0) + seconds
+            for name, value in document["counters"].items():
+                total["counters"][name] = total["counters"].get(name, 0) + value
+            for reason, value in document["skipped"].items():
+                total["skipped"][reason] = total["skipped"].get(reason, 0) + value
+        return totals
+
+    def to_json(self):
+        return json.dumps({"generated_at": time.time(), "totals": self.totals(),
+                           "documents": self.documents}, ensure_ascii=False, indent=2)
+
+    def to_prometheus(self):
+        """
+        Метрики в текстовом формате Prometheus с меткой doc_type. Это итоги
+        одного запуска (каждый запуск начинает с нуля), поэтому тип - gauge, а не counter
+        """
+        families = {
+            "documents": ("gauge", "Обработанные документы", []),
+            "document_seconds": ("gauge", "Время обработки документов", []),
+            "stage_seconds": ("gauge", "Время по этапам разбора", []),
+            "tables": ("gauge", "Прочитанные таблицы", []),
+            "rows": ("gauge", "Строки по этапам (read, mapped, written - зафиксированные)", []),
+            "bytes": ("gauge", "Размер документов (docx - файл, xml - основная часть)", []),
+            "db_round_trips": ("gauge", "Обращения к базе (запросы и фиксации)", []),
+            "skipped_rows": ("gauge", "Пропущенные строки по причинам", []),
+        }
+        for doc_type, total in self.totals().items():
+            doc_label = f'doc_type="{_label(doc_type)}"'
+            failed = total["failed"]
+            families["documents"][2].append((f'{doc_label},status="ok"', total["documents"] - failed))
+            families["documents"][2].append((f'{doc_label},status="failed"', failed))
+            families["document_seconds"][2].append((doc_label, total["seconds"]))
+            for name, seconds in total["stages"].items():
+                families["stage_seconds"][2].append((f'{doc_label},stage="{name}"', seconds))
+            counters = total["counters"]
+            families["tables"][2].append((doc_label, counters["tables"]))
+            for kind in ("read", "mapped", "written"):
+                families["rows"][2].append((f'{doc_label},kind="{kind}"', counters[f"rows_{kind}"]))
+            for kind in ("docx", "xml"):
+                families["bytes"][2].append((f'{doc_label},kind="{kind}"', counters[f"{kind}_bytes"]))
+            families["db_round_trips"][2].append((doc_label, counters["db_round_trips"]))
+            for reason, value in sorted(total["skipped"].items()):
+                families["skipped_rows"][2].append((f'{doc_label},reason="{_label(reason)}"', value))
+
+        lines = []
+        for name, (metric_type, help_text, samples) in families.items():
+            full_name = f"{METRIC_PREFIX}_{name}"
+            lines.append(f"# HELP {full_name} {help_text}")
+            lines.append(f"# TYPE {full_name} {metric_type}")
+            lines.extend(f"{full_name}{{{labels}}} {value:.6f}" if isinstance(value, float)
+                         else f"{full_name}{{{labels}}} {value}"
+                         for labels, value in samples)
+        lines.append(f"# HELP {METRIC_PREFIX}_last_run_timestamp_seconds Время формирования метрик")
+        lines.append(f"# TYPE {METRIC_PREFIX}_last_run_timestamp_seconds gauge")
+        lines.append(f"{METRIC_PREFIX}_last_run_timestamp_seconds {time.time():.3f}")
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """Сохраняет метрики: *.prom - текстовый формат Prometheus, иначе JSON"""
+        if path.endswith('.prom'):
+            _write_atomic(path, self.to_prometheus())
+        else:
+            _write_atomic(path, self.to_json())
@@ -0,0 +1,29 @@
+from bulk_writer import DEFAULT_BATCH_SIZE
+from sinks import sink_session
+
+class ParseOptions:
+    """
+    Куда парсер пишет строки документа и что при этом замеряет.
+    conn - открытое подключение к PostgreSQL (остаётся открытым после обработки),
+    sessions - пул подключений (db_config.SessionFactory), sink - приёмник
+    из sinks вместо PostgreSQL, export_dir и export_format - выгрузка в Parquet
+    или Arrow IPC вместо записи (см. columnar_export), metrics - DocumentMetrics
+    для замеров по этапам, batch_size - размер пачки при записи.
+    """
+
+    def __init__(self, conn=None, sessions=None, sink=None, export_dir=None,
+                 export_format="parquet", metrics=None, batch_size=DEFAULT_BATCH_SIZE):
+        self.conn = conn
+        self.sessions = sessions
+        self.sink = sink
+        self.export_dir = export_dir
+        self.export_format = export_format
+        self.metrics = metrics
+        self.batch_size = batch_size
+
+    def session(self, db_params):
+        """Приёмник для записи документа (см. sinks.sink_session)"""
+        return sink_session(db_params, self.conn, self.sessions, self.sink)
+
+# Параметры по умолчанию: новое подключение по db_params, запись без выгрузки
+DEFAULT_OPTIONS = ParseOptions()
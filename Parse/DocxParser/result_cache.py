@@ -0,0 +1,151 @@
+import os
+import json
+import sqlite3
+import hashlib
+from datetime import datetime
+
+# Версия формата разобранных строк. При изменении логики парсеров её нужно
+# увеличить, чтобы записи, сохранённые старой версией, не воспроизводились
+CACHE_VERSION = 2
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def file_sha256(path):
+    """SHA-256 содержимого файла"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class ResultCache:
+    """
+    Постоянный кэш результатов разбора в файле SQLite.
+    Документ идентифицируется SHA-256 содержимого; размер и время изменения
+    файла позволяют не пересчитывать хэш, если файл не трогали.
+    Для документа хранится определённый тип (КЖ/СО/ВР или '' - не подходит)
+    и записанные в базу строки в виде словаря (таблица, столбцы) -> строки.
+    Отдельно запоминается, в какие приёмники документ уже записан: target -
+    описание текущего приёмника (см. sinks.cache_target); None - приёмник,
+    куда записанное не сохраняется (NDJSON), документы в него пишутся всегда.
+    """
+
+    def __init__(self, path, target=None):
+        self.path = path
+        self.target = target
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                sha256 TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS documents (
+                sha256 TEXT PRIMARY KEY,
+                doc_type TEXT,
+                version INTEGER,
+                batches TEXT,
+                parsed_at TEXT
+            );
+            CREATE TABLE IF NOT EXISTS targets (
+                sha256 TEXT NOT NULL,
+                target TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                written_at TEXT NOT NULL,
+                PRIMARY KEY (sha256, target)
+            );
+        """)
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def digest(self, path):
+        """
+        SHA-256 файла. Если размер и время изменения совпадают с запомненными,
+        хэш берётся из кэша без чтения файла.
+        """
+        key = os.path.abspath(path)
+        stat = os.stat(path)
+        row = self.conn.execute(
+            'SELECT size, mtime_ns, sha256 FROM files WHERE path = ?', (key,)).fetchone()
+        if row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            return row[2]
+
+        sha256 = file_sha256(path)
+        self.conn.execute(
+            'INSERT OR REPLACE INTO files (path, size, mtime_ns, sha256) VALUES (?, ?, ?, ?)',
+            (key, stat.st_size, stat.st_mtime_ns, sha256))
+        self.conn.commit()
+        return sha256
+
+    def doc_type(self, path):
+        """
+        Запомненный тип документа: 'КЖ'/'СО'/'ВР', '' если документ
+        не подходит ни под один тип, None если тип ещё не определялся
+        """
+        row = self.conn.execute(
+            'SELECT doc_type FROM documents WHERE sha256 = ?', (self.digest(path),)).fetchone()
+        return row[0] if row is not None else None
+
+    def store_doc_type(self, path, doc_type):
+        """Запоминает тип документа (None сохраняется как '')"""
+        self.conn.execute(
+            'INSERT INTO documents (sha256, doc_type) VALUES (?, ?) '
+            'ON CONFLICT (sha256) DO UPDATE SET doc_type = excluded.doc_type',
+            (self.digest(path), doc_type or ''))
+        self.conn.commit()
+
+    def rows(self, path):
+        """
+        Разобранные строки документа {(таблица, столбцы): [строки, ...]}
+        или None, если документ с таким содержимым ещё не разбирался
+        """
+        row = self.conn.execute(
+            'SELECT version, batches FROM documents WHERE sha256 = ?',
+            (self.digest(path),)).fetchone()
+        if row is None or row[0] != CACHE_VERSION or row[1] is None:
+            return None
+
+        return {(batch['table'], tuple(batch['columns'])): [tuple(r) for r in batch['rows']]
+                for batch in json.loads(row[1])}
+
+    def written(self, path):
+        """Записан ли документ с таким содержимым в текущий приёмник (target)"""
+        if self.target is None:
+            return False
+        row = self.conn.execute(
+            'SELECT version FROM targets WHERE sha256 = ? AND target = ?',
+            (self.digest(path), self.target)).fetchone()
+        return row is not None and row[0] == CACHE_VERSION
+
+    def mark_written(self, path):
+        """Запоминает, что строки документа записаны в текущий приёмник"""
+        if self.target is None:
+            return
+        self.conn.execute(
+            'INSERT OR REPLACE INTO targets (sha256, target, version, written_at) VALUES (?, ?, ?, ?)',
+            (self.digest(path), self.target, CACHE_VERSION,
+             datetime.now().isoformat(timespec='seconds')))
+        self.conn.commit()
+
+    def store_rows(self, path, doc_type, batches):
+        """Сохраняет тип и разобранные строки документа, записанного в текущий приёмник"""
+        payload = json.dumps(
+            [{'table': table, 'columns': list(columns), 'rows': rows}
+             for (table, columns), rows in batches.items()],
+            ensure_ascii=False)
+        self.conn.execute(
+            'INSERT OR REPLACE INTO documents (sha256, doc_type, version, batches, parsed_at) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (self.digest(path), doc_type or '', CACHE_VERSION, payload,
+             datetime.now().isoformat(timespec='seconds')))
+        self.conn.commit()
+        self.mark_written(path)
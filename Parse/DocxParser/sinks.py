@@ -0,0 +1,327 @@
+import os
+import sys
+import json
+import logging
+import shutil
+import sqlite3
+import tempfile
+from contextlib import contextmanager, redirect_stdout
+
+from bulk_writer import DEFAULT_BATCH_SIZE, create_writer, natural_id
+from db_config import db_session
+
+# Схема таблиц для SQLite - та же, что в PostgreSQL (uuid хранится как текст,
+# double precision - как REAL). Первый столбец - идентификатор строки
+SQLITE_SCHEMA = {
+    "Cable": [
+        ("ID_cable", "TEXT PRIMARY KEY"),
+        ("ID_project_document", "TEXT"),
+        ("Cable_identification", "TEXT"),
+        ("Trassa_beginning", "TEXT"),
+        ("Trassa_end", "TEXT"),
+        ("Pipe_passage_designation", "TEXT"),
+        ("Pipe_passage_diameter", "TEXT"),
+        ("Pipe_passage_length", "REAL"),
+        ("Draw_box_passing_length", "REAL"),
+        ("Cable_or_wire_brand", "TEXT"),
+        ("Cable_or_wire_projet_cross_section", "TEXT"),
+        ("Cable_or_wire_projet_length", "REAL"),
+        ("Cable_or_wire_laying_brand", "TEXT"),
+        ("Cable_or_wire_laying_cross_setion", "TEXT"),
+        ("Cable_or_wire_laying_length", "REAL")
+    ],
+    "Equipment": [
+        ("ID_equipment", "TEXT PRIMARY KEY"),
+        ("Equipment_identification", "TEXT"),
+        ("Name_equipment", "TEXT"),
+        ("Type_equipment", "TEXT"),
+        ("Code_product", "TEXT"),
+        ("Supplier", "TEXT"),
+        ("Units1", "TEXT"),
+        ("Units2", "TEXT"),
+        ("Quantity1", "REAL"),
+        ("Quantity2", "REAL"),
+        ("Unit_mass", "REAL"),
+        ("Note", "TEXT")
+    ],
+    "SpecifiedWork": [
+        ("ID_work", "TEXT PRIMARY KEY"),
+        ("ID_project_document", "TEXT"),
+        ("ID_document_section", "TEXT"),
+        ("Work_identification", "TEXT"),
+        ("Name_work", "TEXT"),
+        ("Units1", "TEXT"),
+        ("Units2", "TEXT"),
+        ("Quantity1", "REAL"),
+        ("Quantity2", "REAL"),
+        ("Note", "TEXT")
+    ]
+}
+
+# Объём строк NDJSON, который держится в памяти до фиксации; остальное - во временном файле
+NDJSON_SPOOL_SIZE = 4 * 1024 * 1024
+
+class Sink:
+    """
+    Приёмник строк парсеров. Парсер получает у приёмника писатель для каждой
+    пары (таблица, столбцы) - объект с методами add(row), flush() и discard(),
+    которые возвращают количество записанных строк, как BulkWriter, - и сам
+    решает, когда фиксировать (commit) или отменять (rollback) записанное.
+    """
+
+    def writer(self, table, columns, batch_size=DEFAULT_BATCH_SIZE, key_columns=None):
+        raise NotImplementedError
+
+    def commit(self):
+        raise NotImplementedError
+
+    def rollback(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.rollback()
+        self.close()
+
+class PostgresSink(Sink):
+    """
+    Запись в PostgreSQL через подключение psycopg2 (COPY, см. bulk_writer).
+    Подключением владеет вызывающий код: close() его не закрывает.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def writer(self, table, columns, batch_size=DEFAULT_BATCH_SIZE, key_columns=None):
+        return create_writer(self.conn, table, columns, batch_size, key_columns)
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        self.conn.rollback()
+
+class SQLiteWriter:
+    """
+    Буферизует строки одной таблицы и вставляет их пачками через executemany.
+    Если задан естественный ключ, идентификатор заменяется на natural_id,
+    как в UpsertWriter, а существующая строка обновляется только при изменении значений.
+    """
+
+    def __init__(self, conn, table, columns, batch_size=DEFAULT_BATCH_SIZE, key_columns=None):
+        self.conn = conn
+        self.table = table
+        self.columns = list(columns)
+        self.batch_size = batch_size
+        self.rows = []
+        self.round_trips = 0
+        self.key_indexes = [self.columns.index(column) for column in key_columns or []]
+
+        column_list = ', '.join(f'"{column}"' for column in self.columns)
+        placeholders = ', '.join('?' for _ in self.columns)
+        self.insert_query = f'INSERT INTO "{table}" ({column_list}) VALUES ({placeholders})'
+        if self.key_indexes:
+            id_column = f'"{self.columns[0]}"'
+            data_columns = [f'"{column}"' for column in self.columns[1:]]
+            assignments = ', '.join(f'{column} = excluded.{column}' for column in data_columns)
+            target_values = ', '.join(data_columns)
+            excluded_values = ', '.join(f'excluded.{column}' for column in data_columns)
+            self.insert_query += (f' ON CONFLICT ({id_column}) DO UPDATE SET {assignments} '
+                                  f'WHERE ({target_values}) IS NOT ({excluded_values})')
+
+    def add(self, row):
+        """
+        Добавляет строку в буфер и вставляет буфер, если он заполнен.
+        Возвращает количество добавленных (в режиме upsert - изменённых) строк.
+        """
+        if self.key_indexes:
+            row = (natural_id(self.table, [row[i] for i in self.key_indexes]),) + tuple(row[1:])
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            return self.flush()
+        return 0
+
+    def flush(self):
+        """Вставляет накопленные строки. Возвращает количество добавленных или изменённых"""
+        if not self.rows:
+            return 0
+
+        rows, self.rows = self.rows, []
+        self.round_trips += 1
+        return self.conn.executemany(self.insert_query, rows).rowcount
+
+    def discard(self):
+        """Отбрасывает неотправленные строки (например, после ошибки)"""
+        self.rows = []
+
+class SQLiteSink(Sink):
+    """
+    Запись в файл SQLite со схемой таблиц PostgreSQL (SQLITE_SCHEMA).
+    Транзакции те же, что у базы: строки, не зафиксированные парсером, отменяются.
+    Подходит для разбора без сервера PostgreSQL и для замеров в CI.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(''.join(
+            f'CREATE TABLE IF NOT EXISTS "{table}" ('
+            + ', '.join(f'"{column}" {column_type}' for column, column_type in columns)
+            + ');\n'
+            for table, columns in SQLITE_SCHEMA.items()))
+        self.conn.commit()
+
+    def writer(self, table, columns, batch_size=DEFAULT_BATCH_SIZE, key_columns=None):
+        return SQLiteWriter(self.conn, table, columns, batch_size, key_columns)
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        self.conn.rollback()
+
+    def close(self):
+        self.conn.close()
+
+class NdjsonWriter:
+    """
+    Пишет строки одной таблицы в приёмник NDJSON: объект JSON на строку
+    с полем "table" и значениями столбцов. В режиме upsert идентификатор
+    заменяется на natural_id, чтобы потребитель мог сопоставить повторы.
+    """
+
+    def __init__(self, sink, table, columns, key_columns=None):
+        self.sink = sink
+        self.table = table
+        self.columns = list(columns)
+        self.key_indexes = [self.columns.index(column) for column in key_columns or []]
+
+    def add(self, row):
+        """Записывает строку в незафиксированную часть вывода. Возвращает 1"""
+        if self.key_indexes:
+            row = (natural_id(self.table, [row[i] for i in self.key_indexes]),) + tuple(row[1:])
+        record = {"table": self.table}
+        record.update(zip(self.columns, row))
+        self.sink.pending.write(json.dumps(record, ensure_ascii=False) + '\n')
+        return 1
+
+    def flush(self):
+        return 0
+
+    def discard(self):
+        pass
+
+class NdjsonSink(Sink):
+    """
+    Вывод строк в формате NDJSON (по умолчанию в stdout) для передачи
+    другим программам. Строки до фиксации копятся во временном файле
+    (первые NDJSON_SPOOL_SIZE байт - в памяти) и попадают в вывод только
+    при commit(), поэтому отменённые строки не выводятся.
+    """
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+        self.owns_stream = False
+        self.pending = self._spool()
+
+    @classmethod
+    def open(cls, path):
+        """Приёмник, пишущий в файл path (файл закрывается в close())"""
+        sink = cls(open(path, 'w', encoding='utf-8'))
+        sink.owns_stream = True
+        return sink
+
+    @staticmethod
+    def _spool():
+        return tempfile.SpooledTemporaryFile(max_size=NDJSON_SPOOL_SIZE, mode='w+',
+                                             encoding='utf-8')
+
+    def writer(self, table, columns, batch_size=DEFAULT_BATCH_SIZE, key_columns=None):
+        return NdjsonWriter(self, table, columns, key_columns)
+
+    def commit(self):
+        self.pending.seek(0)
+        shutil.copyfileobj(self.pending, self.stream)
+        self.stream.flush()
+        self.pending.close()
+        self.pending = self._spool()
+
+    def rollback(self):
+        self.pending.close()
+        self.pending = self._spool()
+
+    def close(self):
+        self.pending.close()
+        if self.owns_stream:
+            self.stream.close()
+
+def create_sink(spec):
+    """
+    Приёмник по описанию из командной строки:
+    "postgres" - None (подключение к PostgreSQL по db_config),
+    "sqlite:ФАЙЛ" - SQLiteSink, "ndjson" - NdjsonSink в stdout, "ndjson:ФАЙЛ" - в файл.
+    """
+    kind, _, target = spec.partition(':')
+    if kind == "postgres" and not target:
+        return None
+    if kind == "sqlite" and target:
+        return SQLiteSink(target)
+    if kind == "ndjson":
+        return NdjsonSink.open(target) if target else NdjsonSink()
+    raise ValueError(f"Неизвестный приёмник: {spec} (ожидается postgres, sqlite:ФАЙЛ, ndjson или ndjson:ФАЙЛ)")
+
+def cache_target(sink, db_params):
+    """
+    Описание приёмника для кэша результатов (result_cache.ResultCache): документ,
+    записанный в одну базу, не считается записанным в другую. Для NDJSON - None:
+    поток не хранит записанное, поэтому документы выводятся при каждом запуске.
+    """
+    if sink is None or isinstance(sink, PostgresSink):
+        return (f"postgres://{db_params.get('user', '')}@{db_params.get('host', '')}:"
+                f"{db_params.get('port', '')}/{db_params.get('database', '')}")
+    if isinstance(sink, SQLiteSink):
+        return f"sqlite:{os.path.abspath(sink.path)}"
+    return None
+
+@contextmanager
+def sink_session(db_params=None, conn=None, sessions=None, sink=None):
+    """
+    Приёмник для одного документа. Переданный sink используется как есть
+    и остаётся открытым; иначе строки пишутся в PostgreSQL через подключение
+    из db_session(db_params, conn, sessions).
+    """
+    if sink is not None:
+        yield sink
+        return
+
+    with db_session(db_params, conn, sessions) as conn:
+        yield PostgresSink(conn)
+
+def log_to_stderr():
+    """
+    Переводит логи парсеров (logging.basicConfig со stdout) на stderr:
+    stdout остаётся только для данных (событий сервиса или строк NDJSON)
+    """
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, logging.StreamHandler) and handler.stream is sys.stdout:
+            handler.setStream(sys.stderr)
+
+@contextmanager
+def console_output(sink):
+    """
+    Если приёмник выводит NDJSON в stdout, сообщения программы (print и логи)
+    на время работы переводятся в stderr, чтобы не смешиваться с данными
+    """
+    if not (isinstance(sink, NdjsonSink) and sink.stream is sys.stdout):
+        yield
+        return
+
+    log_to_stderr()
+    with redirect_stdout(sys.stderr):
+        yield
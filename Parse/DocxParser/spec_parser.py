@@ -1,13 +1,16 @@
-from docx import Document
 import os
 import re
 import sys
 import traceback
-import psycopg2
 import uuid
 import logging
-import pandas as pd
-import numpy as np
+from db_config import load_db_params
+from docx_tables import iter_tables, open_archive, source_name
+from text_normalize import normalize_cell_text, parse_float
+from column_merge import collapse_columns
+from columnar_export import ColumnarExport
+from parse_options import DEFAULT_OPTIONS
+from metrics import DocumentMetrics
 
 # Настройка логирования
 logging.basicConfig(
@@ -19,6 +22,24 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Столбцы таблицы Equipment в порядке записи
+EQUIPMENT_COLUMNS = [
+    "ID_equipment",
+    "Equipment_identification",
+    "Name_equipment",
+    "Type_equipment",
+    "Code_product",
+    "Supplier",
+    "Units1",
+    "Units2",
+    "Quantity1",
+    "Quantity2",
+    "Unit_mass",
+    "Note"
+]
+# Естественный ключ для режима upsert
+EQUIPMENT_NATURAL_KEY = ["Equipment_identification", "Name_equipment"]
+
 def clean_filename(name):
     """Удаляет запрещенные символы из имени файла"""
     if not name:
@@ -32,211 +53,217 @@ def is_number(s):
     """Проверяет, можно ли преобразовать строку в число (целое или дробное)"""
     if not s:
         return False
-    try:
-        s_clean = s.replace(',', '.').replace(' ', '')
-        float(s_clean)
-        return True
-    except ValueError:
-        return False
+    return parse_float(s.replace(' ', '')) is not None
 
-def parse_docx_to_postgres(docx_path, db_params):
-    """Основная функция для обработки DOCX файла и записи в PostgreSQL"""
-    try:
-        conn = psycopg2.connect(**db_params)
-        cursor = conn.cursor()
-        logger.info("Успешное подключение к базе данных PostgreSQL!")
-    except Exception as e:
-        logger.error(f"Ошибка подключения к PostgreSQL: {str(e)}")
-        raise
+def equipment_skip_reason(row_data):
+    """Причина пропуска строки спецификации (без первого столбца) или None"""
+    # Позиция оборудования содержит не меньше двух точек
+    if row_data[0].count('.') < 2:
+        return "no_identification"
+    if len(set(row_data)) == 1:
+        return "separator"
+    return None
+
+def map_equipment_row(row_data):
+    """
+    Формирует строку таблицы Equipment (EQUIPMENT_COLUMNS) из строки спецификации
+    без первого столбца. Возвращает None для заголовков и разделителей.
+    """
+    if equipment_skip_reason(row_data) is not None:
+        return None
+
+    padded_row = (row_data + [''] * 9)[:9]
     
+    # Генерируем UUID для оборудования
+    equipment_id = str(uuid.uuid4())
+    
+    # Определяем значения для Type_equipment и Code_product
+    type_equipment = padded_row[2] or None
+    code_product = padded_row[3] or None
+    supplier = (padded_row[4] or '').strip().lower()
+    
+    # Специальная обработка для производителя "Фенсис"
+    if 'фенсис' in supplier:
+        if type_equipment and is_number(type_equipment) and not code_product:
+            code_product = type_equipment
+            type_equipment = None
+    
+    # Обработка количеств
+    quantity_str = padded_row[6].replace(',', '.')
+    if '/' in quantity_str:
+        quantity_parts = quantity_str.split('/')
+        quantity1 = quantity_parts[0]
+        quantity2 = quantity_parts[1] if len(quantity_parts) > 1 else None
+    else:
+        quantity1 = quantity_str
+        quantity2 = None
+    
+    # Преобразование числовых полей
+    quantity1 = parse_float(quantity1) if quantity1 else None
+    quantity2 = parse_float(quantity2) if quantity2 else None
+    unit_mass = parse_float(padded_row[7]) if padded_row[7].strip() else None
+
+    # Капитализация поставщика
+    if padded_row[4] and padded_row[4] == padded_row[4].lower():
+        padded_row[4] = padded_row[4].capitalize()
+
+    # Обработка единиц измерения
+    units = padded_row[5] or ''
+    if '/' in units:
+        units_parts = units.split('/')
+        units1 = units_parts[0]
+        units2 = units_parts[1] if len(units_parts) > 1 else None
+    else:
+        units1 = units
+        units2 = None
+
+    # Строка для записи в Equipment
+    return (
+        equipment_id,
+        padded_row[0] or None,
+        padded_row[1] or None,
+        type_equipment,
+        code_product,
+        padded_row[4] or None,
+        units1,
+        units2,
+        quantity1,
+        quantity2,
+        unit_mass,
+        padded_row[8] or None
+    )
+
+def iter_equipment_rows(data, metrics=None):
+    """
+    Выдаёт строки для записи в Equipment из таблицы спецификации.
+    В metrics (DocumentMetrics) учитываются таблица, её строки, время
+    схлопывания столбцов и сопоставления и причины пропуска строк.
+    """
+    if metrics is None:
+        metrics = DocumentMetrics()
+    metrics.count("tables")
+    metrics.count("rows_read", len(data))
+    with metrics.stage("collapse"):
+        rows = collapse_columns(data)
+
+    for row in rows:
+        with metrics.stage("map"):
+            reason = equipment_skip_reason(row[1:])
+            if reason is None:
+                equipment = map_equipment_row(row[1:])
+                metrics.count("rows_mapped")
+            else:
+                metrics.skip(reason)
+        if reason is None:
+            yield equipment
+
+def extract_equipment_rows(docx_path, progress=None):
+    """
+    Разбирает спецификацию без записи в базу.
+    Возвращает строки в виде {(таблица, столбцы): [строки, ...]}.
+    progress(количество таблиц, количество строк) вызывается после каждой таблицы.
+    """
+    rows = []
+    for table_idx, data in enumerate(iter_tables(docx_path, normalize=normalize_cell_text)):
+        rows.extend(iter_equipment_rows(data))
+        if progress:
+            progress(table_idx + 1, len(rows))
+    return {("Equipment", tuple(EQUIPMENT_COLUMNS)): rows} if rows else {}
+
+def parse_docx_to_postgres(docx_path, db_params, collected=None, upsert=False,
+                           options=DEFAULT_OPTIONS):
+    """
+    Основная функция для обработки DOCX файла и записи в PostgreSQL.
+    docx_path - путь к файлу или открытый zipfile.ZipFile, options (ParseOptions) -
+    подключение или приёмник, выгрузка и замеры. Изменения фиксируются после
+    каждой таблицы; в collected (если передан) добавляются зафиксированные строки,
+    в режиме upsert строки пишутся по EQUIPMENT_NATURAL_KEY.
+    """
+    metrics = options.metrics
+    if metrics is None:
+        metrics = DocumentMetrics(source_name(docx_path), "СО")
+    batch_size = options.batch_size
     try:
-        doc = Document(docx_path)
-        logger.info(f"Файл {docx_path} успешно открыт")
+        with metrics.stage("open"):
+            docx_zip = open_archive(docx_path)
+        metrics.measure_document(docx_zip)
+        logger.info(f"Файл {source_name(docx_path)} успешно открыт")
     except Exception as e:
-        conn.close()
         logger.error(f"Ошибка открытия DOCX файла: {str(e)}")
         raise
 
-    # Создаем список всех таблиц в виде DataFrame
-    tables = []
-    for table in doc.tables:
-        data = []
-        for row in table.rows:
-            current_row = []
-            for cell in row.cells:
-                text = cell.text.strip()
-                text = re.sub(r'\s+', ' ', text)
-                text = text.replace(" ,", ",")
-                current_row.append(text)
-            data.append(current_row)
-        df_table = pd.DataFrame(data)
-        tables.append(df_table)
-
-    total_inserted = 0
-
-    # Обрабатываем каждую таблицу
-    for table_idx, df in enumerate(tables):
-        logger.info(f"Обработка таблицы {table_idx+1}")
-        
-        # Функция для вычисления схожести столбцов
-        def calculate_similarity(col1, col2):
-            mask = (~df[col1].isna()) & (~df[col2].isna())
-            if mask.sum() == 0:
-                return 0
-            matches = (df.loc[mask, col1] == df.loc[mask, col2]).sum()
-            total = mask.sum()
-            return (matches / total) * 100
-
-        # Находим группы схожих столбцов
-        groups = []
-        current_group = [df.columns[0]]
-        for i in range(1, len(df.columns)):
-            similarity = calculate_similarity(df.columns[i-1], df.columns[i])
-            if similarity > 80:
-                current_group.append(df.columns[i])
-            else:
-                groups.append(current_group)
-                current_group = [df.columns[i]]
-        groups.append(current_group)
-
-        # Формируем очищенный DataFrame
-        columns_to_keep = []
-        for group in groups:
-            columns_to_keep.append(group[0])
-        df_cleaned = df[columns_to_keep].copy()
-
-        # Заменяем NaN на пустые строки
-        df_cleaned = df_cleaned.fillna('')
-
-        # Проходим по всем строкам таблицы
-        try:
-            inserted_count = 0
-            for idx, row in df_cleaned.iterrows():
-                row_data = row.tolist()[1:]
-                # Пропускаем строки, где второй столбец содержит менее двух точек
-                if row_data[0].count('.') < 2 or len(set(row_data)) == 1:
-                    continue
-
-                # print(row_data)
-                
-                padded_row = (row_data + [''] * 9)[:9]
-                
-                # Генерируем UUID для оборудования
-                equipment_id = str(uuid.uuid4())
-                
-                # Определяем значения для Type_equipment и Code_product
-                type_equipment = padded_row[2] or None
-                code_product = padded_row[3] or None
-                supplier = (padded_row[4] or '').strip().lower()
-                
-                # Специальная обработка для производителя "Фенсис"
-                if 'фенсис' in supplier:
-                    if type_equipment and is_number(type_equipment) and not code_product:
-                        code_product = type_equipment
-                        type_equipment = None
-                
-                # Обработка количеств
-                quantity_str = padded_row[6].replace(',', '.')
-                if '/' in quantity_str:
-                    quantity_parts = quantity_str.split('/')
-                    quantity1 = quantity_parts[0]
-                    quantity2 = quantity_parts[1] if len(quantity_parts) > 1 else None
-                else:
-                    quantity1 = quantity_str
-                    quantity2 = None
-                
-                # Преобразование числовых полей
-                try:
-                    quantity1 = float(quantity1) if quantity1 else None
-                except:
-                    quantity1 = None
-                try:
-                    quantity2 = float(quantity2) if quantity2 else None
-                except:
-                    quantity2 = None
-                    
+    try:
+        if options.export_dir:
+            with ColumnarExport(options.export_dir, docx_path, options.export_format,
+                                batch_size) as export:
+                for data in metrics.timed("read", iter_tables(docx_zip, normalize=normalize_cell_text)):
+                    for row in iter_equipment_rows(data, metrics):
+                        with metrics.stage("write"):
+                            export.add("Equipment", EQUIPMENT_COLUMNS, row)
+            metrics.count("rows_written", export.count)
+            logger.info(f"Выгрузка завершена. Выгружено записей: {export.count}")
+            metrics.log(logger)
+            return export.count
+
+        with options.session(db_params) as sink:
+            sink = metrics.sink(sink)
+            total_inserted = 0
+            failed_tables = []
+            writer = sink.writer("Equipment", EQUIPMENT_COLUMNS, batch_size,
+                                 EQUIPMENT_NATURAL_KEY if upsert else None)
+
+            # Таблицы читаются из word/document.xml по одной: в памяти держится
+            # только текущая таблица, а её строки уходят в базу пачками
+            tables = metrics.timed("read", iter_tables(docx_zip, normalize=normalize_cell_text))
+            for table_idx, data in enumerate(tables):
+                logger.info(f"Обработка таблицы {table_idx+1}")
+
+                # Проходим по всем строкам таблицы
                 try:
-                    unit_mass = float(padded_row[7].replace(',', '.')) if padded_row[7].strip() else None
-                except:
-                    unit_mass = None
-
-                # Капитализация поставщика
-                if padded_row[4] and padded_row[4] == padded_row[4].lower():
-                    padded_row[4] = padded_row[4].capitalize()
-
-                # Обработка единиц измерения
-                units = padded_row[5] or ''
-                if '/' in units:
-                    units_parts = units.split('/')
-                    units1 = units_parts[0]
-                    units2 = units_parts[1] if len(units_parts) > 1 else None
-                else:
-                    units1 = units
-                    units2 = None
-
-                # Формируем запрос
-                insert_query = '''
-                INSERT INTO "Equipment" (
-                    "ID_equipment",
-                    "Equipment_identification",
-                    "Name_equipment",
-                    "Type_equipment",
-                    "Code_product",
-                    "Supplier",
-                    "Units1",
-                    "Units2",
-                    "Quantity1",
-                    "Quantity2",
-                    "Unit_mass",
-                    "Note"
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                '''
-                
-                # Параметры для запроса
-                data = (
-                    equipment_id,
-                    padded_row[0] or None,
-                    padded_row[1] or None,
-                    type_equipment,
-                    code_product,
-                    padded_row[4] or None,
-                    units1,
-                    units2,
-                    quantity1,
-                    quantity2,
-                    unit_mass,
-                    padded_row[8] or None
-                )
-                
-                # Выполняем запрос
-                cursor.execute(insert_query, data)
-                inserted_count += 1
+                    inserted_count = 0
+                    table_rows = []
+                    for equipment in iter_equipment_rows(data, metrics):
+                        # Добавляем строку в пакет
+                        inserted_count += writer.add(equipment)
+                        if collected is not None:
+                            table_rows.append(equipment)
             
-            # Фиксируем изменения для таблицы
-            conn.commit()
-            total_inserted += inserted_count
-            logger.info(f"Таблица {table_idx+1}: добавлено {inserted_count} записей")
+                    # Отправляем остаток пакета и фиксируем изменения для таблицы
+                    inserted_count += writer.flush()
+                    sink.commit()
+                    total_inserted += inserted_count
+                    if collected is not None and table_rows:
+                        collected.setdefault(("Equipment", tuple(EQUIPMENT_COLUMNS)), []).extend(table_rows)
+                    logger.info(f"Таблица {table_idx+1}: добавлено {inserted_count} записей")
             
-        except Exception as e:
-            logger.error(f"Ошибка при обработке таблицы {table_idx+1}: {str(e)}")
-            conn.rollback()
-            traceback.print_exc()
-                
-    cursor.close()
-    conn.close()
+                except Exception as e:
+                    logger.error(f"Ошибка при обработке таблицы {table_idx+1}: {str(e)}")
+                    writer.discard()
+                    sink.rollback()
+                    traceback.print_exc()
+                    failed_tables.append(table_idx + 1)
+
+            # Остальные таблицы зафиксированы, но документ записан не целиком:
+            # вызывающий код не должен считать его обработанным (например, кэшировать)
+            if failed_tables:
+                raise RuntimeError(f"не записаны таблицы {', '.join(map(str, failed_tables))}, "
+                                   f"остальные зафиксированы ({total_inserted} записей)")
+    except Exception as e:
+        metrics.error = str(e)
+        metrics.log(logger)
+        raise
+    finally:
+        if docx_zip is not docx_path:
+            docx_zip.close()
+
     logger.info(f"Обработка завершена. Всего добавлено записей: {total_inserted}")
+    metrics.log(logger)
     return total_inserted
 
 if __name__ == "__main__":
     docx_file_path = sys.argv[1]
     
-    db_params = {
-        "host": "localhost",
-        "port": "5432",
-        "database": "cable_db",
-        "user": "postgres",
-        "password": "test1"
-    }
+    db_params = load_db_params()
     
     logger.info(f"Начата обработка файла: {docx_file_path}")
     
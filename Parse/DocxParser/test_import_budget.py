@@ -0,0 +1,14 @@
+import pytest
+
+from import_budget import IMPORT_BUDGET_MS, check_module
+
+# Запусков на модуль: время берётся минимальное, чтобы проверка не срабатывала от шума
+RUNS = 3
+
+@pytest.mark.parametrize("module", sorted(IMPORT_BUDGET_MS))
+def test_import_budget(module):
+    """Точка входа импортируется в отдельном интерпретаторе быстрее бюджета и без тяжёлых модулей"""
+    budget_ms = IMPORT_BUDGET_MS[module]
+    best, heavy, ok = check_module(module, budget_ms, RUNS)
+    assert not heavy, f"{module} импортирует тяжёлые модули: {', '.join(heavy)}"
+    assert ok, f"{module}: {best:.1f} мс при бюджете {budget_ms} мс"
@@ -0,0 +1,47 @@
+import re
+from functools import lru_cache
+
+# Пробельные последовательности внутри текста ячейки
+WHITESPACE_RE = re.compile(r'\s+')
+# Первое число в тексте длины (после удаления пробелов и замены запятой на точку)
+LENGTH_RE = re.compile(r'(\d+\.?\d*)')
+
+# Размер кэша разобранных чисел. Длины, количества и массы в журналах
+# и спецификациях сильно повторяются, поэтому кэш почти всегда попадает
+NUMBER_CACHE_SIZE = 4096
+
+def clean_cell_text(text):
+    """
+    Обрезает пробелы по краям и схлопывает пробельные последовательности.
+    Все пробельные символы, кроме обычного пробела, непечатаемые, поэтому
+    печатаемый текст без двойных пробелов достаточно обрезать - без регулярного выражения.
+    """
+    if text.isprintable() and '  ' not in text:
+        return text.strip()
+    return WHITESPACE_RE.sub(' ', text.strip())
+
+def normalize_cell_text(text):
+    """Очищает текст ячейки и убирает пробел перед запятой (СО и ВР)"""
+    return clean_cell_text(text).replace(" ,", ",")
+
+@lru_cache(maxsize=NUMBER_CACHE_SIZE)
+def parse_float(text):
+    """Число с запятой или точкой в качестве разделителя; None, если текст не число"""
+    try:
+        return float(text.replace(',', '.'))
+    except ValueError:
+        return None
+
+@lru_cache(maxsize=NUMBER_CACHE_SIZE)
+def extract_length(text):
+    """Извлекает числовое значение длины из текста (первое число без учёта пробелов)"""
+    if not text:
+        return None
+
+    match = LENGTH_RE.search(text.replace(' ', '').replace(',', '.'))
+    if match:
+        try:
+            return float(match.group(1))
+        except ValueError:
+            return None
+    return None
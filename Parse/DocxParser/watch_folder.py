@@ -0,0 +1,395 @@
+import os
+import sys
+import time
+import errno
+import select
+import signal
+import struct
+import zipfile
+import argparse
+
+from find_files import find_document_type, is_docx_candidate
+from result_cache import ResultCache
+
+# Сколько секунд размер и время изменения файла должны оставаться прежними,
+# прежде чем он считается скопированным полностью
+DEFAULT_SETTLE_SECONDS = 2.0
+# Период опроса папок, если inotify недоступен (Windows, сетевые папки)
+DEFAULT_POLL_INTERVAL = 1.0
+# Через сколько секунд повторить документ, запись которого не удалась
+RETRY_SECONDS = 30.0
+# Файл, который так и не стал корректным архивом за это время, перестаёт ожидаться
+MAX_WAIT_SECONDS = 600.0
+
+DEFAULT_CACHE_PATH = "watch_cache.sqlite"
+
+# События inotify (см. inotify(7))
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+EVENT_HEADER = struct.Struct('iIII')
+
+def is_kniga_folder(path):
+    return os.path.basename(path.rstrip('/\\')).startswith("Книга")
+
+class InotifyWatcher:
+    """
+    Изменения в папках через inotify (Linux), без сторонних библиотек.
+    changes() возвращает пути изменённых файлов и подпапок; при переполнении
+    очереди событий - сами отслеживаемые папки, чтобы их пересканировать.
+    """
+
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+
+        self.ctypes = ctypes
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        # На системах без inotify функции нет: AttributeError, и используется опрос
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self.directories = {}
+
+    def add(self, directory):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            error = self.ctypes.get_errno()
+            raise OSError(error, os.strerror(error), directory)
+        self.directories[wd] = directory
+
+    def changes(self, timeout):
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return set()
+            raise
+
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b'\0')
+            offset += EVENT_HEADER.size + length
+            if mask & IN_Q_OVERFLOW:
+                changed.update(self.directories.values())
+                continue
+            directory = self.directories.get(wd)
+            if directory is not None and name:
+                changed.add(os.path.join(directory, os.fsdecode(name)))
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+class PollingWatcher:
+    """
+    Изменения в папках опросом: раз в interval секунд содержимое папок
+    сравнивается с предыдущим снимком (размер и время изменения записей)
+    """
+
+    def __init__(self, interval=DEFAULT_POLL_INTERVAL):
+        self.interval = interval
+        self.snapshots = {}
+
+    @staticmethod
+    def _snapshot(directory):
+        snapshot = {}
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    snapshot[entry.name] = (entry.is_dir(), stat.st_size, stat.st_mtime_ns)
+        except FileNotFoundError:
+            pass
+        return snapshot
+
+    def add(self, directory):
+        if directory not in self.snapshots:
+            self.snapshots[directory] = self._snapshot(directory)
+
+    def changes(self, timeout):
+        time.sleep(min(timeout, self.interval))
+        changed = set()
+        for directory, previous in list(self.snapshots.items()):
+            current = self._snapshot(directory)
+            changed.update(os.path.join(directory, name) for name, signature in current.items()
+                           if previous.get(name) != signature)
+            self.snapshots[directory] = current
+        return changed
+
+    def close(self):
+        pass
+
+def create_watcher(polling=False, interval=DEFAULT_POLL_INTERVAL):
+    """inotify, если он доступен и не запрошен опрос, иначе PollingWatcher"""
+    if not polling:
+        try:
+            return InotifyWatcher()
+        except (AttributeError, OSError) as e:
+            print(f"inotify недоступен ({e}), папки будут опрашиваться каждые {interval} с")
+    return PollingWatcher(interval)
+
+def file_signature(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+class WatchDaemon:
+    """
+    Следит за папкой проекта (папки "Книга" на любой глубине) или одной папкой
+    "Книга" и загружает новые и изменённые документы КЖ/СО/ВР. Файл попадает
+    в обработку, когда его размер и время изменения не менялись settle секунд
+    и он открывается как ZIP - так недокопированные файлы не разбираются.
+    Тип каждого файла определяется как в find_files (по имени, затем по
+    содержимому), а неизменённые документы отсекаются кэшем результатов
+    по SHA-256, поэтому дерево целиком не пересканируется и не перезагружается.
+    """
+
+    def __init__(self, root, cache, watcher, db_params=None, settle=DEFAULT_SETTLE_SECONDS,
+                 diff=False, sink=None, report=None, metrics_path=None):
+        self.root = os.path.abspath(root)
+        self.cache = cache
+        self.watcher = watcher
+        self.db_params = db_params
+        self.settle = settle
+        self.diff = diff
+        self.sink = sink
+        self.report = report
+        self.metrics_path = metrics_path
+        self.watched = set()
+        # Путь файла -> (подпись, время последнего изменения, время появления)
+        self.pending = {}
+
+    def in_tree(self, directory):
+        """
+        Входит ли папка в наблюдаемое дерево: как в find_files, папка "Книга"
+        наблюдается одна, а в папке проекта - все подпапки на любой глубине
+        """
+        if is_kniga_folder(self.root):
+            return directory == self.root
+        return directory == self.root or directory.startswith(os.path.join(self.root, ''))
+
+    def kniga_folder(self, path):
+        """Папка "Книга", в которой лежит файл, или None, если файл вне них"""
+        folder = os.path.dirname(path)
+        if is_kniga_folder(folder) and self.in_tree(folder):
+            return folder
+        return None
+
+    def enqueue(self, path, now=None, delay=0.0):
+        now = time.monotonic() if now is None else now
+        try:
+            signature = file_signature(path)
+        except FileNotFoundError:
+            self.pending.pop(path, None)
+            return
+        previous = self.pending.get(path)
+        first_seen = previous[2] if previous else now
+        self.pending[path] = (signature, now + delay, first_seen)
+
+    def watch(self, directory):
+        """Начинает следить за папкой; False, если это не удалось"""
+        if directory not in self.watched:
+            try:
+                self.watcher.add(directory)
+            except OSError as e:
+                print(f"Не удалось следить за папкой {directory}: {e}")
+                return False
+            self.watched.add(directory)
+        return True
+
+    def scan(self, directory, now=None):
+        """
+        Начинает следить за папкой и её подпапками (тем же обходом, что и
+        find_kniga_folders) и ставит в очередь документы найденных папок "Книга".
+        Промежуточные папки тоже наблюдаются, чтобы заметить новые папки "Книга"
+        на любой глубине.
+        """
+        from document_manifest import walk_tree
+
+        for folder, files in walk_tree(directory):
+            if not self.in_tree(folder) or not self.watch(folder) or not is_kniga_folder(folder):
+                continue
+            for scanned in files:
+                self.enqueue(scanned.path, now)
+
+    def rescan(self, directory, now=None):
+        """
+        Повторно просматривает уже наблюдаемую папку без обхода поддерева:
+        новые подпапки сканируются целиком, документы папки "Книга" ставятся в очередь
+        """
+        try:
+            entries = list(os.scandir(directory))
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if entry.path not in self.watched and self.in_tree(entry.path):
+                    self.scan(entry.path, now)
+            elif is_kniga_folder(directory) and is_docx_candidate(entry.name):
+                self.enqueue(entry.path, now)
+
+    def handle_change(self, path, now):
+        if os.path.isdir(path) and not os.path.islink(path):
+            if path in self.watched:
+                self.rescan(path, now)
+            elif self.in_tree(path):
+                self.scan(path, now)
+        elif is_docx_candidate(os.path.basename(path)) and self.kniga_folder(path):
+            self.enqueue(path, now)
+
+    def ready_files(self, now):
+        """Файлы из очереди, которые перестали меняться и являются корректными архивами"""
+        ready = []
+        for path, (signature, changed_at, first_seen) in list(self.pending.items()):
+            try:
+                current = file_signature(path)
+            except FileNotFoundError:
+                del self.pending[path]
+                continue
+            if current != signature:
+                self.pending[path] = (current, now, first_seen)
+                continue
+            if now - changed_at < self.settle:
+                continue
+            if not zipfile.is_zipfile(path):
+                # Копирование ещё идёт или файл повреждён
+                if now - first_seen > MAX_WAIT_SECONDS:
+                    print(f"Файл {path} не является документом DOCX, пропускаем")
+                    del self.pending[path]
+                continue
+            del self.pending[path]
+            ready.append(path)
+        return ready
+
+    def next_timeout(self, now, interval):
+        """Сколько ждать событий: до ближайшей проверки файла из очереди, но не дольше interval"""
+        if not self.pending:
+            return interval
+        due = min(changed_at + self.settle for _, changed_at, _ in self.pending.values())
+        return max(0.05, min(interval, due - now))
+
+    def ingest(self, paths):
+        """
+        Загружает появившиеся и изменившиеся файлы. Каждый файл загружается сам по себе,
+        а не выбором документов папки: второй документ того же типа в папке "Книга"
+        тоже загружается. Файлы, тип которых не определён, пропускаются с сообщением.
+        """
+        from batch_runner import run_documents
+
+        documents = []
+        for path in sorted(paths):
+            try:
+                doc_type = find_document_type(path, self.cache)
+            except Exception as e:
+                print(f"Ошибка при анализе файла {path}: {e}")
+                continue
+            if doc_type is None:
+                print(f"Тип документа не определён, пропускаем: {path}")
+            else:
+                documents.append((doc_type, path))
+        if not documents:
+            return
+
+        print(f"Новые и изменённые документы: {', '.join(path for _, path in documents)}")
+        try:
+            failed = run_documents(documents, self.db_params, self.cache, upsert=not self.diff,
+                                   diff=self.diff, sink=self.sink, report=self.report)
+        except Exception as e:
+            # Например, база недоступна: повторяем все файлы позже
+            print(f"Ошибка при загрузке: {e}")
+            failed = paths
+
+        now = time.monotonic()
+        for path in failed:
+            self.enqueue(path, now, RETRY_SECONDS)
+        if failed:
+            print(f"Не удалось обработать файлов: {len(failed)}, повтор через {RETRY_SECONDS:.0f} с")
+        if self.report is not None and self.metrics_path:
+            self.report.write(self.metrics_path)
+
+    def run(self, interval=DEFAULT_POLL_INTERVAL):
+        """Основной цикл; прерывается KeyboardInterrupt (Ctrl+C, SIGTERM)"""
+        self.scan(self.root)
+        print(f"Наблюдение за {self.root}, папок: {len(self.watched)}")
+        while True:
+            now = time.monotonic()
+            for path in self.watcher.changes(self.next_timeout(now, interval)):
+                self.handle_change(path, time.monotonic())
+            ready = self.ready_files(time.monotonic())
+            if ready:
+                self.ingest(ready)
+
+def _stop(signum, frame):
+    raise KeyboardInterrupt
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Наблюдение за папкой проекта и загрузка новых и изменённых документов КЖ/СО/ВР")
+    parser.add_argument("path", help="путь к папке проекта или к папке \"Книга\"")
+    parser.add_argument("--cache", metavar="FILE", default=DEFAULT_CACHE_PATH,
+                        help=f"файл кэша результатов (по умолчанию {DEFAULT_CACHE_PATH})")
+    parser.add_argument("--settle", type=float, default=DEFAULT_SETTLE_SECONDS,
+                        help=f"сколько секунд файл не должен меняться перед разбором (по умолчанию {DEFAULT_SETTLE_SECONDS})")
+    parser.add_argument("--interval", type=float, default=DEFAULT_POLL_INTERVAL,
+                        help=f"период опроса папок без inotify, с (по умолчанию {DEFAULT_POLL_INTERVAL})")
+    parser.add_argument("--polling", action="store_true",
+                        help="опрашивать папки вместо inotify (например, для сетевых папок)")
+    parser.add_argument("--diff", action="store_true",
+                        help="применять только изменения документа вместо upsert по естественным ключам")
+    parser.add_argument("--sink", default="postgres",
+                        help="куда писать строки: postgres (по умолчанию), sqlite:ФАЙЛ, ndjson (stdout) или ndjson:ФАЙЛ")
+    parser.add_argument("--metrics", metavar="FILE",
+                        help="обновлять файл метрик после каждой загрузки: *.prom - Prometheus, иначе JSON")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.path):
+        print("Указанный путь не существует или не является папкой")
+        sys.exit(1)
+
+    from batch_runner import DB_PARAMS
+    from sinks import cache_target, console_output, create_sink
+    from metrics import MetricsReport
+
+    try:
+        sink = create_sink(args.sink)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+    if sink is not None and args.diff:
+        print("--diff работает только с PostgreSQL")
+        sys.exit(1)
+
+    signal.signal(signal.SIGTERM, _stop)
+    cache = ResultCache(args.cache, cache_target(sink, DB_PARAMS))
+    watcher = create_watcher(args.polling, args.interval)
+    daemon = WatchDaemon(args.path, cache, watcher, DB_PARAMS, args.settle, args.diff, sink,
+                         MetricsReport() if args.metrics else None, args.metrics)
+    try:
+        with console_output(sink):
+            daemon.run(args.interval)
+    except KeyboardInterrupt:
+        print("Наблюдение остановлено")
+    finally:
+        watcher.close()
+        cache.close()
+        if sink is not None:
+            sink.close()
+
+if __name__ == "__main__":
+    main()